@@ -18,17 +18,68 @@ assert os.path.exists(THIS_PACKAGE_DIR), \
 # (probably need to put it in some findable location using setuptools...)
 # (i'm just going to try 'python -m <...>' syntax for running scripts for now)
 
-from .util import generate_protobuf_outputs
+# Only the standard library is imported here, so this happens before anything imports
+# olf_pb2.
+from ._protogen import ensure_generated
 
 # The build process handles this in the Docker case. If the code would changes
 # (which can only happen through a build) it would trigger protoc compilation as
 # part of the build.
+# Outside Docker, olf_pb2.py is generated when the package is built (see setup.py), so
+# this normally just hashes olf.proto and compares it to the hash recorded in olf_pb2.py.
+# protoc is only run if they differ (e.g. olf.proto edited in an editable install).
 if not IN_DOCKER:
-    generate_protobuf_outputs()
+    ensure_generated(THIS_PACKAGE_DIR)
 
 # Because we don't want to expose these under `olfactometer` package.
-del os, generate_protobuf_outputs
+del os, ensure_generated
 
-from .config_io import load
-from .olf import write_message, main
-from .cli_entry_points import *
+# Public names defined in submodules -> the submodule. Each submodule is only imported
+# when one of its names is first accessed (see `__getattr__`), so that e.g. CLI entry
+# points (`olfactometer:<name>_cli`, in setup.py) only import what they use.
+_name2submodule = {
+    'load': 'config_io',
+    'write_message': 'olf',
+    'main': 'olf',
+}
+_name2submodule.update({name: 'cli_entry_points' for name in (
+    'main_cli',
+    'get_last_attempted_cli',
+    'retry_last_attempted_cli',
+    'valve_test_cli',
+    'one_valve_cli',
+    'flush_cli',
+    'mfc_response_cli',
+    'upload_cli',
+    'print_config_time_cli',
+    'show_pins2odors_cli',
+    'export_cli',
+    'version_str',
+)})
+
+from importlib import import_module as _import_module
+
+def __getattr__(name):
+    try:
+        submodule = _name2submodule[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}'
+            ) from None
+
+    value = getattr(_import_module(f'{__name__}.{submodule}'), name)
+    # So this is only called on first access.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_name2submodule))
+
+
+# Module level __getattr__ requires python>=3.7 (the Docker image is still on 3.6).
+import sys
+if sys.version_info < (3, 7):
+    for _name in _name2submodule:
+        __getattr__(_name)
+    del _name
+del sys
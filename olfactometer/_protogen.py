@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Generates olf_pb2.py from olf.proto, and checks whether an existing olf_pb2.py is
+out of date.
+
+Only uses the standard library, so that setup.py (at build time) and the Dockerfile can
+run it without importing the rest of the package. Run directly to (re)generate.
+"""
+
+import hashlib
+import os
+from os.path import join, split, exists, abspath
+import shutil
+import subprocess
+import sys
+from typing import Optional
+
+
+proto_fname = 'olf.proto'
+generated_fname = 'olf_pb2.py'
+
+# Appended to the generated module, so we can tell which olf.proto it was generated
+# from without running protoc (or importing the generated module).
+proto_hash_var = 'OLF_PROTO_SHA256'
+_proto_hash_prefix = f"{proto_hash_var} = '"
+
+
+def proto_sha256(package_dir: str) -> str:
+    with open(join(package_dir, proto_fname), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def generated_proto_sha256(package_dir: str) -> Optional[str]:
+    """Returns hash of olf.proto that olf_pb2.py was generated from, if it was recorded.
+    """
+    generated_path = join(package_dir, generated_fname)
+    if not exists(generated_path):
+        return None
+
+    with open(generated_path, 'r') as f:
+        for line in f:
+            if line.startswith(_proto_hash_prefix):
+                return line[len(_proto_hash_prefix):].rstrip().rstrip("'")
+
+    return None
+
+
+def is_stale(package_dir: str) -> bool:
+    """Returns whether olf_pb2.py is missing or was generated from another olf.proto.
+    """
+    return generated_proto_sha256(package_dir) != proto_sha256(package_dir)
+
+
+def _protoc_cmd():
+    if shutil.which('protoc') is not None:
+        return ['protoc']
+
+    # grpcio-tools (in install_requires) bundles protoc, for when it's not on PATH.
+    return [sys.executable, '-m', 'grpc_tools.protoc']
+
+
+def generate(package_dir: str) -> None:
+    """Runs protoc to (re)generate olf_pb2.py in package_dir, recording olf.proto hash.
+    """
+    proto_file = join(package_dir, proto_fname)
+    proto_path, _ = split(proto_file)
+    # Hashing before running protoc, so a change during generation is not missed.
+    sha256 = proto_sha256(package_dir)
+
+    p = subprocess.run(_protoc_cmd() + [f'--python_out={package_dir}',
+        f'--proto_path={proto_path}', proto_file
+    ])
+    if p.returncode:
+        raise RuntimeError(f'generating python code from {proto_file} failed')
+
+    # If interrupted before the hash is written, the next check will just find the
+    # output stale and regenerate it.
+    generated_path = join(package_dir, generated_fname)
+    with open(generated_path, 'r') as f:
+        generated = f.read()
+
+    temp_path = f'{generated_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(generated)
+        f.write(f'\n# Added by olfactometer/_protogen.py. Used to check whether '
+            f'{proto_fname} has changed.\n{_proto_hash_prefix}{sha256}\'\n'
+        )
+    os.replace(temp_path, generated_path)
+
+
+def ensure_generated(package_dir: str) -> bool:
+    """Generates olf_pb2.py only if it is stale. Returns whether it was generated.
+    """
+    if not is_stale(package_dir):
+        return False
+
+    generate(package_dir)
+    return True
+
+
+if __name__ == '__main__':
+    generate(split(abspath(__file__))[0])
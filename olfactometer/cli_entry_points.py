@@ -6,12 +6,10 @@ Every function in this file should be a CLI entrypoint (referenced in setup.py)
 
 import argparse
 
-import pyperclip
-
-from olfactometer import main, olf, config_io, util, _DEBUG
-from olfactometer.generators import common
-from olfactometer.upload import main as upload_main
-from olfactometer.upload import version_str as _version_str
+# Everything else is imported in the functions that use it, so that each command only
+# imports what it needs (e.g. `olf-lastrun` should not need to import protobuf, or
+# `olf-time` the serial / flow controller libraries).
+from olfactometer import util, _DEBUG
 
 
 def main_cli(config_path=None):
@@ -19,13 +17,15 @@ def main_cli(config_path=None):
     Args:
         config_path: None or path to config file to run
     """
+    from olfactometer.olf import main
+
     parser = util.argparse_run_args(config_path=True if config_path is None else False)
 
     parser.add_argument('-c', '--check-set-flows', action='store_true',
         default=False, help='query flow controllers after each change in '
-        'setpoints to see the change seems to have been applied. only for '
-        'debugging experiments involving flow controllers. does NOT check '
-        'ACHIEVED flow rates.'
+        'setpoints to see the change seems to have been applied. queries happen in '
+        'batches, in the background, so they do not delay changes. mismatches are '
+        'warned about. does NOT check ACHIEVED flow rates.'
     )
 
     if _DEBUG:
@@ -43,6 +43,8 @@ def main_cli(config_path=None):
             help='speeds up stimulus program by this factor to test faster'
         )
 
+    util.argparse_serial_load_arg(parser)
+
     # TODO maybe add arg to specify generated YAML w/ pins2odors to use?
     # (for subsequent generation of a subset of odors, for testing?)
     # or maybe just make some easier way of quickly doing an experiment (how to
@@ -59,6 +61,8 @@ def main_cli(config_path=None):
 
 
 def get_last_attempted_cli(copy=True, _return=False):
+    import pyperclip
+
     config_path, abs_config_path = util.get_last_attempted()
 
     print(f'Last attempted config: {config_path}', end='')
@@ -86,6 +90,10 @@ def retry_last_attempted_cli():
 
 
 def valve_test_cli():
+    from olfactometer import config_io
+    from olfactometer.olf import main
+    from olfactometer.generators import common
+
     parser = util.argparse_run_args(config_path=False)
 
     default_n_repeats = 3
@@ -235,6 +243,10 @@ def valve_test_cli():
 
 
 def one_valve_cli():
+    from olfactometer import config_io
+    from olfactometer.olf import main
+    from olfactometer.generators import common
+
     parser = util.argparse_run_args(config_path=False)
 
     # TODO check that it's among odor pins in hardware definition (i.e. also check it's
@@ -311,6 +323,10 @@ def one_valve_cli():
 
 # TODO try to refactor this + valve_test_cli + one_valve_cli to share a bit more code
 def flush_cli():
+    from olfactometer import config_io
+    from olfactometer.olf import main
+    from olfactometer.generators import common
+
     parser = util.argparse_run_args(config_path=False, wait_option=False)
 
     # seems to be about the max possible (given how long of a pin sequence will fit in
@@ -371,7 +387,87 @@ def flush_cli():
     )
 
 
+def mfc_response_cli():
+    from olfactometer import config_io, flow
+
+    parser = util.argparse_config_args(hardware=False)
+
+    parser.add_argument('-s', '--setpoints', type=str, help='setpoints (in mL/min, '
+        'comma separated) to step each flow controller between. default is all of the '
+        'distinct setpoints each controller uses in the config.'
+    )
+    default_duration_s = 5.0
+    parser.add_argument('-d', '--duration', type=float, default=default_duration_s,
+        help='seconds to sample flow after each step (default: '
+        f'{default_duration_s:.1f})'
+    )
+    parser.add_argument('-n', '--no-save', action='store_true', help='do not save '
+        'profiles (which are otherwise used to pick settling waits and flow change '
+        'lead times for subsequent runs)'
+    )
+    parser.add_argument('-v', '--verbose', action='store_true')
+
+    config_path, kwargs = util.parse_config_args(parser)
+
+    verbose = kwargs['verbose']
+    cli_setpoints = kwargs['setpoints']
+    if cli_setpoints is not None:
+        cli_setpoints = [float(x) for x in cli_setpoints.split(',')]
+
+    _, config_dict = config_io.load(config_path)
+    if flow.flow_setpoints_sequence_key not in config_dict:
+        raise ValueError(f'config must have {flow.flow_setpoints_sequence_key} to '
+            'know which flow controllers to characterize'
+        )
+
+    mfc_id2flow_controller, _ = flow.open_alicat_controllers(config_dict,
+        verbose=verbose
+    )
+
+    mfc_id2setpoints = dict()
+    for trial_setpoints in config_dict[flow.flow_setpoints_sequence_key]:
+        for one_controller_setpoint in trial_setpoints:
+            mfc_id = one_controller_setpoint.get('address',
+                one_controller_setpoint.get('port')
+            )
+            mfc_id2setpoints.setdefault(mfc_id, set()).add(
+                float(one_controller_setpoint['sccm'])
+            )
+
+    mfc_id2profile = dict()
+    try:
+        for mfc_id, c in sorted(mfc_id2flow_controller.items()):
+            setpoints = cli_setpoints
+            if setpoints is None:
+                setpoints = sorted(mfc_id2setpoints[mfc_id])
+
+            if len(setpoints) < 2:
+                raise ValueError(f'{mfc_id} only has one setpoint in config. specify '
+                    'at least two to step between with -s/--setpoints.'
+                )
+
+            print(f'Characterizing {mfc_id} (setpoints: {setpoints})...', end='',
+                flush=True
+            )
+            profile = flow.characterize_controller(c, setpoints,
+                duration_s=kwargs['duration'], verbose=verbose
+            )
+            print('done')
+            print(f"- rise time: {profile['rise_time_s']:.2f}s, settling time: "
+                f"{profile['settling_time_s']:.2f}s, overshoot: "
+                f"{profile['overshoot_frac']:.1%}"
+            )
+            mfc_id2profile[mfc_id] = profile
+    finally:
+        flow.restore_initial_setpoints(mfc_id2flow_controller, verbose=verbose)
+
+    if not kwargs['no_save']:
+        flow.save_response_profiles(mfc_id2profile)
+
+
 def upload_cli():
+    from olfactometer.upload import main as upload_main
+
     parser = argparse.ArgumentParser()
 
     util.argparse_arduino_id_args(parser)
@@ -403,50 +499,107 @@ def upload_cli():
         ' rather than symlinked.'
     )
 
+    parser.add_argument('--no-build-cache', action='store_true',
+        help='always regenerate nanopb code and recompile from scratch, rather than '
+        'flashing cached firmware built from the same inputs (if any). does not add to '
+        'the cache.'
+    )
+
     parser.add_argument('-v', '--verbose', action='store_true',
         help='make arduino-cli compilation verbose'
     )
 
     kwargs = util.parse_args(parser)
     kwargs['use_symlinks'] = not kwargs.pop('no_symlink', False)
+    kwargs['use_cache'] = not kwargs.pop('no_build_cache', False)
 
     upload_main(**kwargs)
 
 
 def print_config_time_cli():
+    from olfactometer import olf, flow, timeline
+
     parser = util.argparse_config_args()
-    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-v', '--verbose', action='store_true', help='also print the '
+        'predicted time of each trial start and valve onset / offset'
+    )
+    util.argparse_serial_load_arg(parser)
 
     config_path, kwargs = util.parse_config_args(parser)
+    verbose = kwargs.get('verbose', False)
+
+    loaded = list(olf.config_iter(config_path, **kwargs))
+    timed = [x.all_required_data for x in loaded
+        if not x.all_required_data.settings.follow_hardware_timing
+    ]
+
+    # Simulating firmware timing of all configs at once (see `timeline`).
+    durations_s = iter((timeline.sequence_durations_us(
+        [x.settings.timing for x in timed], [util.number_of_trials(x) for x in timed]
+    ) / 1e6).tolist())
+
+    total_s = 0.0
+    for _, all_required_data, config_dict, flows in loaded:
+        n_trials = util.number_of_trials(all_required_data)
+        print(f'{n_trials} trials')
+
+        settings = all_required_data.settings
+        if settings.follow_hardware_timing:
+            finish_delay_s = timeline.follow_hardware_finish_delay_us / 1e6
+            print('Can not compute duration because following hardware timing '
+                f'(finishes {finish_delay_s:.0f}s after last trigger)'
+            )
+            continue
 
-    n_config = 0
-    total_s = 0
+        duration_s = next(durations_s)
+        print(f'Will take {util.format_duration_s(duration_s)} ({duration_s:.0f}s)')
 
-    for single_run_config in olf.config_iter(config_path, **kwargs):
+        timing = settings.timing
+        naive_s = n_trials * (timing.pre_pulse_us + timing.pulse_us +
+            timing.post_pulse_us) / 1e6
 
-        all_required_data, config_dict = config_io.load(single_run_config)
+        # Firmware timer rounding alone is typically well under this.
+        if duration_s - naive_s >= 0.5:
+            print(f'(including {duration_s - naive_s:.1f}s of pulse train overrun)')
+
+        total_s += duration_s
+
+        if flows is not None:
+            # As olf.run waits, after setting initial flows.
+            settling_s = flow.settling_time_s(flows.mfc_ids,
+                default=flow.default_mfc_settling_wait_s
+            )
+            print(f'(plus {settling_s:.1f}s waiting for flow controllers to settle '
+                'first)'
+            )
+            total_s += settling_s
 
-        time_s = util.time_config_will_take_s(all_required_data, print_=True)
-        total_s += time_s
+        if verbose:
+            simulated = timeline.simulate(settings, n_trials)
+            for trial_index, (start_us, onset_us, offset_us) in enumerate(zip(
+                simulated.trial_start_us.tolist(), simulated.onset_us.tolist(),
+                simulated.offset_us.tolist())):
 
-        n_config += 1
+                print(f'- trial {trial_index + 1}: start {start_us / 1e6:.3f}s, '
+                    f'valve(s) {onset_us / 1e6:.3f}-{offset_us / 1e6:.3f}s'
+                )
 
-    if n_config > 1:
+    if len(loaded) > 1:
         print(f'\nTotal: {util.format_duration_s(total_s)}')
 
 
 def show_pins2odors_cli():
+    from olfactometer import olf
+
     parser = util.argparse_config_args(hardware=False)
 
     parser.add_argument('-v', '--verbose', action='store_true')
 
     config_path, kwargs = util.parse_config_args(parser)
 
-    for single_run_config in olf.config_iter(config_path,
+    for _, _, config_dict, _ in olf.config_iter(config_path,
         _skip_config_preprocess_check=True, **kwargs):
 
-        _, config_dict = config_io.load(single_run_config)
-
         if 'generator' in config_dict:
             raise ValueError('Do not use this (directly) with config that use '
                 'generators. Instead, pass generator output or manually created config.'
@@ -455,6 +608,33 @@ def show_pins2odors_cli():
         util.print_pins2odors(config_dict)
 
 
+def export_cli():
+    from olfactometer import export
+
+    parser = argparse.ArgumentParser(description='writes one row per trial (pins, '
+        'odors, flows and expected valve times) for all configs under the input '
+        'directories. rows for configs unchanged since the last export to the same '
+        'output are reused.'
+    )
+    parser.add_argument('roots', nargs='+', help='directories (searched recursively '
+        f'for {", ".join(export.config_suffixes)} files) or individual config files. '
+        'each document of multi-document YAML and JSON lines files is exported.'
+    )
+    parser.add_argument('-o', '--output', required=True, dest='output_path',
+        help='file to write. format is picked by extension: '
+        f'{", ".join(export.output_suffix2writer)}. all but .csv require pyarrow.'
+    )
+    util.argparse_serial_load_arg(parser, dest='parallel',
+        min_files=export.parallel_export_min_files, description='parse config files'
+    )
+    parser.add_argument('-v', '--verbose', action='store_true')
+
+    kwargs = util.parse_args(parser)
+    export.export(**kwargs)
+
+
 def version_str():
+    from olfactometer.upload import version_str as _version_str
+
     print(_version_str())
 
@@ -4,19 +4,26 @@ Functions for loading / saving configuration.
 
 import glob
 from datetime import datetime
+import hashlib
+import io
 import json
 import os
 from os.path import split, join, isdir, isfile, splitext, exists
+import pickle
+import struct
 import sys
-import tempfile
-from pprint import pformat
-from typing import Union, Sequence, Dict, Any
+import warnings
+from typing import (Union, Sequence, Dict, Any, NamedTuple, Optional, List, Iterable,
+    Iterator
+)
 
 from google.protobuf import json_format
+from google.protobuf.descriptor import FieldDescriptor
 import yaml
 
-from olfactometer import util, IN_DOCKER
+from olfactometer import util, IN_DOCKER, THIS_PACKAGE_DIR
 from olfactometer.generators.common import validate_hardware_dict
+from olfactometer import validation, persist
 
 # NOTE: this import must come after `util.generate_protobuf_outputs` call, which
 # is currently ensured by happening on first module import (via __init__.py)
@@ -29,6 +36,25 @@ from olfactometer import olf_pb2
 #import olfactometer
 
 
+# Using the libyaml (C) implementations when PyYAML was built with them, as the pure
+# Python ones dominate load / write time for large generated configs. Both produce the
+# same data / output (see tests/test_yaml_io.py).
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as _SafeDumper
+
+
+class NoAliasDumper(_SafeDumper):
+    """Dumper that writes repeated objects out in full, rather than as aliases.
+
+    Aliases (references) within generated YAML make it less readable.
+    https://stackoverflow.com/questions/13518819
+    """
+    def ignore_aliases(self, data):
+        return True
+
+
 HARDWARE_DIR_ENVVAR = 'OLFACTOMETER_HARDWARE_DIR'
 DEFAULT_HARDWARE_ENVVAR = 'OLFACTOMETER_DEFAULT_HARDWARE'
 
@@ -91,6 +117,7 @@ def load_hardware_config(hardware_config=None):
                 break
 
         if _hardware_config_path is None:
+            from pprint import pformat
             raise IOError(f'{err_prefix} is neither a fullpath to a file, nor a file/'
                 f'prefix directly under {HARDWARE_DIR_ENVVAR}={hardware_config_dir}\n'
                 'prefixes of files under this directory:\n'
@@ -114,12 +141,133 @@ def load_hardware_config(hardware_config=None):
 
     print('Using olfactometer hardware definition at:', hardware_config_path)
     with open(hardware_config_path, 'r') as f:
-        hardware_yaml_dict = yaml.safe_load(f)
+        hardware_yaml_dict = safe_load_yaml(f)
 
     validate_hardware_dict(hardware_yaml_dict)
     return hardware_yaml_dict
 
 
+class _FallBackToParseDict(Exception):
+    pass
+
+
+def _scalar_fields(message_class):
+    """Returns dict of field name -> is_bool, for uint32 / bool fields.
+    """
+    name2is_bool = dict()
+    for field in message_class.DESCRIPTOR.fields:
+        if field.type not in (FieldDescriptor.TYPE_UINT32, FieldDescriptor.TYPE_BOOL):
+            continue
+
+        name2is_bool[field.name] = field.type == FieldDescriptor.TYPE_BOOL
+
+    return name2is_bool
+
+_settings_scalar_fields = _scalar_fields(olf_pb2.Settings)
+_timing_scalar_fields = _scalar_fields(olf_pb2.PulseTiming)
+
+def _fall_back_keys(message_class, handled):
+    """Returns field names (proto and JSON) in `message_class` not in `handled`.
+
+    Other keys are ignored (as with `ignore_unknown_fields=True`), but if any of these
+    are present (e.g. JSON names, like 'pinSequence'), we fall back to `ParseDict`.
+    """
+    return frozenset(n for f in message_class.DESCRIPTOR.fields
+        for n in (f.name, f.json_name)
+    ) - set(handled)
+
+_all_required_data_fall_back_keys = _fall_back_keys(olf_pb2.AllRequiredData,
+    {'settings', 'pin_sequence'}
+)
+_settings_fall_back_keys = _fall_back_keys(olf_pb2.Settings,
+    {'timing'} | set(_settings_scalar_fields)
+)
+_timing_fall_back_keys = _fall_back_keys(olf_pb2.PulseTiming, _timing_scalar_fields)
+_pin_sequence_fall_back_keys = _fall_back_keys(olf_pb2.PinSequence, {'pin_groups'})
+_pin_group_fall_back_keys = _fall_back_keys(olf_pb2.PinGroup, {'pins'})
+
+def _check_keys(d, fall_back_keys) -> None:
+    if type(d) is not dict or not fall_back_keys.isdisjoint(d):
+        raise _FallBackToParseDict
+
+
+def _set_scalar_fields(d, message, scalar_fields) -> None:
+    for k, v in d.items():
+        if k not in scalar_fields:
+            continue
+
+        if scalar_fields[k]:
+            if type(v) is not bool:
+                raise _FallBackToParseDict
+
+        # Excluding bool (a subclass of int), floats, strs, None, etc, which ParseDict
+        # either converts or errs on.
+        elif type(v) is not int or not 0 <= v < 2**32:
+            raise _FallBackToParseDict
+
+        setattr(message, k, v)
+
+
+def _build_all_required_data(config_dict, message) -> None:
+    """Populates empty `AllRequiredData` message from config dict.
+
+    Equivalent to `json_format.ParseDict(config_dict, message,
+    ignore_unknown_fields=True)` for the inputs it handles, but much faster for long
+    pin sequences, since it does not need to inspect each field of each `PinGroup`
+    via reflection.
+
+    Raises `_FallBackToParseDict` (possibly after modifying `message`) on any input
+    it does not handle the same way as `ParseDict` (e.g. values that need conversion,
+    or invalid input, where we want `ParseDict`'s errors).
+    """
+    _check_keys(config_dict, _all_required_data_fall_back_keys)
+
+    if 'settings' in config_dict:
+        settings_dict = config_dict['settings']
+        _check_keys(settings_dict, _settings_fall_back_keys)
+
+        settings = message.settings
+        settings.SetInParent()
+
+        if 'timing' in settings_dict:
+            # ParseDict errs if more than one field of a oneof is set.
+            if 'follow_hardware_timing' in settings_dict:
+                raise _FallBackToParseDict
+
+            timing_dict = settings_dict['timing']
+            _check_keys(timing_dict, _timing_fall_back_keys)
+            settings.timing.SetInParent()
+            _set_scalar_fields(timing_dict, settings.timing, _timing_scalar_fields)
+
+        _set_scalar_fields(settings_dict, settings, _settings_scalar_fields)
+
+    if 'pin_sequence' in config_dict:
+        pin_sequence_dict = config_dict['pin_sequence']
+        _check_keys(pin_sequence_dict, _pin_sequence_fall_back_keys)
+
+        pin_sequence = message.pin_sequence
+        pin_sequence.SetInParent()
+
+        if 'pin_groups' in pin_sequence_dict:
+            pin_group_dicts = pin_sequence_dict['pin_groups']
+            if type(pin_group_dicts) is not list:
+                raise _FallBackToParseDict
+
+            # Much faster than constructing each PinGroup with keyword arguments, at
+            # least with the pure Python protobuf implementation.
+            add_pin_group = pin_sequence.pin_groups.add
+            for pin_group_dict in pin_group_dicts:
+                _check_keys(pin_group_dict, _pin_group_fall_back_keys)
+
+                pins = pin_group_dict.get('pins', [])
+                if type(pins) is not list or not all(
+                    type(p) is int and 0 <= p < 2**32 for p in pins):
+
+                    raise _FallBackToParseDict
+
+                add_pin_group().pins.extend(pins)
+
+
 def load_dict(config_dict, message=None):
     """Returns a populated protobuf message and a dict with extra metadata.
     """
@@ -127,6 +275,16 @@ def load_dict(config_dict, message=None):
         #message = olfactometer.olf_pb2.AllRequiredData()
         message = olf_pb2.AllRequiredData()
 
+    # Fast path for the (common) case where the config is well formed. Other cases (and
+    # other message types) use ParseDict, for its conversions / error messages.
+    if type(message) is olf_pb2.AllRequiredData and len(message.ListFields()) == 0:
+        try:
+            _build_all_required_data(config_dict, message)
+            return message, config_dict
+
+        except _FallBackToParseDict:
+            message.Clear()
+
     # Always ignoring unknown fields for now, so the generators can store extra
     # metadata for use at analysis only in the same config files.
     json_format.ParseDict(config_dict, message, ignore_unknown_fields=True)
@@ -157,18 +315,179 @@ def load_json(json_filelike, message=None):
     return _load_helper(json.load, json_filelike, message=message)
 
 
+def safe_load_yaml(yaml_filelike):
+    """Like `yaml.safe_load`, but with the faster C loader when available.
+    """
+    return yaml.load(yaml_filelike, Loader=YamlLoader)
+
+
 def load_yaml(yaml_filelike, message=None):
     # TODO do we actually need any of the yaml 1.2(+?) features
     # available in ruamel.yaml but not in PyYAML (1.1 only)?
-    return _load_helper(yaml.safe_load, yaml_filelike, message=message)
+    return _load_helper(safe_load_yaml, yaml_filelike, message=message)
+
+
+# Files with this extension contain a sequence of JSON configs (typically one per line,
+# but any whitespace between them works). YAML files may also contain a sequence of
+# configs, as multiple documents (separated by '---' lines). Either is an alternative
+# to a directory of numbered configs (see `olf.config_iter`).
+jsonl_suffix = '.jsonl'
+
+# Characters read at a time when parsing JSON sequences.
+json_stream_chunk_size = 64 * 1024
+
+def _iter_json_documents(filelike):
+    """Yields each JSON value in the file, reading only as much as needed for each.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if len(buffer) > 0:
+            try:
+                document, end = decoder.raw_decode(buffer)
+            # Incomplete document (or actually invalid, which we can only tell at EOF).
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number at the end of the buffer could continue in the next chunk.
+                if end < len(buffer) or eof or type(document) in (dict, list):
+                    yield document
+                    buffer = buffer[end:]
+                    continue
+
+        elif eof:
+            return
+
+        chunk = filelike.read(json_stream_chunk_size)
+        if len(chunk) == 0:
+            eof = True
+
+        buffer += chunk
+
+
+class _PrefixedReader:
+    """File-like object returning `prefix` and then the rest of `filelike`.
+    """
+    def __init__(self, prefix: str, filelike):
+        self.prefix = prefix
+        self.filelike = filelike
+
+    def read(self, size=-1):
+        if len(self.prefix) == 0:
+            return self.filelike.read(size)
+
+        if size is None or size < 0:
+            data = self.prefix + self.filelike.read()
+            self.prefix = ''
+            return data
+
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        if len(data) < size:
+            data += self.filelike.read(size - len(data))
+
+        return data
+
+
+def iter_config_dicts(filelike, is_json: Optional[bool] = None):
+    """Yields each config dict in a YAML / JSON stream, parsing them one at a time.
+
+    If `is_json` is None, the stream is treated as JSON if its first non-whitespace
+    character is '{'.
+    """
+    if is_json is None:
+        prefix = ''
+        while True:
+            c = filelike.read(1)
+            prefix += c
+            if len(c) == 0 or not c.isspace():
+                break
+
+        is_json = prefix.endswith('{')
+        filelike = _PrefixedReader(prefix, filelike)
+
+    if is_json:
+        yield from _iter_json_documents(filelike)
+    else:
+        for config_dict in yaml.load_all(filelike, Loader=YamlLoader):
+            # e.g. from a trailing '---'
+            if config_dict is not None:
+                yield config_dict
+
+
+def _has_multiple_yaml_documents(yaml_path: str) -> bool:
+    seen_content = False
+    with open(yaml_path, 'r') as f:
+        for line in f:
+            if line.startswith('---') and (len(line) == 3 or line[3].isspace()):
+                if seen_content:
+                    return True
+
+            elif len(line.strip()) > 0 and not line.startswith(('#', '%', '...')):
+                seen_content = True
 
+    return False
 
-def load(config=None):
+
+def is_config_stream(config) -> bool:
+    """Returns whether config is a path to a file containing a sequence of configs.
+    """
+    if type(config) is not str or not isfile(config):
+        return False
+
+    if config.endswith(jsonl_suffix):
+        return True
+
+    return config.endswith('.yaml') and _has_multiple_yaml_documents(config)
+
+
+def iter_stream_config_dicts(config=None):
+    """Yields each config dict in a stream of them. See `load_stream`.
+    """
+    if config is None:
+        print('Reading configs from stdin')
+        yield from iter_config_dicts(sys.stdin)
+        return
+
+    if not (config.endswith(jsonl_suffix) or config.endswith('.yaml')):
+        raise ValueError(f'config stream must end with either {jsonl_suffix} or '
+            '.yaml'
+        )
+
+    with open(config, 'r') as f:
+        yield from iter_config_dicts(f, is_json=config.endswith(jsonl_suffix))
+
+
+def load_stream(config=None):
+    """Yields (AllRequiredData, config dict) for each config in a stream of them.
+
+    Args:
+    config (str|None): path to a multi-document YAML file or a .jsonl file (see
+        `jsonl_suffix`), or None to read from `sys.stdin`.
+
+    Each config is only parsed as it is needed, so memory use does not grow with the
+    number of configs.
+    """
+    for config_dict in iter_stream_config_dicts(config):
+        yield load_dict(config_dict)
+
+
+def load(config=None, write_cache: bool = False):
     """Parses config for a single run into a AllRequiredData message object
 
     Args:
     config (str|dict|None): If `str`, path to JSON or YAML file, which
-        must end in .json or .yaml. If `None`, reads from `sys.stdin`.
+        must end in .json or .yaml. If `None`, reads from `sys.stdin`. Either must
+        contain a single config. See `load_stream` for sequences of configs.
+
+    write_cache: if True, config files not already in the cache are added to it.
+        Config files are always read from the cache (or their sidecar) if possible, but
+        by default nothing is written for them, so read-only callers (e.g.
+        `olf-export`) do not fill the user's cache. `load_compiled` (and so
+        `olf.config_iter`) caches the loaded, validated and encoded config instead.
 
     Returns an `olf_pb2.AllRequiredData` object and a `dict` that contains all
     of the loaded config data, including fields beyond those that affect
@@ -188,31 +507,13 @@ def load(config=None):
             assert IN_DOCKER
             raise IOError('you must use the -i flag with docker run')
 
-        # TODO check output of yaml dumping w/ default_flow_style=True again.
-        # that might be an example of a case where YAML also would trigger this,
-        # in which case i might want to do something different to detect JSON...
-        if stdin_str.lstrip()[0] == '{':
-            suffix = '.json'
-        else:
-            suffix = '.yaml'
-
-        if util.in_windows():
-            # To avoid weird errors with NamedTemporaryFile, which I vaguely
-            # remember hearing didn't work as I need on Windows. See perhaps:
-            # https://stackoverflow.com/questions/2549384
-            # TODO test though. maybe this error is no longer relevant?
-            # TODO maybe i can just do the rest of the stuff inside the tempfile
-            # block? this was just Named for the suffix, right? maybe just
-            # handle that separately (or do other tempfile objects also support
-            # this?)?
-            raise NotImplementedError('using stdin as input not supported in '
-                'Windows'
+        config_dicts = list(iter_config_dicts(io.StringIO(stdin_str)))
+        if len(config_dicts) != 1:
+            raise ValueError(f'stdin had {len(config_dicts)} config documents. use '
+                '`load_stream` (or `olf.config_iter`) for sequences of configs.'
             )
 
-        with tempfile.NamedTemporaryFile(mode='w', suffix=suffix, delete=False
-            ) as temp:
-            config = temp.name
-            temp.write(stdin_str)
+        config = config_dicts[0]
 
     #all_required_data = olfactometer.olf_pb2.AllRequiredData()
     all_required_data = olf_pb2.AllRequiredData()
@@ -221,6 +522,23 @@ def load(config=None):
         _, config_dict = load_dict(config, all_required_data)
 
     elif type(config) is str:
+        if not (config.endswith('.json') or config.endswith('.yaml')):
+            raise ValueError('file must end with either .json or .yaml')
+
+        # In case it was just generated, and is still being written.
+        persist.wait_for(config)
+
+        sidecar = _read_config_sidecar(config)
+        if sidecar is not None:
+            serialized, config_dict = sidecar
+            all_required_data.ParseFromString(serialized)
+            return all_required_data, config_dict
+
+        entry = _read_config_cache(config)
+        if entry is not None:
+            all_required_data.ParseFromString(entry['all_required_data'])
+            return all_required_data, entry['config_dict']
+
         with open(config, 'r') as f:
             if config.endswith('.json'):
                 # First return argument is just the same as the second argument.
@@ -229,8 +547,9 @@ def load(config=None):
 
             elif config.endswith('.yaml'):
                 _, config_dict = load_yaml(f, all_required_data)
-            else:
-                raise ValueError('file must end with either .json or .yaml')
+
+        if write_cache:
+            _write_config_cache(config, all_required_data, config_dict)
 
     else:
         # TODO i think i have a few such error lines now. maybe factor out?
@@ -241,10 +560,525 @@ def load(config=None):
     return all_required_data, config_dict
 
 
-# TODO ~pathlike type hint for generated_yaml_fname
-# TODO factor this Dict[str, Any] to an alias -> use throughout (here and other modules)
-def write_yaml(generated_config: Dict[str, Any], generated_yaml_fname) -> None:
+# Generated YAML configs may have a binary "sidecar" file next to them (same name,
+# with this extension instead of .yaml), which `load` reads instead of the YAML, if the
+# hash stored in the sidecar matches the current YAML contents. The YAML is still the
+# authoritative, human-readable version.
+#
+# Format:
+# - config_sidecar_magic
+# - 32 byte SHA-256 of olf.proto and YAML contents (see `_config_sidecar_hash`)
+# - 4 byte (big-endian) length, then serialized `AllRequiredData`
+# - 4 byte length, then JSON encoded config dict (all of the YAML, as `load` returns it.
+#   see `_sidecar_json_default`)
+#
+# Not pickle, as sidecars are data files that get copied and shared along with the
+# YAML, and unpickling one could run arbitrary code.
+config_sidecar_suffix = '.pb'
+config_sidecar_magic = b'OLFPB\x00\x00\x02'
+
+# JSON objects with only this key encode a mapping with some non-str keys (e.g. the int
+# pins of pins2odors), as a list of [key, value] pairs.
+_sidecar_items_key = '__items__'
+
+# Set False to not write sidecars in `write_timestamped_config`.
+write_config_sidecars = True
+
+def config_sidecar_path(config_path: str) -> str:
+    return splitext(config_path)[0] + config_sidecar_suffix
+
+
+_proto_hash = None
+def _config_sidecar_hash(yaml_bytes: bytes) -> bytes:
+    # Only the .proto (rather than all the code, as for the config cache), as this
+    # should be the only thing the meaning of the serialized data depends on, and
+    # sidecars are not regenerated after they are written.
+    global _proto_hash
+    if _proto_hash is None:
+        with open(join(THIS_PACKAGE_DIR, 'olf.proto'), 'rb') as f:
+            _proto_hash = hashlib.sha256(f.read()).digest()
+
+    return hashlib.sha256(_proto_hash + yaml_bytes).digest()
+
+
+def _to_sidecar_json(x):
+    if type(x) is dict:
+        if all(type(k) is str for k in x):
+            return {k: _to_sidecar_json(v) for k, v in x.items()}
+
+        return {_sidecar_items_key: [[k, _to_sidecar_json(v)] for k, v in x.items()]}
+
+    if type(x) is list:
+        return [_to_sidecar_json(v) for v in x]
+
+    return x
+
+
+def _from_sidecar_json_object(obj):
+    if len(obj) == 1 and _sidecar_items_key in obj:
+        return {k: v for k, v in obj[_sidecar_items_key]}
+
+    return obj
+
+
+def _sidecar_metadata(config_dict) -> Optional[bytes]:
+    """Returns JSON encoded config_dict, or None if it would not decode back the same.
+    """
+    try:
+        metadata = json.dumps(_to_sidecar_json(config_dict), separators=(',', ':'))
+    except (TypeError, ValueError):
+        # e.g. dates, which the YAML loader can produce, but JSON can not represent.
+        return None
+
+    if json.loads(metadata, object_hook=_from_sidecar_json_object) != config_dict:
+        return None
+
+    return metadata.encode()
+
+
+def write_config_sidecar(config_path: str, all_required_data, config_dict,
+    yaml_bytes: Optional[bytes] = None) -> Optional[str]:
+    """Writes binary sidecar for YAML config, returning the sidecar path.
+
+    Args:
+        all_required_data: `olf_pb2.AllRequiredData` for the config
+        config_dict: the config as `load` would return it (the data in the YAML)
+        yaml_bytes: contents of the YAML, if already in memory. Otherwise read from
+            `config_path`.
+
+    The sidecar is written in the background (see `persist`). Returns None (writing
+    nothing) if config_dict can not be stored exactly (see `_sidecar_metadata`).
+    """
+    if not config_path.endswith('.yaml'):
+        raise ValueError('sidecars are only supported for .yaml configs')
+
+    metadata = _sidecar_metadata(config_dict)
+    if metadata is None:
+        return None
+
+    if yaml_bytes is None:
+        persist.wait_for(config_path)
+        with open(config_path, 'rb') as f:
+            yaml_bytes = f.read()
+
+    serialized = all_required_data.SerializeToString()
+
+    sidecar_path = config_sidecar_path(config_path)
+    persist.write(sidecar_path, b''.join([
+        config_sidecar_magic,
+        _config_sidecar_hash(yaml_bytes),
+        struct.pack('>I', len(serialized)),
+        serialized,
+        struct.pack('>I', len(metadata)),
+        metadata,
+    ]))
+    return sidecar_path
+
+
+def _read_config_sidecar(config_path: str):
+    """Returns (serialized AllRequiredData, config dict) or None.
+
+    None if there is no sidecar for the config, or if it does not match the config's
+    current contents.
+    """
+    if not config_path.endswith('.yaml'):
+        return None
+
+    sidecar_path = config_sidecar_path(config_path)
+    # Failing to write one is not fatal, as the YAML can be used instead.
+    persist.wait_for(sidecar_path, raise_errors=False)
+    try:
+        with open(sidecar_path, 'rb') as f:
+            data = f.read()
+
+    except FileNotFoundError:
+        return None
+
+    with open(config_path, 'rb') as f:
+        yaml_bytes = f.read()
+
+    header_len = len(config_sidecar_magic) + 32
+    if (data[:len(config_sidecar_magic)] != config_sidecar_magic or
+        data[len(config_sidecar_magic):header_len] != _config_sidecar_hash(yaml_bytes)):
+
+        return None
+
+    try:
+        offset = header_len
+        (serialized_len,) = struct.unpack_from('>I', data, offset)
+        offset += 4
+        serialized = data[offset:offset + serialized_len]
+        offset += serialized_len
+
+        (metadata_len,) = struct.unpack_from('>I', data, offset)
+        offset += 4
+        config_dict = json.loads(data[offset:offset + metadata_len],
+            object_hook=_from_sidecar_json_object
+        )
+
+    except (struct.error, ValueError) as err:
+        warnings.warn(f'ignoring unreadable config sidecar for {config_path}: {err}')
+        return None
+
+    return serialized, config_dict
+
 
+# Parsed (and, via `load_compiled`, validated and encoded) configs are cached under
+# this directory, so that loading a config we have seen before is just one read and
+# unpickling. Entries are keyed by a hash of the config file contents, and of the code
+# and .proto file that loading depends on.
+def _config_cache_dir(mkdir=False):
+    config_cache_dir = util.user_data_dir(mkdir=mkdir) / 'config_cache'
+    if mkdir:
+        config_cache_dir.mkdir(exist_ok=True)
+
+    return config_cache_dir
+
+# Least recently used entries are deleted past either of these limits.
+max_config_cache_bytes = 64 * 1024 ** 2
+max_config_cache_entries = 2000
+
+# Set False to always load configs from scratch.
+use_config_cache = True
+
+_code_hash = None
+def _get_code_hash() -> bytes:
+    """Returns hash of .proto file and package source, which loading may depend on.
+    """
+    global _code_hash
+    if _code_hash is None:
+        h = hashlib.sha256()
+        for fname in [join(THIS_PACKAGE_DIR, 'olf.proto')] + sorted(
+            glob.glob(join(THIS_PACKAGE_DIR, '*.py'))):
+
+            with open(fname, 'rb') as f:
+                h.update(f.read())
+
+        _code_hash = h.digest()
+
+    return _code_hash
+
+
+def _config_cache_fname(config_path: str):
+    with open(config_path, 'rb') as f:
+        data = f.read()
+
+    h = hashlib.sha256(_get_code_hash())
+    # So identical contents loaded as JSON vs YAML don't share an entry.
+    h.update(splitext(config_path)[1].encode())
+    h.update(data)
+    return _config_cache_dir() / f'{h.hexdigest()}.pkl'
+
+
+def _read_config_cache(config_path: str) -> Optional[dict]:
+    """Returns cache entry for config (see `_write_config_cache`), or None if missing.
+    """
+    if not use_config_cache:
+        return None
+
+    cache_fname = _config_cache_fname(config_path)
+    persist.wait_for(cache_fname, raise_errors=False)
+    try:
+        with open(cache_fname, 'rb') as f:
+            entry = pickle.load(f)
+
+    except FileNotFoundError:
+        return None
+
+    # e.g. if a previous write was interrupted. Will just be overwritten.
+    except (pickle.UnpicklingError, EOFError) as err:
+        warnings.warn(f'ignoring unreadable config cache entry {cache_fname}: {err}')
+        return None
+
+    # For least-recently-used eviction.
+    os.utime(cache_fname)
+    return entry
+
+
+def _write_config_cache(config_path: str, all_required_data, config_dict,
+    validation_warnings=None, encoded_messages=None, flows=None) -> None:
+
+    if not use_config_cache:
+        return
+
+    # Not using pickle on the protobuf message directly, as serialization is smaller,
+    # and not tied to the particular generated class.
+    entry = {
+        'all_required_data': all_required_data.SerializeToString(),
+        'config_dict': config_dict,
+        # None if not yet validated. Otherwise, a list of (message, category) for
+        # each warning validation produced (so they can be shown again on load).
+        'validation_warnings': validation_warnings,
+        # None if not yet encoded. Otherwise, dict of message field name (e.g.
+        # 'settings') -> output of `util.encode_message`.
+        'encoded_messages': encoded_messages,
+        # `trial_table.FlowSetpoints` from validation, or None if not yet validated (or
+        # no flow setpoints).
+        'flows': flows,
+    }
+    cache_fname = _config_cache_fname(config_path)
+    cache_dir = _config_cache_dir(mkdir=True)
+
+    # Written atomically (so no other process can ever see a partial entry), in the
+    # background, as is eviction (which needs to stat every entry).
+    persist.write(cache_fname, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+    persist.submit(None, lambda: _evict_config_cache(cache_dir))
+
+
+def _evict_config_cache(cache_dir) -> None:
+    entries = []
+    for fname in cache_dir.glob('*.pkl'):
+        try:
+            stat = fname.stat()
+        # Another process may have evicted it already.
+        except FileNotFoundError:
+            continue
+
+        entries.append((stat.st_mtime, stat.st_size, fname))
+
+    total_bytes = sum([size for _, size, _ in entries])
+
+    # Oldest first.
+    entries.sort(key=lambda x: x[0])
+    while len(entries) > 0 and (len(entries) > max_config_cache_entries or
+        total_bytes > max_config_cache_bytes):
+
+        _, size, fname = entries.pop(0)
+        try:
+            fname.unlink()
+        except FileNotFoundError:
+            pass
+
+        total_bytes -= size
+
+
+def clear_config_cache() -> None:
+    """Deletes all cached configs.
+    """
+    cache_dir = _config_cache_dir()
+    if not cache_dir.exists():
+        return
+
+    for fname in cache_dir.glob('*.pkl'):
+        fname.unlink()
+
+
+class CompiledConfig(NamedTuple):
+    all_required_data: Any
+    config_dict: Dict[str, Any]
+    # Message field name (e.g. 'settings') -> bytes to send to Arduino for that message
+    # (see `util.encode_message`).
+    encoded_messages: Dict[str, bytes]
+    # `trial_table.FlowSetpoints` parsed (once) from `flow_setpoints_sequence` during
+    # validation. None if config has no flow setpoints.
+    flows: Any
+
+
+class LoadedConfig(NamedTuple):
+    # None if config was not loaded from a file (i.e. was a dict or read from stdin).
+    path: Optional[str]
+    all_required_data: Any
+    config_dict: Dict[str, Any]
+    # As in `CompiledConfig`.
+    flows: Any = None
+
+
+# Absolute path -> ((modification time, size) of file, CompiledConfig), for configs
+# already loaded by `load_compiled` in this process.
+_path2compiled = dict()
+
+def file_signature(config_path: str):
+    """Returns (modification time, size) of file, to detect when it has changed.
+    """
+    stat = os.stat(config_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_compiled(config=None, warn=True) -> CompiledConfig:
+    """Returns loaded, validated, and encoded config. See `load` for `config` types.
+
+    For configs loaded from files, the outputs of validation and encoding are cached
+    along with the loaded data, so they only need to be computed the first time each
+    config is loaded. Warnings from validation are shown again each time the config is
+    loaded in a new process.
+
+    Within one process, the same (unchanged) file is only loaded once, and the same
+    objects are returned for each call, so they should not be modified. Copy the
+    `AllRequiredData` message first if it needs to be changed.
+
+    Raises ValueError if config is invalid.
+    """
+    # So that stdin is only read once.
+    if config is None:
+        all_required_data, config_dict = load(config)
+        config = config_dict
+
+    if type(config) is str:
+        persist.wait_for(config)
+
+    if type(config) is str and isfile(config):
+        abs_path = os.path.abspath(config)
+        signature = file_signature(abs_path)
+
+        signature_and_compiled = _path2compiled.get(abs_path)
+        if signature_and_compiled is not None and (
+            signature_and_compiled[0] == signature):
+
+            return signature_and_compiled[1]
+
+        compiled = _load_compiled(config, warn=warn)
+        _path2compiled[abs_path] = (signature, compiled)
+        return compiled
+
+    return _load_compiled(config, warn=warn)
+
+
+def forget_compiled(config_path: str) -> None:
+    """Drops config from what `load_compiled` keeps in memory (no-op if not there).
+
+    For callers going through many configs once each (e.g. generator output), so that
+    memory does not grow with the number of configs.
+    """
+    _path2compiled.pop(os.path.abspath(config_path), None)
+
+
+def _load_compiled(config, warn=True) -> CompiledConfig:
+    entry = None
+    if type(config) is str and isfile(config):
+        entry = _read_config_cache(config)
+
+    if entry is not None and entry['validation_warnings'] is not None:
+        all_required_data = olf_pb2.AllRequiredData()
+        all_required_data.ParseFromString(entry['all_required_data'])
+        config_dict = entry['config_dict']
+
+        if warn:
+            for message, category in entry['validation_warnings']:
+                warnings.warn(message, category)
+
+        return CompiledConfig(all_required_data, config_dict,
+            entry['encoded_messages'], entry['flows']
+        )
+
+    all_required_data, config_dict = load(config)
+
+    # Always validating with warn=True, so cached warnings are complete regardless of
+    # how this was called.
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        flows = validation.validate_config_dict(config_dict, warn=True)
+        validation.validate_protobuf(all_required_data, warn=True)
+
+    validation_warnings = [(str(w.message), w.category) for w in caught]
+    if warn:
+        for message, category in validation_warnings:
+            warnings.warn(message, category)
+
+    encoded_messages = {name: util.encode_message(getattr(all_required_data, name))
+        for name in ('settings', 'pin_sequence')
+    }
+
+    if type(config) is str:
+        _write_config_cache(config, all_required_data, config_dict,
+            validation_warnings=validation_warnings, encoded_messages=encoded_messages,
+            flows=flows
+        )
+
+    return CompiledConfig(all_required_data, config_dict, encoded_messages, flows)
+
+
+# Errors from loading / validating one config, that `load_compiled_many` collects
+# across configs.
+config_errors = (ValueError, yaml.YAMLError, json_format.ParseError)
+
+# When `load_compiled_many` is called with `parallel=None`, configs are loaded in
+# parallel (across processes) if at least this many still need to be loaded.
+parallel_load_min_files = 8
+
+def _load_compiled_in_worker(config_path: str, serialize: bool = True):
+    """Returns (CompiledConfig|None, validation warnings, error message|None).
+
+    If `serialize`, the `AllRequiredData` message in the CompiledConfig is serialized,
+    as the generated class can not be pickled (to return it from a pool). Warnings are
+    returned rather than shown, so the calling process can show them.
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        try:
+            compiled = load_compiled(config_path)
+        except config_errors as err:
+            return None, [], f'{type(err).__name__}: {err}'
+
+    if serialize:
+        compiled = compiled._replace(
+            all_required_data=compiled.all_required_data.SerializeToString()
+        )
+
+    return compiled, [(str(w.message), w.category) for w in caught], None
+
+
+def load_compiled_many(config_paths: Sequence[str], parallel: Optional[bool] = None,
+    max_workers: Optional[int] = None, warn: bool = True) -> List[CompiledConfig]:
+    """Returns `load_compiled` output for each config file, in the same order.
+
+    Args:
+        parallel: whether to load configs in a pool of processes. If None, only does
+            so if at least `parallel_load_min_files` are not already loaded in this
+            process.
+
+        max_workers: passed to `ProcessPoolExecutor`. Default is number of CPUs.
+
+    Raises ValueError describing all invalid configs, if any are invalid.
+    """
+    def already_loaded(config_path):
+        persist.wait_for(config_path)
+        abs_path = os.path.abspath(config_path)
+        return (abs_path in _path2compiled and
+            _path2compiled[abs_path][0] == file_signature(abs_path)
+        )
+
+    to_load = [x for x in config_paths if not already_loaded(x)]
+    if parallel is None:
+        parallel = len(to_load) >= parallel_load_min_files
+
+    parallel = parallel and len(to_load) > 1
+    if parallel:
+        # Only imported when needed, as it is slow to import (multiprocessing, etc).
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_load_compiled_in_worker, to_load))
+    else:
+        results = [_load_compiled_in_worker(x, serialize=False) for x in to_load]
+
+    errors = []
+    for config_path, (compiled, validation_warnings, error) in zip(to_load, results):
+        if error is not None:
+            errors.append(f'{config_path}: {error}')
+            continue
+
+        if warn:
+            for message, category in validation_warnings:
+                warnings.warn(message, category)
+
+        if parallel:
+            all_required_data = olf_pb2.AllRequiredData()
+            all_required_data.ParseFromString(compiled.all_required_data)
+            compiled = compiled._replace(all_required_data=all_required_data)
+
+        abs_path = os.path.abspath(config_path)
+        _path2compiled[abs_path] = (file_signature(abs_path), compiled)
+
+    if len(errors) > 0:
+        raise ValueError(f'{len(errors)}/{len(config_paths)} configs invalid:\n' +
+            '\n'.join(errors)
+        )
+
+    return [load_compiled(x) for x in config_paths]
+
+
+def _sort_pins2odors(generated_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns shallow copy of config, with pins2odors sorted by pin.
+    """
     # Now that we are no longer letting PyYAML sort keys, we want to sort this
     # ourselves. It makes configs / interactive output easier to read.
     pins2odors = generated_config['pins2odors']
@@ -253,14 +1087,64 @@ def write_yaml(generated_config: Dict[str, Any], generated_yaml_fname) -> None:
     generated_config['pins2odors'] = dict(
         sorted(pins2odors.items(), key=lambda x: x[0])
     )
+    return generated_config
+
+
+def _to_plain_data(data):
+    """Returns data with tuples as lists, and NumPy scalars / arrays as the equivalent
+    Python values, recursing into dicts and lists.
+
+    Generator code may produce such values. The safe YAML dumper refuses them (the
+    default dumper wrote them with Python specific tags, which safe loaders can not
+    load), as do protobuf parsing and JSON encoding of sidecars.
+    """
+    if isinstance(data, dict):
+        return {_to_plain_data(k): _to_plain_data(v) for k, v in data.items()}
+
+    if isinstance(data, (list, tuple)):
+        return [_to_plain_data(x) for x in data]
+
+    # NumPy scalars and arrays (checked without importing numpy).
+    if hasattr(data, 'dtype') and hasattr(data, 'tolist'):
+        return _to_plain_data(data.tolist())
+
+    return data
+
+
+def _plain_generated_config(generated_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns config as written to YAML: plain data, with pins2odors sorted by pin.
+    """
+    return _to_plain_data(_sort_pins2odors(generated_config))
+
+
+def _write_generated_config(generated_config: Dict[str, Any], generated_yaml_fname,
+    sidecar: bool) -> None:
+    """Writes YAML (and, if `sidecar`, binary sidecar) for one generated config.
+    """
+    # As it will be in the YAML, so the sidecar has the same data and order.
+    generated_config = _plain_generated_config(generated_config)
+    yaml_str = _write_plain_yaml(generated_config, generated_yaml_fname)
+    if sidecar:
+        # Built from the dict we already have, rather than by parsing the YAML again.
+        all_required_data, _ = load_dict(generated_config)
+        write_config_sidecar(generated_yaml_fname, all_required_data, generated_config,
+            yaml_bytes=yaml_str.encode()
+        )
+
+
+# TODO ~pathlike type hint for generated_yaml_fname
+# TODO factor this Dict[str, Any] to an alias -> use throughout (here and other modules)
+def write_yaml(generated_config: Dict[str, Any], generated_yaml_fname) -> str:
+    """Writes generated config to YAML (in the background), returning the YAML.
+
+    Tuples and NumPy values are written as the equivalent lists / Python values.
+    """
+    return _write_plain_yaml(_plain_generated_config(generated_config),
+        generated_yaml_fname
+    )
 
-    # TODO should i be using safe_dump instead? (modify SafeDumper instead
-    # of Dumper if so)
-    # So that there are not aliases (references) within the generated YAML
-    # (they make it less readable).
-    # https://stackoverflow.com/questions/13518819
-    yaml.Dumper.ignore_aliases = lambda *args : True
 
+def _write_plain_yaml(generated_config: Dict[str, Any], generated_yaml_fname) -> str:
     # TODO what is default_style kwarg to pyyaml dump? docs don't seem to say...
     # TODO maybe i want to make a custom dumper that just uses this style for pin groups
     # though? right now it's pretty ugly when everything is using this style...
@@ -270,26 +1154,38 @@ def write_yaml(generated_config: Dict[str, Any], generated_yaml_fname) -> None:
     default_flow_style = False
 
     assert not exists(generated_yaml_fname)
-    with open(generated_yaml_fname, 'w') as f:
-        yaml.dump(generated_config, f, default_flow_style=default_flow_style,
-            sort_keys=False
-        )
+
+    # Safe dumper, so generated configs can always be loaded with safe loaders.
+    # NoAliasDumper, so there are no aliases (references) within generated YAML.
+    yaml_str = yaml.dump(generated_config, Dumper=NoAliasDumper,
+        default_flow_style=default_flow_style, sort_keys=False
+    )
+    # In the background. Use `persist.wait_for` before reading it.
+    persist.write(generated_yaml_fname, yaml_str)
+    return yaml_str
 
 
 # TODO change to returning Path objects?
 def write_timestamped_config(
-    generated_config: Union[Dict[str, Any], Sequence[Dict[str, Any]]],
-    verbose: bool = True) -> str:
+    generated_config: Union[Dict[str, Any], Iterable[Dict[str, Any]]],
+    verbose: bool = True, sidecars: Optional[bool] = None) -> str:
     """Writes config to YAML file(s) under working directory, named with current time.
 
+    Args:
+        sidecars: whether to also write a binary sidecar next to each YAML (see
+            `write_config_sidecar`). Defaults to `write_config_sidecars`.
+
     Returns name of file / directory where config YAML was written.
     """
+    if sidecars is None:
+        sidecars = write_config_sidecars
+
     if type(generated_config) is dict:
         generated_yaml_fname = datetime.now().strftime('%Y%m%d_%H%M%S_stimuli.yaml')
         if verbose:
             print(f'Writing generated YAML to {generated_yaml_fname}')
 
-        write_yaml(generated_config, generated_yaml_fname)
+        _write_generated_config(generated_config, generated_yaml_fname, sidecars)
 
         if verbose:
             print()
@@ -299,22 +1195,44 @@ def write_timestamped_config(
     else:
         # TODO squeeze list to single element if only one file would be in dir?
 
-        timestamp_str = datetime.now().strftime('%Y%m%d_%H%M%S')
-        generated_config_dir = timestamp_str + '_stimuli'
-        if verbose:
-            print(f'Writing generated YAML under ./{generated_config_dir}/')
+        generated_config_dir = None
+        for generated_yaml_fname in iter_write_timestamped_configs(generated_config,
+            verbose=verbose, sidecars=sidecars):
 
-        assert not exists(generated_config_dir)
-        os.mkdir(generated_config_dir)
+            generated_config_dir = split(generated_yaml_fname)[0]
 
-        for i, yaml_dict in enumerate(generated_config):
-            assert type(yaml_dict) is dict
-            generated_yaml_fname = join(
-                generated_config_dir, f'{timestamp_str}_stimuli_{i}.yaml'
-            )
-            write_yaml(yaml_dict, generated_yaml_fname)
+        assert generated_config_dir is not None, 'generated config sequence was empty'
+        return generated_config_dir
 
-        if verbose:
-            print()
 
-        return generated_config_dir
+def iter_write_timestamped_configs(generated_configs: Iterable[Dict[str, Any]],
+    verbose: bool = True, sidecars: Optional[bool] = None) -> Iterator[str]:
+    """Writes each config under a new timestamped directory, as it is generated.
+
+    Yields the name of each YAML file once it is written, so that it can be used before
+    the later configs are generated (`generated_configs` can be a generator).
+
+    See `write_timestamped_config` for `sidecars`.
+    """
+    if sidecars is None:
+        sidecars = write_config_sidecars
+
+    timestamp_str = datetime.now().strftime('%Y%m%d_%H%M%S')
+    generated_config_dir = timestamp_str + '_stimuli'
+    if verbose:
+        print(f'Writing generated YAML under ./{generated_config_dir}/')
+
+    assert not exists(generated_config_dir)
+    os.mkdir(generated_config_dir)
+
+    for i, yaml_dict in enumerate(generated_configs):
+        assert type(yaml_dict) is dict
+        generated_yaml_fname = join(
+            generated_config_dir, f'{timestamp_str}_stimuli_{i}.yaml'
+        )
+        _write_generated_config(yaml_dict, generated_yaml_fname, sidecars)
+
+        yield generated_yaml_fname
+
+    if verbose:
+        print()
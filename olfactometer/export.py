@@ -0,0 +1,295 @@
+"""
+Export of generated (or manually written) configs under directory trees to a single
+table with one row per trial, for analysis across many experiments.
+
+Output format is picked by extension. .parquet and .arrow / .feather require `pyarrow`
+(`pip install olfactometer[export]`). .csv does not (list columns are JSON encoded).
+
+Config streams (multi-document YAML and .jsonl files, see `config_io.load_stream`) are
+exported too, with one set of rows per document.
+
+Exports are incremental: rows are cached (next to the output) by the path, modification
+time and size of each config, so only new or changed configs are parsed on re-export.
+Configs are only read: nothing is written to the config cache or next to the configs.
+"""
+
+import csv
+import json
+import os
+from os.path import splitext, isdir, join
+import pickle
+import warnings
+from typing import Any, Dict, Iterable, List, Optional
+
+from olfactometer import config_io, persist, util
+from olfactometer.trial_table import TrialTable
+
+
+# Order of columns in output.
+columns = (
+    # Path to config file.
+    'file',
+    # Index of the config in a config stream (0 for files with a single config).
+    'document_index',
+    'trial_index',
+    # All pins opened on the trial (including any balance pins).
+    'pins',
+    # These three have one element per pin in `pins` with an entry in `pins2odors`.
+    'odor_names',
+    'odor_abbrevs',
+    'odor_log10_concs',
+    # One element per flow controller, in the order of `flow_setpoints_sequence`.
+    'flow_mfc_ids',
+    'flow_sccm',
+    # Expected valve onset / offset, in seconds from start of the config. null if
+    # following hardware timing.
+    'expected_onset_s',
+    'expected_offset_s',
+)
+list_columns = ('pins', 'odor_names', 'odor_abbrevs', 'odor_log10_concs',
+    'flow_mfc_ids', 'flow_sccm'
+)
+
+config_suffixes = ('.yaml', '.json', config_io.jsonl_suffix)
+
+# Changed configs are parsed in a pool of processes if at least this many need to be.
+parallel_export_min_files = config_io.parallel_load_min_files
+
+
+def trial_rows(config_path: str, all_required_data, config_dict,
+    document_index: int = 0) -> List[Dict[str, Any]]:
+    """Returns one dict (with keys in `columns`) per trial in config.
+    """
+    table = TrialTable.from_all_required_data(all_required_data, config_dict)
+    pins2odors = util.get_pins2odors(config_dict) or dict()
+
+    pin_lists = table.pin_lists()
+    n_trials = len(table)
+
+    if table.sccm is not None:
+        flow_mfc_ids = [str(x) for x in table.mfc_ids]
+        flow_sccm = table.sccm.astype(float).tolist()
+    else:
+        flow_mfc_ids = []
+        flow_sccm = [[] for _ in range(n_trials)]
+
+    if table.onset_s is not None:
+        onsets_s = table.onset_s.tolist()
+        offsets_s = table.offset_s.tolist()
+    else:
+        onsets_s = offsets_s = [None] * n_trials
+
+    rows = []
+    for trial_index, pins in enumerate(pin_lists):
+        odors = [pins2odors[p] for p in pins if p in pins2odors]
+        rows.append({
+            'file': config_path,
+            'document_index': document_index,
+            'trial_index': trial_index,
+            'pins': pins,
+            'odor_names': [o['name'] for o in odors],
+            'odor_abbrevs': [o.get('abbrev') for o in odors],
+            'odor_log10_concs': [o.get('log10_conc') for o in odors],
+            'flow_mfc_ids': list(flow_mfc_ids),
+            'flow_sccm': flow_sccm[trial_index],
+            'expected_onset_s': onsets_s[trial_index],
+            'expected_offset_s': offsets_s[trial_index],
+        })
+
+    return rows
+
+
+def find_config_files(roots: Iterable[str]) -> List[str]:
+    """Returns sorted paths of all .yaml / .json files under each root (or root files).
+    """
+    config_paths = []
+    for root in roots:
+        if not isdir(root):
+            config_paths.append(root)
+            continue
+
+        for dirpath, _, fnames in os.walk(root):
+            config_paths.extend(join(dirpath, f) for f in fnames
+                if f.endswith(config_suffixes)
+            )
+
+    return sorted(config_paths)
+
+
+def _is_run_config(config_dict) -> bool:
+    # Not true of e.g. hardware configs, or generator inputs.
+    return type(config_dict) is dict and 'pin_sequence' in config_dict
+
+
+def _file_rows(config_path: str):
+    """Returns (rows, None), or (None, reason) if file is not a config we can export.
+    """
+    try:
+        if config_io.is_config_stream(config_path):
+            rows = []
+            for i, config_dict in enumerate(
+                config_io.iter_stream_config_dicts(config_path)):
+
+                if not _is_run_config(config_dict):
+                    continue
+
+                all_required_data, config_dict = config_io.load_dict(config_dict)
+                rows.extend(trial_rows(config_path, all_required_data, config_dict,
+                    document_index=i
+                ))
+
+            if len(rows) == 0:
+                return None, 'no pin_sequence'
+
+            return rows, None
+
+        all_required_data, config_dict = config_io.load(config_path)
+        if not _is_run_config(config_dict):
+            return None, 'no pin_sequence'
+
+        # Also in the try, as this raises ValueError for some invalid configs (e.g. if
+        # flow setpoints do not match the trials).
+        return trial_rows(config_path, all_required_data, config_dict), None
+
+    except config_io.config_errors as err:
+        return None, f'{type(err).__name__}: {err}'
+
+
+# Key in the row cache (which otherwise has config paths as keys) for the columns the
+# rows were made with.
+_cache_columns_key = None
+
+def _row_cache_path(output_path: str) -> str:
+    return f'{output_path}.rows.pkl'
+
+
+def export_rows(config_paths: List[str], cache_path: Optional[str] = None,
+    parallel: Optional[bool] = None, verbose: bool = False) -> List[Dict[str, Any]]:
+    """Returns rows for all trials in configs, only parsing those not in cache.
+
+    Args:
+        cache_path: pickle of path -> (file signature, rows or None), updated with the
+            newly parsed configs. Not used if None.
+
+        parallel: whether to parse configs in a pool of processes. If None, only does
+            so if at least `parallel_export_min_files` need to be parsed.
+    """
+    cache = dict()
+    if cache_path is not None:
+        persist.wait_for(cache_path, raise_errors=False)
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            try:
+                cache = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError) as err:
+                warnings.warn(f'ignoring unreadable export cache {cache_path}: {err}')
+
+        # Rows cached before the columns last changed can not be reused.
+        if cache.pop(_cache_columns_key, None) != columns:
+            cache = dict()
+
+    path2signature = {x: config_io.file_signature(x) for x in config_paths}
+    to_parse = [x for x in config_paths
+        if x not in cache or cache[x][0] != path2signature[x]
+    ]
+
+    if parallel is None:
+        parallel = len(to_parse) >= parallel_export_min_files
+
+    if parallel and len(to_parse) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(_file_rows, to_parse))
+    else:
+        results = [_file_rows(x) for x in to_parse]
+
+    for config_path, (rows, reason) in zip(to_parse, results):
+        if verbose and rows is None:
+            print(f'skipping {config_path} ({reason})')
+
+        cache[config_path] = (path2signature[config_path], rows)
+
+    if verbose:
+        print(f'parsed {len(to_parse)}/{len(config_paths)} configs (rest cached)')
+
+    if cache_path is not None and len(to_parse) > 0:
+        # Only keeping entries for configs in this export.
+        cache = {x: cache[x] for x in config_paths}
+        cache[_cache_columns_key] = columns
+        persist.write(cache_path, pickle.dumps(cache, protocol=pickle.HIGHEST_PROTOCOL))
+
+    return [row for x in config_paths if cache[x][1] is not None for row in cache[x][1]]
+
+
+def _write_csv(rows, output_path: str) -> None:
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: json.dumps(v) if k in list_columns else v
+                for k, v in row.items()
+            })
+
+
+def _write_arrow(rows, output_path: str) -> None:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('writing .parquet / .arrow output requires pyarrow. '
+            "install with 'pip install olfactometer[export]', or export to .csv."
+        )
+
+    # Explicit types, so list columns of all-null / empty lists are still typed.
+    schema = pa.schema([
+        ('file', pa.string()),
+        ('document_index', pa.int64()),
+        ('trial_index', pa.int64()),
+        ('pins', pa.list_(pa.int64())),
+        ('odor_names', pa.list_(pa.string())),
+        ('odor_abbrevs', pa.list_(pa.string())),
+        ('odor_log10_concs', pa.list_(pa.float64())),
+        ('flow_mfc_ids', pa.list_(pa.string())),
+        ('flow_sccm', pa.list_(pa.float64())),
+        ('expected_onset_s', pa.float64()),
+        ('expected_offset_s', pa.float64()),
+    ])
+    table = pa.Table.from_pydict({c: [row[c] for row in rows] for c in columns},
+        schema=schema
+    )
+
+    if output_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pq.write_table(table, output_path)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, output_path)
+
+
+output_suffix2writer = {
+    '.parquet': _write_arrow,
+    '.arrow': _write_arrow,
+    '.feather': _write_arrow,
+    '.csv': _write_csv,
+}
+
+def export(roots: Iterable[str], output_path: str, parallel: Optional[bool] = None,
+    verbose: bool = False) -> int:
+    """Writes one row per trial, for all configs under `roots`. Returns number of rows.
+    """
+    suffix = splitext(output_path)[1]
+    if suffix not in output_suffix2writer:
+        raise ValueError(f'output must end with one of {list(output_suffix2writer)}')
+
+    config_paths = find_config_files(roots)
+    rows = export_rows(config_paths, cache_path=_row_cache_path(output_path),
+        parallel=parallel, verbose=verbose
+    )
+    output_suffix2writer[suffix](rows, output_path)
+
+    if verbose:
+        print(f'wrote {len(rows)} trials from {len(config_paths)} files to '
+            f'{output_path}'
+        )
+
+    return len(rows)
@@ -3,21 +3,27 @@ Functions for controlling flows via Alicat mass flow controllers (MFCs).
 """
 
 import atexit
+from datetime import datetime
 import math
+import os
 from pprint import pprint
 import time
 import warnings
 
-from alicat import FlowController
-from serial.tools import list_ports
 import yaml
 
-from olfactometer import util, _DEBUG
+from olfactometer import util, mock_alicat, persist, _DEBUG
+from olfactometer.flow_schedule import flow_change_lead_s_key
 from olfactometer.generators import common
 
 
-# TODO use alicat mock.py contents to allow testing (if _DEBUG) flow stuff w/o flow
-# controllers connected
+# If this environment variable is set to '1', simulated flow controllers (see
+# `mock_alicat`) are used instead of any connected ones.
+MOCK_MFCS_ENVVAR = 'OLFACTOMETER_MOCK_MFCS'
+
+# Optional config key, also selecting simulated flow controllers. Either True, or a
+# dict of parameters (see `mock_alicat.default_params`).
+mock_flow_controllers_key = 'mock_flow_controllers'
 
 # Hardware config doesn't specify ports/addresses for flow controllers.
 class FlowHardwareNotConfigured(Exception):
@@ -52,11 +58,108 @@ safe_usb_ids_key = 'safe_usb_ids_to_check_for_mfcs'
 # FlowMeter.__init__. This dependency should be handled by setup.py.
 read_timeout_s = 0.1
 
+# alicat and pyserial are only imported once flow controllers are actually used (see
+# `_import_hardware`), so that importing this module (e.g. for config validation) does
+# not pay for them. Both replaced by `use_mock_flow_controllers`.
+FlowController = None
+_comports = None
+_mock_params = None
+
+def _import_hardware() -> None:
+    global FlowController, _comports
+    if FlowController is None:
+        from alicat import FlowController
+
+    if _comports is None:
+        from serial.tools import list_ports
+        _comports = list_ports.comports
+
+
+def use_mock_flow_controllers(params=None) -> None:
+    """Makes all flow controller functions here use simulated flow controllers.
+
+    Args:
+        params: dict of simulation parameters (see `mock_alicat.default_params`).
+            Simulated device state is only reset if these differ from the last call.
+    """
+    global FlowController, _comports, _mock_params
+
+    params = dict() if params is None else params
+    if _mock_params == params:
+        return
+
+    mock_alicat.configure(params)
+    FlowController = mock_alicat.MockFlowController
+    _comports = mock_alicat.comports
+    _mock_params = params
+
+    # So ports found for real flow controllers are not used for simulated ones (or
+    # vice versa).
+    _address2port.clear()
+    _address2port_identity.clear()
+    _whitelist_ports.clear()
+
+
+# Attributes of `list_ports.comports` outputs saved (in the address->port cache) to
+# identify the USB-to-serial adapter each flow controller was last found on. Device
+# paths (e.g. /dev/ttyUSB0, COM3) can change across reboots / re-plugging, but the
+# others (when the adapter provides them) should not.
+_port_identity_attrs = ('device', 'vid', 'pid', 'serial_number', 'location')
+
+def _port_identity(port) -> dict:
+    return {k: getattr(port, k, None) for k in _port_identity_attrs}
+
+
+def _find_last_port(ports, last_port):
+    """Returns element of `ports` matching `last_port`, or None if there isn't one.
+
+    Args:
+        ports: outputs of `list_ports.comports`
+        last_port: either a port identity dict (see `_port_identity`), or str device
+            path (as in caches written by older versions)
+    """
+    if last_port is None:
+        return None
+
+    if type(last_port) is str:
+        last_port = {'device': last_port}
+
+    vid_pid = (last_port.get('vid'), last_port.get('pid'))
+
+    # In order of preference. Serial numbers should be unique to each adapter, and
+    # locations (USB bus / hub port path) are stable as long as it's plugged into the
+    # same place. Device path is only used if we have nothing else to go on.
+    for attr in ('serial_number', 'location'):
+        value = last_port.get(attr)
+        if value is None:
+            continue
+
+        matches = [p for p in ports
+            if getattr(p, attr, None) == value and (p.vid, p.pid) == vid_pid
+        ]
+        if len(matches) == 1:
+            return matches[0]
+
+    device = last_port.get('device')
+    for p in ports:
+        if p.device == device:
+            return p
+
+    return None
+
+
 _address2port = dict()
+# address -> identity (see `_port_identity`) of port each was found on.
+_address2port_identity = dict()
 _whitelist_ports = set()
 def find_port_for_controller_address(address, safe_usb_ids_to_check_for_mfcs=None,
     unsafe=False, _last_port=None):
     """
+    Args:
+        _last_port: identity of port (see `_find_last_port`) where controller was last
+            found. Checked first, so that in the common case only one port needs to be
+            probed.
+
     Raises FlowHardwareNotFound if no flow controller can be found with this address.
     """
     # TODO just raise FlowHardwareNotConfigured probably (as if ID for a manifold's flow
@@ -76,21 +179,17 @@ def find_port_for_controller_address(address, safe_usb_ids_to_check_for_mfcs=Non
     if _DEBUG:
         print(f'searching for MFC with address {address}')
 
-    ports = sorted(list_ports.comports())
+    _import_hardware()
+    ports = sorted(_comports())
 
-    if _last_port is not None:
-
-        last_port_obj = None
-        other_port_objs = []
-        for p in ports:
-            if p.device == _last_port:
-                last_port_obj = p
-            else:
-                other_port_objs.append(p)
+    last_port_obj = _find_last_port(ports, _last_port)
+    if last_port_obj is not None:
+        if _DEBUG:
+            print(f'last port for address {address} now at {last_port_obj.device}')
 
-        if last_port_obj is not None:
-            # Just re-ordering to try the last known port first, if it's provided.
-            ports = [last_port_obj] + other_port_objs
+        # Just re-ordering to try the last known port first. If the probe of that port
+        # fails, we fall back to checking all the others.
+        ports = [last_port_obj] + [p for p in ports if p is not last_port_obj]
 
     for port in ports:
         if port.device in _address2port.values():
@@ -117,6 +216,7 @@ def find_port_for_controller_address(address, safe_usb_ids_to_check_for_mfcs=Non
             print('found')
 
         _address2port[address] = port.device
+        _address2port_identity[address] = _port_identity(port)
         return port.device
 
     raise FlowHardwareNotFound(f'no (whitelisted) port found for MFC address {address}')
@@ -126,7 +226,7 @@ _mfc_id2initial_get_output = dict()
 def open_alicat_controller(mfc_id=None, *, port=None, address=None, id_type=None,
     save_initial_setpoints=True, check_gas_is_air=True, verbose=False,
     safe_usb_ids_to_check_for_mfcs=None, _skip_read_check=False, _last_port=None
-    ) -> FlowController:
+    ) -> 'FlowController':
     """Returns opened alicat.FlowController for controller on input port/address.
 
     Also registers atexit function to close connection and restore previous setpoints.
@@ -140,6 +240,8 @@ def open_alicat_controller(mfc_id=None, *, port=None, address=None, id_type=None
     if save_initial_setpoints or check_gas_is_air:
         _skip_read_check = False
 
+    _import_hardware()
+
     if sum([x is not None for x in [mfc_id, port, address]]) != 1:
         raise ValueError('specify exactly one of mfc_id, port, or address. mfc_id '
             'will select between port/address behavior based on id_type'
@@ -230,16 +332,53 @@ def open_alicat_controller(mfc_id=None, *, port=None, address=None, id_type=None
     return c
 
 
-def _are_flows_constant(mfc_id2flows):
+def parse_flow_setpoints(flow_setpoints_sequence):
+    """Returns `trial_table.FlowSetpoints` for flow_setpoints_sequence.
+
+    Also takes an already parsed `FlowSetpoints` (returned as-is), so callers can parse
+    once and pass that along.
+    """
+    # Deferred so that importing this module does not require numpy.
+    from olfactometer.trial_table import FlowSetpoints
+
+    if isinstance(flow_setpoints_sequence, FlowSetpoints):
+        return flow_setpoints_sequence
+
+    # olf.run will have called validate_flow_setpoints_sequence on the input already
+    # (via validate_config_dict), so we can assume that it is either all addresses or
+    # all ports, and that all trials have data for all MFCs (among other things).
+    if len(flow_setpoints_sequence) == 0 or len(flow_setpoints_sequence[0]) == 0:
+        raise ValueError("first flow controller settings missing 'address' or 'port'")
+
+    return FlowSetpoints.from_sequence(flow_setpoints_sequence)
+
+
+def parse_flow_setpoints_sequence(flow_setpoints_sequence):
+    """Returns id_type ('address'|'port') and dict of MFC ID -> list of flows.
+
+    Each list of flows has one element per trial.
+    """
+    flows = parse_flow_setpoints(flow_setpoints_sequence)
+    return flows.id_type, flows.mfc_id2flows()
+
+
+def are_flows_constant(config_dict, flows=None) -> bool:
     """True if each MFC only has one flow for the whole experiment, False otherwise.
+
+    Args:
+        flows: `trial_table.FlowSetpoints` already parsed from config_dict, if any.
     """
-    for one_mfc_trial_flows in mfc_id2flows.values():
-        if not all([x == one_mfc_trial_flows[0] for x in one_mfc_trial_flows]):
-            return False
-    return True
+    if flows is None:
+        flows = parse_flow_setpoints(config_dict[flow_setpoints_sequence_key])
+
+    return flows.are_constant()
 
 
 def _last_address2port_cache_fname(mkdir=False):
+    # So that simulated ports don't clobber the cache of real ones.
+    if _mock_params is not None:
+        return util.user_data_dir(mkdir=mkdir) / 'mock_last_address2port.yaml'
+
     return util.user_data_dir(mkdir=mkdir) / 'last_address2port.yaml'
 
 
@@ -263,12 +402,26 @@ def handle_flow_control_requirement(config_dict, err, warn_msg: str) -> None:
         pass
 
 
-def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
+def open_alicat_controllers(config_dict, flows=None, _skip_read_check=False,
+    verbose=False):
     """Returns a dict of str port/address -> opened alicat.FlowController
 
+    Args:
+        flows: `trial_table.FlowSetpoints` already parsed from config_dict (e.g. by
+            `config_io.load_compiled`). Parsed here if not passed.
+
     Raises:
         FlowHardwareNotFound (see `find_port_for_controller_address`)
     """
+    # Checked here (rather than on import), so the backend does not depend on what
+    # imported this module first. Parameters in the config take precedence.
+    mock_params = config_dict.get(mock_flow_controllers_key, False)
+    if not mock_params and os.environ.get(MOCK_MFCS_ENVVAR) == '1':
+        mock_params = True
+
+    if mock_params:
+        use_mock_flow_controllers(mock_params if type(mock_params) is dict else None)
+
     safe_usb_ids_to_check_for_mfcs = None
     # TODO require this is here? thread unsafe= kwarg thru (from inner find_* call)?
     if safe_usb_ids_key in config_dict:
@@ -289,10 +442,18 @@ def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
             print('USB (vid, pid) whitelist, to allow searching for MFCs:')
             pprint(safe_usb_ids_to_check_for_mfcs)
 
+    if _mock_params is not None:
+        safe_usb_ids_to_check_for_mfcs = (safe_usb_ids_to_check_for_mfcs or set()) | {
+            mock_alicat.mock_usb_ids
+        }
+
     # TODO move into find_port_for_controller_address (set a "private" global cache
     # var)?
+    # Values are port identities (see `_port_identity`), or str device paths in caches
+    # written by older versions.
     cache_fname = _last_address2port_cache_fname(mkdir=True)
-    last_address2port = None
+    persist.wait_for(cache_fname, raise_errors=False)
+    last_address2port = dict()
     if cache_fname.exists():
         with open(cache_fname, 'r') as f:
             last_address2port = yaml.safe_load(f)
@@ -302,46 +463,20 @@ def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
             print(f'address->port read from cache at {cache_fname}:')
             pprint(last_address2port)
 
-    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
-
-    # olf.run will have called validate_flow_setpoints_sequence on the input already
-    # (via validate_config_dict), so we can assume that it is either all addresses or
-    # all ports, and that all trials have data for all MFCs (among other things).
-    first_flow_setpoint_dict = flow_setpoints_sequence[0][0]
-
-    if 'address' in first_flow_setpoint_dict:
-        id_type = 'address'
-
-    elif 'port' in first_flow_setpoint_dict:
-        id_type = 'port'
-    else:
-        raise ValueError("first flow controller settings missing 'address' or 'port'")
+    if flows is None:
+        flows = parse_flow_setpoints(config_dict[flow_setpoints_sequence_key])
 
-    mfc_id_set = set()
-    mfc_id2flows = dict()
-    for trial_setpoints in flow_setpoints_sequence:
-        for one_controller_setpoint in trial_setpoints:
-            mfc_id = one_controller_setpoint[id_type]
-            mfc_id_set.add(mfc_id)
-
-            sccm = one_controller_setpoint['sccm']
-            if mfc_id not in mfc_id2flows:
-                mfc_id2flows[mfc_id] = [sccm]
-            else:
-                mfc_id2flows[mfc_id].append(sccm)
+    id_type = flows.id_type
+    mfc_id_set = set(flows.mfc_ids)
 
     # Checking we can find the ports of all flow controller addresses before we try
     # opening any, so that we can decide not to err if require_flow_controllers=False
     if id_type == 'address':
         for address in mfc_id_set:
-            last_port = None
-            if last_address2port is not None:
-                last_port = last_address2port[address]
-
             try:
                 port = find_port_for_controller_address(address,
                     safe_usb_ids_to_check_for_mfcs=safe_usb_ids_to_check_for_mfcs,
-                    _last_port=last_port
+                    _last_port=last_address2port.get(address)
                 )
 
             except FlowHardwareNotFound:
@@ -357,8 +492,8 @@ def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
     for mfc_id in sorted_mfc_ids:
         last_port = None
         # TODO rename to address2last_port (and elsewhere)?
-        if id_type == 'address' and last_address2port is not None:
-            last_port = last_address2port[mfc_id]
+        if id_type == 'address':
+            last_port = last_address2port.get(mfc_id)
 
         print(f'- {mfc_id} ...', end='', flush=True)
 
@@ -379,9 +514,13 @@ def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
         mfc_id2flow_controller[mfc_id] = c
         print('done', flush=True)
 
-    with open(cache_fname, 'w') as f:
-        # _address2port populated in the open_alicat_controller calls above
-        yaml.safe_dump(_address2port, f)
+    # _address2port_identity populated in the open_alicat_controller calls above.
+    # Keeping entries for addresses not used this time, for other configs.
+    address2port = dict(last_address2port)
+    address2port.update(_address2port_identity)
+    # Only rewriting if something moved (or is new), which should be rare.
+    if address2port != last_address2port:
+        persist.write(cache_fname, yaml.safe_dump(address2port))
 
     if _DEBUG:
         took_s = time.time() - start_s
@@ -396,14 +535,15 @@ def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
         pprint(whitelist_ports_without_mfcs)
 
     # TODO factor out
-    are_flows_constant = _are_flows_constant(mfc_id2flows)
+    are_flows_constant = flows.are_constant()
     if not are_flows_constant:
+        mins = flows.sccm.min(axis=0).tolist()
+        maxs = flows.sccm.max(axis=0).tolist()
         # TODO maybe put behind verbose
         print('\n[min, max] requested flows (in mL/min) for each flow controller:')
         for mfc_id in sorted_mfc_ids:
-            fmin = min(mfc_id2flows[mfc_id])
-            fmax = max(mfc_id2flows[mfc_id])
-            print(f'- {mfc_id}: [{fmin:.1f}, {fmax:.1f}]')
+            column = flows.mfc_id2column[mfc_id]
+            print(f'- {mfc_id}: [{mins[column]:.1f}, {maxs[column]:.1f}]')
         print()
 
     # TODO TODO somehow check all flow rates (min/max over course of sequence)
@@ -424,10 +564,15 @@ def open_alicat_controllers(config_dict, _skip_read_check=False, verbose=False):
 _called_set_flow_setpoints = False
 _mfc_id2last_flow_rate = dict()
 def set_flow_setpoints(mfc_id2flow_controller, trial_setpoints,
-    check_set_flows=False, silent=False, verbose=False):
+    check_set_flows=False, silent=False, verbose=False, changed_mfc_ids=None):
     """
     Args:
         silent: if True, overrides verbose and nothing is printed at all
+
+        changed_mfc_ids: if passed, IDs of the only MFCs whose setpoints differ from
+            those of the last call (see `trial_table.FlowSetpoints.changed_mfc_ids`),
+            so the others are not compared to the last setpoints we sent. MFCs we have
+            not successfully set yet are still always set.
     """
 
     global _called_set_flow_setpoints
@@ -460,7 +605,12 @@ def set_flow_setpoints(mfc_id2flow_controller, trial_setpoints,
         sccm = one_controller_setpoint['sccm']
 
         unchanged = False
-        if mfc_id in _mfc_id2last_flow_rate:
+        if changed_mfc_ids is not None:
+            unchanged = (mfc_id not in changed_mfc_ids and
+                mfc_id in _mfc_id2last_flow_rate
+            )
+
+        elif mfc_id in _mfc_id2last_flow_rate:
             last_sccm = _mfc_id2last_flow_rate[mfc_id]
             if last_sccm == sccm:
                 unchanged = True
@@ -495,21 +645,20 @@ def set_flow_setpoints(mfc_id2flow_controller, trial_setpoints,
             # TODO also print full traceback
             print(e)
             erred = True
+            # So it is set again on the next call, even if changed_mfc_ids is passed
+            # and does not include it.
+            _mfc_id2last_flow_rate.pop(mfc_id, None)
             continue
 
         _mfc_id2last_flow_rate[mfc_id] = sccm
 
         # TODO TODO shouldn't i need to wait some amount of time for it to achieve the
         # setpoint? what value is appropriate?
+        # (flow_worker does this check asynchronously, in batches, instead)
         if check_set_flows:
-            data = c.get()
-
-            # TODO may need to change tolerance args because of precision limits
-            if not math.isclose(data['setpoint'], sccm):
-                raise RuntimeError('commanded setpoint was not reflected '
-                    f'in subsequent query. set: {sccm:.1f}, got: '
-                    f'{data["set_point"]:.1f}'
-                )
+            mismatches = check_setpoints({mfc_id: c}, {mfc_id: sccm})
+            if len(mismatches) > 0:
+                raise RuntimeError(format_setpoint_mismatch(mismatches[0]))
 
             if not silent and verbose:
                 print('setpoint check OK')
@@ -523,6 +672,44 @@ def set_flow_setpoints(mfc_id2flow_controller, trial_setpoints,
         )
 
 
+def check_setpoints(mfc_id2flow_controller, mfc_id2sccm):
+    """Returns list of dicts, for each setpoint not reflected in a query of controller.
+
+    Each flow controller in `mfc_id2sccm` is queried once. Dicts have keys 'mfc_id',
+    'commanded_sccm', 'reported_sccm' (None if query failed) and 'error' (str, if query
+    failed).
+
+    Does NOT check achieved flow rates.
+    """
+    mismatches = []
+    for mfc_id, sccm in mfc_id2sccm.items():
+        c = mfc_id2flow_controller[mfc_id]
+        try:
+            reported_sccm = c.get()['setpoint']
+            error = None
+        except OSError as err:
+            reported_sccm = None
+            error = str(err)
+
+        # TODO may need to change tolerance args because of precision limits
+        if reported_sccm is None or not math.isclose(reported_sccm, sccm):
+            mismatches.append({'mfc_id': mfc_id, 'commanded_sccm': sccm,
+                'reported_sccm': reported_sccm, 'error': error
+            })
+
+    return mismatches
+
+
+def format_setpoint_mismatch(mismatch) -> str:
+    msg = (f"commanded setpoint for {mismatch['mfc_id']} was not reflected in "
+        f"subsequent query. set: {mismatch['commanded_sccm']:.1f}, "
+    )
+    if mismatch['reported_sccm'] is None:
+        return msg + f"query failed: {mismatch['error']}"
+
+    return msg + f"got: {mismatch['reported_sccm']:.1f}"
+
+
 # TODO if i ever set gas (or anything beyond set points) rename to
 # restore_initial_flowcontroller_settings or something + also restore those
 # things here
@@ -542,6 +729,196 @@ def restore_initial_setpoints(mfc_id2flow_controller, verbose=False):
         c.set_flow_rate(initial_setpoint)
 
 
+# Used when we don't have a response profile (see `characterize_controller`) for each
+# flow controller in use.
+default_mfc_settling_wait_s = 2.0
+
+# Flow is considered settled once it stays within the larger of these (the first is a
+# fraction of the size of the step) of the final flow.
+settling_tolerance_frac = 0.02
+settling_tolerance_sccm = 0.5
+
+def _response_profiles_fname(mkdir=False):
+    return util.user_data_dir(mkdir=mkdir) / 'mfc_response_profiles.yaml'
+
+
+def load_response_profiles():
+    """Returns dict of MFC address/port -> response profile dict (empty if none saved).
+
+    See `characterize_controller` for contents of each profile.
+    """
+    profiles_fname = _response_profiles_fname()
+    if not profiles_fname.exists():
+        return dict()
+
+    with open(profiles_fname, 'r') as f:
+        profiles = yaml.safe_load(f)
+
+    assert type(profiles) is dict, f'malformed {profiles_fname}'
+    return profiles
+
+
+def save_response_profiles(mfc_id2profile) -> None:
+    """Updates saved profiles with input, leaving any other saved profiles.
+    """
+    profiles = load_response_profiles()
+    profiles.update(mfc_id2profile)
+
+    profiles_fname = _response_profiles_fname(mkdir=True)
+    # So an interrupted write can not leave a truncated file, which every later run
+    # would fail to read (see `settling_time_s`).
+    persist.write_atomic(profiles_fname, yaml.safe_dump(profiles, sort_keys=False))
+
+    print(f'Wrote flow controller response profiles to {profiles_fname}')
+
+
+def measure_step_response(c: 'FlowController', to_sccm, duration_s=5.0):
+    """Changes setpoint and samples flow as fast as possible for duration_s.
+
+    Returns (times_s, flows_sccm) lists, with times relative to when the setpoint
+    change was sent.
+    """
+    times_s = []
+    flows_sccm = []
+
+    # Monotonic, as only differences between these times are used.
+    start_s = time.perf_counter()
+    c.set_flow_rate(float(to_sccm))
+
+    while True:
+        data = c.get()
+        t_s = time.perf_counter() - start_s
+
+        times_s.append(t_s)
+        flows_sccm.append(data['mass_flow'])
+
+        if t_s >= duration_s:
+            break
+
+    return times_s, flows_sccm
+
+
+def fit_step_response(times_s, flows_sccm, from_sccm, to_sccm):
+    """Returns dict with rise time, settling time, and overshoot of one step.
+
+    - 'rise_time_s': time from 10% to 90% of the way to the final flow.
+    - 'settling_time_s': time after which flow stays within tolerance (see
+      `settling_tolerance_[frac|sccm]`) of the final flow.
+    - 'overshoot_frac': how far flow went past the final flow, as a fraction of the
+      step size.
+
+    The final flow is taken as the mean of the last 20% of samples, rather than the
+    setpoint, so that a constant offset between setpoint and achieved flow doesn't
+    prevent the flow from ever being considered settled.
+    """
+    assert len(times_s) == len(flows_sccm) and len(times_s) > 0
+    step_sccm = to_sccm - from_sccm
+    if step_sccm == 0:
+        raise ValueError('from_sccm and to_sccm must differ')
+
+    n_final = max(1, len(flows_sccm) // 5)
+    final_sccm = sum(flows_sccm[-n_final:]) / n_final
+
+    # Signed, so that all of this works for steps down too.
+    direction = 1 if step_sccm > 0 else -1
+    final_step_sccm = final_sccm - from_sccm
+    progress = [(f - from_sccm) / final_step_sccm if final_step_sccm != 0 else 1.0
+        for f in flows_sccm
+    ]
+
+    def first_time_reaching(frac):
+        for t, p in zip(times_s, progress):
+            if p >= frac:
+                return t
+        return times_s[-1]
+
+    rise_time_s = first_time_reaching(0.9) - first_time_reaching(0.1)
+
+    tolerance_sccm = max(settling_tolerance_frac * abs(step_sccm),
+        settling_tolerance_sccm
+    )
+    settling_time_s = 0.0
+    for t, f in zip(times_s, flows_sccm):
+        if abs(f - final_sccm) > tolerance_sccm:
+            settling_time_s = t
+
+    peak_past_final_sccm = max(direction * (f - final_sccm) for f in flows_sccm)
+    overshoot_frac = max(0.0, peak_past_final_sccm / abs(step_sccm))
+
+    return {
+        'rise_time_s': float(rise_time_s),
+        'settling_time_s': float(settling_time_s),
+        'overshoot_frac': float(overshoot_frac),
+    }
+
+
+def characterize_controller(c: 'FlowController', setpoints_sccm, duration_s=5.0,
+    verbose=False):
+    """Steps controller between each pair of setpoints and summarizes the responses.
+
+    Returns profile dict with the worst case (max) of each value returned by
+    `fit_step_response`, across all the steps, along with the individual steps.
+    Controller will be left at the last setpoint.
+    """
+    setpoints_sccm = [float(x) for x in setpoints_sccm]
+    if len(setpoints_sccm) < 2:
+        raise ValueError('need at least two setpoints to characterize step responses')
+
+    # Stepping up through the setpoints and then back down, so we measure steps in
+    # both directions.
+    sequence = setpoints_sccm + setpoints_sccm[-2::-1]
+
+    # Starting from a settled state at the first setpoint.
+    measure_step_response(c, sequence[0], duration_s=duration_s)
+
+    steps = []
+    for from_sccm, to_sccm in zip(sequence[:-1], sequence[1:]):
+        times_s, flows_sccm = measure_step_response(c, to_sccm, duration_s=duration_s)
+        step = fit_step_response(times_s, flows_sccm, from_sccm, to_sccm)
+
+        sample_rate_hz = len(times_s) / times_s[-1]
+        step.update({'from_sccm': from_sccm, 'to_sccm': to_sccm,
+            'sample_rate_hz': float(sample_rate_hz)
+        })
+        if verbose:
+            pprint(step)
+
+        steps.append(step)
+
+    return {
+        'rise_time_s': max(x['rise_time_s'] for x in steps),
+        'settling_time_s': max(x['settling_time_s'] for x in steps),
+        'overshoot_frac': max(x['overshoot_frac'] for x in steps),
+        'measured': datetime.now().isoformat(timespec='seconds'),
+        'steps': steps,
+    }
+
+
+def settling_time_s(mfc_ids, default=None, profiles=None):
+    """Returns max saved settling time across input MFCs.
+
+    Returns `default` if any of them do not have a saved response profile.
+
+    Args:
+        profiles: as returned by `load_response_profiles`, which is called if this is
+            not passed.
+    """
+    if profiles is None:
+        profiles = load_response_profiles()
+
+    settling_times_s = []
+    for mfc_id in mfc_ids:
+        if mfc_id not in profiles:
+            return default
+
+        settling_times_s.append(profiles[mfc_id]['settling_time_s'])
+
+    if len(settling_times_s) == 0:
+        return default
+
+    return max(settling_times_s)
+
+
 total_flow_key = 'total_flow_ml_per_min'
 odor_flow_key = 'odor_flow_ml_per_min'
 
@@ -549,9 +926,10 @@ def generate_flow_setpoint_sequence(input_config_dict, hardware_dict, generated_
 
     # used to just return input here, but trying to generate this twice should indicate
     # code issue
-    assert flow_setpoints_sequence_key not in generated_config, (
-        'trying to generate flow config twice'
-    )
+    # (only checking dicts, as checking generators would consume them)
+    assert not (isinstance(generated_config, dict) and
+        flow_setpoints_sequence_key in generated_config
+    ), 'trying to generate flow config twice'
 
     # No experiment-wide flow specified
     if not ((total_flow_key in input_config_dict) or
@@ -622,6 +1000,7 @@ def generate_flow_setpoint_sequence(input_config_dict, hardware_dict, generated_
         return mfc_id
 
     require_flow_controllers = input_config_dict.get(require_flow_controllers_key)
+    flow_change_lead_s = input_config_dict.get(flow_change_lead_s_key)
 
     carrier_mfc_id = _get_mfc_id('carrier_flow_controller_')
     odor_mfc_ids = sorted([_get_mfc_id(p) for p in odor_mfc_prefixes])
@@ -657,6 +1036,9 @@ def generate_flow_setpoint_sequence(input_config_dict, hardware_dict, generated_
         if require_flow_controllers is not None:
             config_dict[require_flow_controllers_key] = require_flow_controllers
 
+        if flow_change_lead_s is not None:
+            config_dict[flow_change_lead_s_key] = flow_change_lead_s
+
         if safe_usb_ids_key in hardware_dict:
             config_dict[safe_usb_ids_key] = hardware_dict[safe_usb_ids_key]
 
@@ -671,6 +1053,9 @@ def generate_flow_setpoint_sequence(input_config_dict, hardware_dict, generated_
         return one_experiment_config_with_flow_sequence(generated_config)
 
     # Should be an iterable containing configurations for a sequence of experiments
-    else:
+    elif isinstance(generated_config, list):
         return [one_experiment_config_with_flow_sequence(d) for d in generated_config]
 
+    # From generators that yield configs, which we want to keep lazy.
+    else:
+        return (one_experiment_config_with_flow_sequence(d) for d in generated_config)
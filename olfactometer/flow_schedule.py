@@ -0,0 +1,285 @@
+"""
+Deadline-driven scheduling of flow controller setpoint changes.
+
+All changes are computed before the run starts, from `flow_setpoints_sequence` and the
+known trial timing, so that each can be issued some lead time before the valve onset
+of the trial it is for (rather than whenever the run loop notices a new trial).
+"""
+
+import statistics
+import time
+import warnings
+from typing import Callable, Hashable, List, NamedTuple, Optional
+
+from olfactometer import timeline, _DEBUG
+
+
+# Optional top-level config key. Seconds before valve onset that the setpoint change
+# for a trial should be issued. If not specified, changes are issued at the start of
+# each trial (i.e. pre_pulse_us before valve onset), as they have always been.
+flow_change_lead_s_key = 'flow_change_lead_s'
+
+# Commands completing later than this after their deadline are reported as missed.
+default_late_tolerance_s = 0.05
+
+
+class ScheduledSetpointChange(NamedTuple):
+    # Index of the trial these setpoints are for.
+    trial_index: int
+    # Both of these are in seconds relative to the start of the sequence.
+    deadline_s: float
+    valve_onset_s: float
+    trial_setpoints: list
+    # IDs of the only flow controllers whose setpoints change, or None if all should be
+    # compared to their last setpoints (e.g. after a waveform).
+    changed_mfc_ids: Optional[tuple] = None
+
+
+def trial_valve_times_s(all_required_data, trial_index):
+    """Returns (onset, offset) of valve opening for trial, in seconds from start.
+
+    With a pulse train, these are the first onset and last offset.
+    """
+    trial = timeline.trial_timing(all_required_data.settings.timing)
+    trial_start_us = trial_index * trial.trial_us
+    return ((trial_start_us + trial.onset_us) / 1e6,
+        (trial_start_us + trial.offset_us) / 1e6
+    )
+
+
+def make_schedule(all_required_data, flow_setpoints_sequence, lead_s=None,
+    flows=None) -> List[ScheduledSetpointChange]:
+    """Returns list of setpoint changes, sorted by deadline.
+
+    Trials whose setpoints do not differ from those of the previous trial (and which
+    did not have any waveforms) are skipped, as is the first trial (which should be set
+    before the sequence starts).
+
+    Args:
+        lead_s: seconds before each valve onset to issue setpoint change. `None` means
+            the start of each trial. Deadlines will not be moved before the valve
+            offset of the previous trial, so that flow does not change during a pulse.
+
+        flows: `trial_table.FlowSetpoints` parsed from `flow_setpoints_sequence`, if
+            the caller already has it.
+    """
+    if all_required_data.settings.follow_hardware_timing:
+        raise ValueError('can not schedule flow changes when following hardware '
+            'timing'
+        )
+
+    pre_pulse_s = all_required_data.settings.timing.pre_pulse_us / 1e6
+    if lead_s is None:
+        lead_s = pre_pulse_s
+
+    if lead_s < 0:
+        raise ValueError(f'lead_s must be non-negative (got {lead_s})')
+
+    if flows is None:
+        from olfactometer.trial_table import FlowSetpoints
+        flows = FlowSetpoints.from_sequence(flow_setpoints_sequence)
+
+    changed_mfc_ids = flows.changed_mfc_ids
+    # If any flows followed a waveform (see `flow_stream`) on the last trial, they need
+    # to be set back to the trial setpoint, even if it is the same.
+    after_waveform_trials = {t + 1 for t in flows.trials_with_key('waveform')}
+    # e.g. a waveform starting on a trial without a change in setpoint.
+    extras_changed_trials = flows.trials_with_changed_extras()
+
+    schedule = []
+    clamped_trials = []
+    for trial_index in range(1, len(flow_setpoints_sequence)):
+        after_waveform = trial_index in after_waveform_trials
+        if not (changed_mfc_ids[trial_index] or after_waveform or
+            trial_index in extras_changed_trials):
+
+            continue
+
+        valve_onset_s, _ = trial_valve_times_s(all_required_data, trial_index)
+        _, last_offset_s = trial_valve_times_s(all_required_data, trial_index - 1)
+
+        deadline_s = valve_onset_s - lead_s
+        if deadline_s < last_offset_s:
+            deadline_s = last_offset_s
+            clamped_trials.append(trial_index)
+
+        schedule.append(ScheduledSetpointChange(trial_index=trial_index,
+            deadline_s=deadline_s, valve_onset_s=valve_onset_s,
+            trial_setpoints=flow_setpoints_sequence[trial_index],
+            changed_mfc_ids=None if after_waveform else changed_mfc_ids[trial_index]
+        ))
+
+    if len(clamped_trials) > 0:
+        warnings.warn(f'{flow_change_lead_s_key}={lead_s:.2f} extends into previous '
+            'valve pulse. setpoint changes will be issued at previous valve offset for '
+            f'{len(clamped_trials)} trial(s)'
+        )
+
+    return sorted(schedule, key=lambda x: x.deadline_s)
+
+
+class FlowSetpointScheduler:
+    """Issues precomputed setpoint changes as their deadlines pass.
+
+    Call `start` with the time the sequence started, then `poll` as often as possible
+    (the run loop uses `seconds_until_next` to decide how long it can block).
+    """
+    def __init__(self, schedule: List[ScheduledSetpointChange],
+        set_fn: Callable[[list], Optional[Hashable]],
+        late_tolerance_s: float = default_late_tolerance_s,
+        pass_changed_mfc_ids: bool = False):
+        """
+        Args:
+            set_fn: called with the setpoints for one trial (an element of
+                `flow_setpoints_sequence`) when that trial's deadline passes. If it
+                returns None, the change is considered complete when it returns.
+                Otherwise, the return value should identify the (asynchronous) command
+                in a later call to `record_completion`.
+
+            pass_changed_mfc_ids: if True, `set_fn` is also passed the
+                `changed_mfc_ids` of each change, as a keyword argument (see
+                `flow.set_flow_setpoints`).
+        """
+        self.schedule = schedule
+        self.set_fn = set_fn
+        self.pass_changed_mfc_ids = pass_changed_mfc_ids
+        self.late_tolerance_s = late_tolerance_s
+
+        self.start_time_s = None
+        self._next_index = 0
+
+        # One dict per issued change. See `_complete` for keys.
+        self.records = []
+        # Tokens returned by `set_fn` -> records of changes not yet completed.
+        self._pending = dict()
+
+    def start(self, start_time_s: Optional[float] = None) -> None:
+        if start_time_s is None:
+            start_time_s = time.time()
+
+        self.start_time_s = start_time_s
+
+    def done(self) -> bool:
+        return self._next_index >= len(self.schedule)
+
+    def seconds_until_next(self, now_s: Optional[float] = None) -> Optional[float]:
+        """Returns seconds until next deadline (<= 0 if overdue), or None if done.
+        """
+        if self.done():
+            return None
+
+        if now_s is None:
+            now_s = time.time()
+
+        deadline_s = self.start_time_s + self.schedule[self._next_index].deadline_s
+        return deadline_s - now_s
+
+    def poll(self, now_s: Optional[float] = None) -> int:
+        """Issues all changes whose deadline has passed. Returns number issued.
+        """
+        assert self.start_time_s is not None, 'must call start first'
+
+        # Issuing commands takes time, so we re-check the clock after each, unless the
+        # caller is supplying the time.
+        use_clock = now_s is None
+        if use_clock:
+            now_s = time.time()
+
+        n_issued = 0
+        while not self.done():
+            change = self.schedule[self._next_index]
+            deadline_s = self.start_time_s + change.deadline_s
+            if now_s < deadline_s:
+                break
+
+            self._next_index += 1
+
+            issued_s = time.time()
+            if self.pass_changed_mfc_ids:
+                token = self.set_fn(change.trial_setpoints,
+                    changed_mfc_ids=change.changed_mfc_ids
+                )
+            else:
+                token = self.set_fn(change.trial_setpoints)
+
+            record = {
+                'trial_index': change.trial_index,
+                'deadline_s': deadline_s,
+                'valve_onset_s': self.start_time_s + change.valve_onset_s,
+                'issued_s': issued_s,
+            }
+            self.records.append(record)
+            if token is None:
+                self._complete(record, time.time())
+            else:
+                self._pending[token] = record
+
+            n_issued += 1
+
+            if use_clock:
+                now_s = time.time()
+
+        return n_issued
+
+    def _complete(self, record: dict, completed_s: float) -> None:
+        record['lateness_s'] = completed_s - record['deadline_s']
+        record['command_s'] = completed_s - record['issued_s']
+        # Time between setpoint change completing and valve opening.
+        record['achieved_lead_s'] = record['valve_onset_s'] - completed_s
+
+    def record_completion(self, token: Hashable, completed_s: float) -> None:
+        """Records when an asynchronous change (identified by `token`) completed.
+
+        Tokens not returned by `set_fn` are ignored.
+        """
+        record = self._pending.pop(token, None)
+        if record is not None:
+            self._complete(record, completed_s)
+
+    def completed_records(self) -> List[dict]:
+        return [r for r in self.records if 'lateness_s' in r]
+
+    def missed_deadlines(self) -> List[dict]:
+        return [r for r in self.completed_records()
+            if r['lateness_s'] > self.late_tolerance_s
+        ]
+
+    def report(self) -> None:
+        """Prints summary of achieved timing. Warns about any missed deadlines.
+        """
+        n_scheduled = len(self.schedule)
+        if n_scheduled == 0:
+            return
+
+        n_issued = len(self.records)
+        if n_issued < n_scheduled:
+            warnings.warn(f'only {n_issued}/{n_scheduled} scheduled flow setpoint '
+                'changes were issued!'
+            )
+
+        completed = self.completed_records()
+        if len(completed) < n_issued:
+            warnings.warn(f'{n_issued - len(completed)}/{n_issued} issued flow '
+                'setpoint changes never completed!'
+            )
+
+        if len(completed) == 0:
+            return
+
+        leads = [r['achieved_lead_s'] for r in completed]
+        print(f'Flow setpoint changes: {n_issued}. Achieved lead before valve onset '
+            f'(min/median/max): {min(leads):.3f}/{statistics.median(leads):.3f}/'
+            f'{max(leads):.3f}s'
+        )
+
+        missed = self.missed_deadlines()
+        if len(missed) > 0:
+            worst = max(missed, key=lambda r: r['lateness_s'])
+            warnings.warn(f'{len(missed)}/{n_issued} flow setpoint changes finished '
+                f'more than {self.late_tolerance_s:.3f}s after their deadline (worst: '
+                f"trial {worst['trial_index'] + 1}, {worst['lateness_s']:.3f}s late)"
+            )
+
+        if _DEBUG:
+            command_times = [r['command_s'] for r in completed]
+            print(f'max time to issue setpoint change: {max(command_times):.3f}s')
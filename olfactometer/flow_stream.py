@@ -0,0 +1,350 @@
+"""
+Streaming of within-trial flow waveforms (ramps, steps, sinusoids) to flow controllers.
+
+Each element of a trial's setpoints in `flow_setpoints_sequence` may have an optional
+`waveform`, describing how that flow controller's setpoint should change (from the
+trial's `sccm`) during the trial. Waveforms are sampled before the run starts, and the
+samples are sent as their times pass. When the flow controllers can not keep up, any
+samples that became due while the last command was still in progress are coalesced
+(only the latest is sent for each flow controller).
+
+Example (times are seconds relative to valve onset of the same trial):
+```
+flow_setpoints_sequence:
+  - - address: A
+      sccm: 100
+      waveform:
+        type: ramp
+        start_s: -1.0
+        duration_s: 2.0
+        to_sccm: 500
+```
+"""
+
+import math
+import statistics
+import time
+import warnings
+from typing import Callable, Hashable, List, NamedTuple, Optional
+
+from olfactometer import _DEBUG
+from olfactometer.flow_schedule import trial_valve_times_s
+
+
+waveform_key = 'waveform'
+
+# Optional top-level config key. Maximum rate (per flow controller) at which ramps and
+# sinusoids are sampled. Steps are sent at the times they are specified at.
+flow_stream_rate_hz_key = 'flow_stream_rate_hz'
+default_flow_stream_rate_hz = 10.0
+
+# Required keys (beyond 'type', 'start_s' and 'duration_s') for each type of waveform.
+waveform_type2keys = {
+    # Linear change from the trial's sccm to to_sccm.
+    'ramp': ('to_sccm',),
+    # sccm + amplitude_sccm * sin(2 * pi * t / period_s), t from start_s.
+    'sine': ('amplitude_sccm', 'period_s'),
+    # List of [t_s (from start_s), sccm] pairs.
+    'steps': ('steps',),
+}
+
+# Seconds between checks on whether in-flight command has completed, while samples are
+# waiting on it.
+in_flight_poll_interval_s = 0.01
+
+# Samples sent later than this after their requested time are reported as late.
+default_late_tolerance_s = 0.05
+
+
+def validate_waveform(waveform) -> None:
+    """Raises ValueError if waveform is not a valid waveform specification.
+    """
+    if type(waveform) is not dict:
+        raise ValueError(f'{waveform_key} must be a mapping')
+
+    waveform_type = waveform.get('type')
+    if waveform_type not in waveform_type2keys:
+        raise ValueError(f'{waveform_key} type must be one of '
+            f'{list(waveform_type2keys)}'
+        )
+
+    required = ('start_s',) + waveform_type2keys[waveform_type]
+    if waveform_type != 'steps':
+        required = required + ('duration_s',)
+
+    for k in required:
+        if k not in waveform:
+            raise ValueError(f"{waveform_key} of type '{waveform_type}' must set {k}")
+
+    for k in ('start_s', 'duration_s', 'to_sccm', 'amplitude_sccm', 'period_s'):
+        if k in waveform and type(waveform[k]) not in (int, float):
+            raise ValueError(f'{waveform_key} {k} must be numeric')
+
+    if waveform.get('duration_s', 0) < 0:
+        raise ValueError(f'{waveform_key} duration_s must be non-negative')
+
+    if waveform.get('period_s', 1) <= 0:
+        raise ValueError(f'{waveform_key} period_s must be positive')
+
+    if waveform_type == 'steps':
+        steps = waveform['steps']
+        if type(steps) is not list or len(steps) == 0 or not all(
+            type(x) is list and len(x) == 2 and
+            all(type(v) in (int, float) for v in x) for x in steps):
+
+            raise ValueError(f'{waveform_key} steps must be a list of [t_s, sccm], '
+                'with numeric t_s and sccm'
+            )
+
+        step_times = [t for t, _ in steps]
+        if step_times != sorted(step_times):
+            raise ValueError(f'{waveform_key} steps must be in order of time')
+
+
+def waveform_samples(waveform, sccm, rate_hz=default_flow_stream_rate_hz,
+    clip: bool = True):
+    """Returns list of (time_s, sccm) from waveform, with time relative to valve onset.
+
+    Args:
+        sccm: the setpoint for the trial, which the waveform starts from
+
+        clip: if False, negative values are returned as-is, rather than set to 0
+            (for validation)
+    """
+    start_s = waveform['start_s']
+    waveform_type = waveform['type']
+
+    if waveform_type == 'steps':
+        values = [float(s) for _, s in waveform['steps']]
+        if clip:
+            values = [max(0.0, v) for v in values]
+
+        return [(start_s + t, v) for (t, _), v in zip(waveform['steps'], values)]
+
+    duration_s = waveform['duration_s']
+    n = max(1, int(math.ceil(duration_s * rate_hz)))
+    times_s = [duration_s * i / n for i in range(n + 1)]
+
+    if waveform_type == 'ramp':
+        to_sccm = waveform['to_sccm']
+        values = [sccm + (to_sccm - sccm) * t / duration_s if duration_s > 0
+            else to_sccm for t in times_s
+        ]
+
+    elif waveform_type == 'sine':
+        amplitude_sccm = waveform['amplitude_sccm']
+        period_s = waveform['period_s']
+        values = [sccm + amplitude_sccm * math.sin(2 * math.pi * t / period_s)
+            for t in times_s
+        ]
+
+    # Negative flows are not possible (sines could otherwise dip below 0).
+    if clip:
+        values = [max(0.0, v) for v in values]
+
+    return [(start_s + t, v) for t, v in zip(times_s, values)]
+
+
+def has_waveforms(flow_setpoints_sequence) -> bool:
+    return any(waveform_key in x for trial_setpoints in flow_setpoints_sequence
+        for x in trial_setpoints
+    )
+
+
+class StreamSample(NamedTuple):
+    # Seconds relative to the start of the sequence.
+    time_s: float
+    trial_index: int
+    mfc_id: str
+    # Element for one flow controller, as in `flow_setpoints_sequence`.
+    setpoint: dict
+
+
+def make_stream(all_required_data, flow_setpoints_sequence,
+    rate_hz=default_flow_stream_rate_hz) -> List[StreamSample]:
+    """Returns samples of all waveforms in `flow_setpoints_sequence`, sorted by time.
+    """
+    if all_required_data.settings.follow_hardware_timing:
+        raise ValueError('can not stream flow waveforms when following hardware '
+            'timing'
+        )
+
+    samples = []
+    for trial_index, trial_setpoints in enumerate(flow_setpoints_sequence):
+        valve_onset_s, _ = trial_valve_times_s(all_required_data, trial_index)
+
+        for one_controller_setpoint in trial_setpoints:
+            if waveform_key not in one_controller_setpoint:
+                continue
+
+            id_type = 'address' if 'address' in one_controller_setpoint else 'port'
+            mfc_id = one_controller_setpoint[id_type]
+
+            for t_s, sccm in waveform_samples(one_controller_setpoint[waveform_key],
+                one_controller_setpoint['sccm'], rate_hz=rate_hz):
+
+                samples.append(StreamSample(time_s=valve_onset_s + t_s,
+                    trial_index=trial_index, mfc_id=mfc_id,
+                    setpoint={id_type: mfc_id, 'sccm': sccm}
+                ))
+
+    return sorted(samples, key=lambda x: x.time_s)
+
+
+class FlowStreamer:
+    """Sends waveform samples as their times pass, coalescing when behind.
+
+    Used like `flow_schedule.FlowSetpointScheduler`: `start`, then `poll` often, with
+    `record_completion` for asynchronous `set_fn`s.
+    """
+    def __init__(self, samples: List[StreamSample],
+        set_fn: Callable[[list], Optional[Hashable]],
+        late_tolerance_s: float = default_late_tolerance_s):
+        """
+        Args:
+            set_fn: called with a list of setpoints (one element per flow controller,
+                as in `flow_setpoints_sequence`). See `FlowSetpointScheduler`.
+        """
+        self.samples = samples
+        self.set_fn = set_fn
+        self.late_tolerance_s = late_tolerance_s
+
+        self.start_time_s = None
+        self._next_index = 0
+
+        # mfc_id -> latest sample that is due but not yet sent.
+        self._due = dict()
+        self._in_flight = None
+        self.n_coalesced = 0
+
+        # One dict per sent sample. See `_complete` for keys.
+        self.records = []
+        # Token from `set_fn` -> records of samples sent in that command.
+        self._pending = dict()
+
+    def start(self, start_time_s: Optional[float] = None) -> None:
+        if start_time_s is None:
+            start_time_s = time.time()
+
+        self.start_time_s = start_time_s
+
+    def done(self) -> bool:
+        return self._next_index >= len(self.samples) and len(self._due) == 0
+
+    def seconds_until_next(self, now_s: Optional[float] = None) -> Optional[float]:
+        """Returns seconds until next sample is due (<= 0 if any are), None if done.
+
+        Often ~0 during a waveform, so this should only bound how long the caller waits
+        between `poll`s (e.g. for whole lines from `olf.SerialLineReader`), never the
+        serial port timeout, which would split lines.
+        """
+        if len(self._due) > 0:
+            # Can't send those until the in-flight command completes, which we only find
+            # out about by polling.
+            return 0.0 if self._in_flight is None else in_flight_poll_interval_s
+
+        if self.done():
+            return None
+
+        if now_s is None:
+            now_s = time.time()
+
+        return self.start_time_s + self.samples[self._next_index].time_s - now_s
+
+    def poll(self, now_s: Optional[float] = None) -> int:
+        """Sends latest due sample for each flow controller. Returns number sent.
+
+        Nothing is sent while the last command is still in progress.
+        """
+        assert self.start_time_s is not None, 'must call start first'
+
+        if now_s is None:
+            now_s = time.time()
+
+        while self._next_index < len(self.samples):
+            sample = self.samples[self._next_index]
+            if now_s < self.start_time_s + sample.time_s:
+                break
+
+            if sample.mfc_id in self._due:
+                self.n_coalesced += 1
+
+            self._due[sample.mfc_id] = sample
+            self._next_index += 1
+
+        if self._in_flight is not None or len(self._due) == 0:
+            return 0
+
+        due = sorted(self._due.values(), key=lambda x: x.mfc_id)
+        self._due = dict()
+
+        issued_s = time.time()
+        token = self.set_fn([x.setpoint for x in due])
+
+        records = [{
+            'trial_index': x.trial_index,
+            'mfc_id': x.mfc_id,
+            'sccm': x.setpoint['sccm'],
+            'requested_s': self.start_time_s + x.time_s,
+            'issued_s': issued_s,
+        } for x in due]
+        self.records.extend(records)
+
+        if token is None:
+            self._complete(records, time.time())
+        else:
+            self._in_flight = token
+            self._pending[token] = records
+
+        return len(due)
+
+    def _complete(self, records, completed_s: float) -> None:
+        for r in records:
+            r['completed_s'] = completed_s
+            r['lateness_s'] = completed_s - r['requested_s']
+
+    def record_completion(self, token: Hashable, completed_s: float) -> None:
+        """Records when an asynchronous command completed. Unknown tokens are ignored.
+        """
+        records = self._pending.pop(token, None)
+        if records is None:
+            return
+
+        self._complete(records, completed_s)
+        if self._in_flight == token:
+            self._in_flight = None
+
+    def completed_records(self) -> List[dict]:
+        return [r for r in self.records if 'lateness_s' in r]
+
+    def report(self) -> None:
+        """Prints summary of achieved vs requested timing. Warns if any were late.
+        """
+        n_requested = len(self.samples)
+        if n_requested == 0:
+            return
+
+        completed = self.completed_records()
+        print(f'Flow waveform samples: {n_requested} requested, {len(self.records)} '
+            f'sent ({self.n_coalesced} coalesced)'
+        )
+        if len(completed) == 0:
+            return
+
+        lateness = [r['lateness_s'] for r in completed]
+        print('Lateness vs requested time (min/median/max): '
+            f'{min(lateness):.3f}/{statistics.median(lateness):.3f}/'
+            f'{max(lateness):.3f}s'
+        )
+
+        n_late = sum([x > self.late_tolerance_s for x in lateness])
+        if self.n_coalesced > 0 or n_late > 0:
+            warnings.warn(f'flow controllers could not keep up with waveforms '
+                f'({self.n_coalesced} samples coalesced, {n_late} sent more than '
+                f'{self.late_tolerance_s:.3f}s late). consider lowering '
+                f'{flow_stream_rate_hz_key}'
+            )
+
+        if _DEBUG:
+            command_times = [r['completed_s'] - r['issued_s'] for r in completed]
+            print(f'max time to send waveform samples: {max(command_times):.3f}s')
@@ -0,0 +1,436 @@
+"""
+Runs all flow controller I/O in a separate process, so that slow or unresponsive flow
+controllers can not delay reading from the Arduino (which trial tracking relies on).
+
+The main process sends commands through a bounded queue, each with a deadline, and gets
+results (and timing telemetry) back through another queue. Outstanding commands that
+pass their deadline are reported, rather than blocking the run.
+"""
+
+import atexit
+import itertools
+import multiprocessing
+import queue
+import time
+import traceback
+import warnings
+from typing import Dict, List, Optional
+
+from olfactometer import flow, _DEBUG
+
+
+class FlowWorkerError(RuntimeError):
+    pass
+
+
+# Bound on the number of commands that can be waiting for the worker. If this is ever
+# reached, the worker is far enough behind that it is better to report it than to keep
+# piling up setpoint changes that will all be late.
+default_max_queued_commands = 16
+
+# Seconds after the last setpoint change (with check_set_flows) before the worker reads
+# back setpoints to verify them. Changes made within this time of each other are all
+# verified together, and no reads happen while there are other commands to process.
+default_verify_delay_s = 0.1
+
+# Default seconds (from submission) each command has to complete, after which the flow
+# controllers it involves are considered hung. Each get/set seems to take ~0.05s.
+default_command_timeout_s = 1.0
+
+
+def _error_info(err: Exception):
+    """Returns (type name, message, traceback) for sending err from the worker.
+
+    Errors are not sent as-is, because those from hardware libraries can hold serial
+    ports or other state that fails to pickle, which the main process would only see
+    as a worker that never responds.
+    """
+    return type(err).__name__, str(err), traceback.format_exc()
+
+
+def _worker_error(error_info) -> Exception:
+    """Returns an error to raise in the main process, for output of `_error_info`.
+    """
+    name, msg, tb = error_info
+    # So callers can still handle missing hardware as configured (see
+    # `flow.handle_flow_control_requirement`).
+    if name == flow.FlowHardwareNotFound.__name__:
+        return flow.FlowHardwareNotFound(msg)
+
+    return FlowWorkerError(f'{name} in flow controller worker: {msg}\n\n'
+        f'Worker traceback:\n{tb}'
+    )
+
+
+def _worker_main(config_dict, flows, command_queue, result_queue, verbose=False,
+    verify_delay_s=default_verify_delay_s) -> None:
+
+    try:
+        mfc_id2flow_controller, are_flows_constant = flow.open_alicat_controllers(
+            config_dict, flows=flows, verbose=verbose
+        )
+    # Sending it back so the main process can decide what to do with it (e.g.
+    # FlowHardwareNotFound when require_flow_controllers is not True).
+    except Exception as err:
+        result_queue.put({'kind': 'opened', 'error': _error_info(err)})
+        return
+
+    result_queue.put({'kind': 'opened', 'mfc_ids': sorted(mfc_id2flow_controller),
+        'are_flows_constant': are_flows_constant
+    })
+
+    # MFC ID -> last commanded setpoint, for changes not yet verified.
+    to_verify = dict()
+    # IDs of the 'set' commands those changes came from.
+    to_verify_command_ids = []
+    verify_at_s = None
+
+    def verify():
+        nonlocal verify_at_s
+
+        started_s = time.time()
+        mismatches = flow.check_setpoints(mfc_id2flow_controller, to_verify)
+        result_queue.put({'kind': 'verify', 'id': None, 'started_s': started_s,
+            'completed_s': time.time(), 'error': None,
+            'command_ids': list(to_verify_command_ids), 'n_checked': len(to_verify),
+            'mismatches': mismatches
+        })
+        to_verify.clear()
+        to_verify_command_ids.clear()
+        verify_at_s = None
+
+    try:
+        while True:
+            timeout_s = None
+            if verify_at_s is not None:
+                timeout_s = max(0.0, verify_at_s - time.time())
+
+            try:
+                command = command_queue.get(timeout=timeout_s)
+            # Only verifying once there is nothing else to do.
+            except queue.Empty:
+                verify()
+                continue
+
+            kind = command['kind']
+            if kind == 'stop':
+                if len(to_verify) > 0:
+                    verify()
+                break
+
+            started_s = time.time()
+            result = {'kind': kind, 'id': command['id'], 'started_s': started_s,
+                'error': None
+            }
+            try:
+                if kind == 'set':
+                    flow.set_flow_setpoints(mfc_id2flow_controller,
+                        command['trial_setpoints'], **command['kwargs']
+                    )
+                    if command['blank_line']:
+                        print()
+
+                    if command['check_set_flows']:
+                        for x in command['trial_setpoints']:
+                            mfc_id = x['address'] if 'address' in x else x['port']
+                            to_verify[mfc_id] = float(x['sccm'])
+
+                        to_verify_command_ids.append(command['id'])
+                        verify_at_s = time.time() + verify_delay_s
+
+                elif kind == 'get':
+                    result['value'] = {mfc_id: c.get()
+                        for mfc_id, c in mfc_id2flow_controller.items()
+                    }
+                else:
+                    raise ValueError(f'unrecognized command kind {kind}')
+
+            except Exception as err:
+                result['error'] = _error_info(err)
+
+            result['completed_s'] = time.time()
+            result_queue.put(result)
+
+    finally:
+        # atexit functions registered in this process (e.g. by set_flow_setpoints) will
+        # not run, because multiprocessing exits child processes via os._exit.
+        try:
+            flow.restore_initial_setpoints(mfc_id2flow_controller, verbose=verbose)
+        finally:
+            for c in mfc_id2flow_controller.values():
+                c.close()
+
+
+class FlowWorker:
+    """Main-process handle on a worker process that owns all flow controllers.
+    """
+    def __init__(self, config_dict, flows=None,
+        max_queued_commands=default_max_queued_commands,
+        command_timeout_s=default_command_timeout_s,
+        verify_delay_s=default_verify_delay_s, verbose=False):
+
+        self.command_timeout_s = command_timeout_s
+        self.verbose = verbose
+
+        self._command_queue = multiprocessing.Queue(maxsize=max_queued_commands)
+        self._result_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_worker_main,
+            args=(config_dict, flows, self._command_queue, self._result_queue, verbose,
+                verify_delay_s
+            ),
+            daemon=True
+        )
+
+        self._ids = itertools.count()
+        # command ID -> (kind, absolute deadline)
+        self._outstanding = dict()
+        self._reported_hung = set()
+        self._results = []
+        self.n_dropped = 0
+
+        # IDs of 'set' commands (with check_set_flows) not yet verified by worker.
+        self._unverified = set()
+        # Anything notable reported by the worker (currently just setpoint
+        # verification mismatches), as dicts with at least 'kind' and 'time_s'.
+        self.events = []
+
+        # Populated by `start`.
+        self.mfc_ids = None
+        self.are_flows_constant = None
+
+    def is_alive(self) -> bool:
+        return self._process.is_alive()
+
+    def start(self) -> None:
+        """Starts worker and waits for it to open all flow controllers.
+
+        Raises `flow.FlowHardwareNotFound` if the worker could not find flow
+        controllers, or `FlowWorkerError` for any other error it encountered opening
+        them.
+        """
+        self._process.start()
+
+        # No deadline here, as searching for MFCs on all whitelisted ports can take a
+        # while. Just making sure we don't wait forever if the worker dies.
+        while True:
+            try:
+                opened = self._result_queue.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise FlowWorkerError('flow controller worker exited before '
+                        'opening flow controllers'
+                    )
+
+        if opened.get('error') is not None:
+            self._process.join()
+            raise _worker_error(opened['error'])
+
+        self.mfc_ids = opened['mfc_ids']
+        self.are_flows_constant = opened['are_flows_constant']
+
+        atexit.register(self.stop)
+
+    def _submit(self, command, timeout_s=None) -> Optional[int]:
+        if timeout_s is None:
+            timeout_s = self.command_timeout_s
+
+        command_id = next(self._ids)
+        command['id'] = command_id
+
+        try:
+            self._command_queue.put_nowait(command)
+        except queue.Full:
+            self.n_dropped += 1
+            warnings.warn(f"flow controller command queue full. dropped '"
+                f"{command['kind']}' command. flow controllers may be hung!"
+            )
+            return None
+
+        self._outstanding[command_id] = (command['kind'], time.time() + timeout_s)
+        return command_id
+
+    def set_flow_setpoints(self, trial_setpoints, timeout_s=None, blank_line=False,
+        check_set_flows=False, **kwargs) -> Optional[int]:
+        """Queues change of setpoints. Returns command ID (None if dropped).
+
+        Args:
+            **kwargs: passed to `flow.set_flow_setpoints` in worker
+            blank_line: if True, worker prints an empty line after setting flows
+            check_set_flows: if True, worker will later read back setpoints (see
+                `default_verify_delay_s`). Mismatches are warned about and added to
+                `events`, rather than raising.
+        """
+        command_id = self._submit({'kind': 'set', 'trial_setpoints': trial_setpoints,
+            'kwargs': kwargs, 'blank_line': blank_line,
+            'check_set_flows': check_set_flows}, timeout_s=timeout_s
+        )
+        if check_set_flows and command_id is not None:
+            self._unverified.add(command_id)
+
+        return command_id
+
+    def get(self, timeout_s=None) -> Optional[int]:
+        """Queues read of all flow controllers. Returns command ID (None if dropped).
+
+        Result 'value' will be a dict of MFC ID -> output of `FlowController.get`.
+        """
+        return self._submit({'kind': 'get'}, timeout_s=timeout_s)
+
+    def poll(self) -> List[Dict]:
+        """Returns results completed since last call, without blocking.
+
+        Raises `FlowWorkerError` for any error encountered in the worker while
+        executing a command. Warns (once per command) about commands that have passed
+        their deadline.
+        """
+        new_results = []
+        while True:
+            try:
+                result = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if result['kind'] == 'verify':
+                self._handle_verification(result)
+            else:
+                self._outstanding.pop(result['id'], None)
+
+            new_results.append(result)
+
+        self._results.extend(new_results)
+
+        now_s = time.time()
+        for command_id, (kind, deadline_s) in self._outstanding.items():
+            if now_s > deadline_s and command_id not in self._reported_hung:
+                self._reported_hung.add(command_id)
+                warnings.warn(f"flow controller '{kind}' command did not complete "
+                    f'within its deadline ({now_s - deadline_s:.2f}s overdue). flow '
+                    'controller may be hung!'
+                )
+
+        if self._outstanding and not self._process.is_alive():
+            raise FlowWorkerError('flow controller worker died with '
+                f'{len(self._outstanding)} outstanding command(s)'
+            )
+
+        for result in new_results:
+            if result['error'] is not None:
+                raise _worker_error(result['error'])
+
+        return new_results
+
+    def _handle_verification(self, result) -> None:
+        self._unverified.difference_update(result['command_ids'])
+
+        for mismatch in result['mismatches']:
+            event = dict(mismatch)
+            event['kind'] = 'setpoint_mismatch'
+            event['time_s'] = result['completed_s']
+            self.events.append(event)
+
+            warnings.warn(flow.format_setpoint_mismatch(mismatch))
+
+    def wait(self, timeout_s: Optional[float] = None) -> List[Dict]:
+        """Waits for all outstanding commands (and verification). Returns results.
+
+        Will return early (after warning) if any outstanding command is still not done
+        `timeout_s` after its deadline. Default is `command_timeout_s`.
+        """
+        if timeout_s is None:
+            timeout_s = self.command_timeout_s
+
+        # Verification of setpoints has no deadline of its own, so waiting for it is
+        # bounded relative to when we start waiting.
+        now_s = time.time()
+        give_up_s = max([d for _, d in self._outstanding.values()] + [now_s]
+            ) + timeout_s
+
+        results = []
+        while len(self._outstanding) > 0 or len(self._unverified) > 0:
+            results.extend(self.poll())
+
+            if time.time() > give_up_s:
+                warnings.warn('gave up waiting on flow controller worker with '
+                    f'{len(self._outstanding)} outstanding command(s) and '
+                    f'{len(self._unverified)} unverified setpoint change(s)'
+                )
+                break
+
+            time.sleep(0.005)
+
+        return results
+
+    def report(self) -> None:
+        """Prints (or warns about) timing of all commands executed so far.
+        """
+        if self.n_dropped > 0 or len(self._reported_hung) > 0:
+            warnings.warn(f'{len(self._reported_hung)} flow controller command(s) '
+                f'missed their deadline and {self.n_dropped} were dropped'
+            )
+
+        n_mismatches = len([e for e in self.events if e['kind'] == 'setpoint_mismatch'])
+        if n_mismatches > 0:
+            warnings.warn(f'{n_mismatches} flow controller setpoint(s) did not match '
+                'what was commanded, when read back'
+            )
+
+        if _DEBUG and len(self._results) > 0:
+            durations_s = [r['completed_s'] - r['started_s'] for r in self._results]
+            print(f'flow controller worker: {len(self._results)} commands, max '
+                f'{max(durations_s):.3f}s'
+            )
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        """Stops worker, which restores initial setpoints before closing controllers.
+        """
+        if not self._process.is_alive():
+            return
+
+        try:
+            # Not using put_nowait, because stop should get in even if queue is full
+            # of commands that are about to be processed.
+            self._command_queue.put({'kind': 'stop'}, timeout=timeout_s)
+        except queue.Full:
+            pass
+
+        self._process.join(timeout_s)
+        if self._process.is_alive():
+            warnings.warn('flow controller worker did not stop in time. terminating. '
+                'initial flow controller setpoints may not have been restored!'
+            )
+            self._process.terminate()
+            self._process.join()
+
+
+_worker = None
+def get_worker(config_dict, flows=None, verbose=False) -> FlowWorker:
+    """Returns started worker for the flow controllers in config.
+
+    Re-uses the worker from the previous call if it controls the same flow
+    controllers (e.g. for the rest of the configs in a directory), so that their
+    setpoints are not restored between runs (as they are when a worker stops).
+
+    Args:
+        flows: `trial_table.FlowSetpoints` already parsed from config_dict, if any.
+    """
+    global _worker
+
+    if flows is None:
+        flows = flow.parse_flow_setpoints(config_dict[flow.flow_setpoints_sequence_key])
+
+    mfc_ids = sorted(flows.mfc_ids)
+
+    if _worker is not None and _worker.is_alive() and _worker.mfc_ids == mfc_ids:
+        _worker.are_flows_constant = flows.are_constant()
+        return _worker
+
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
+
+    worker = FlowWorker(config_dict, flows=flows, verbose=verbose)
+    worker.start()
+
+    _worker = worker
+    return worker
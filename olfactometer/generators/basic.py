@@ -93,7 +93,8 @@ def make_config_dict(generator_config_yaml_dict):
     Returns `dict` representation of YAML config for olfactometer. Also includes
     a `pins2odors` YAML dictionary which is not used by the olfactometer, but
     which is for tracking which odors certain pins corresponded to, at analysis
-    time.
+    time. If there are more odors than available pins, returns a generator of such
+    `dict`s instead (one per run).
 
     Used keys in the YAML that gets parsed and input to this function (as a
     dict):
@@ -173,26 +174,30 @@ def make_config_dict(generator_config_yaml_dict):
         if randomly_split_odors_into_runs:
             random.shuffle(unique_odors)
 
-        i = 0
-        generated_config_dicts = []
-        while True:
-            odor_subset = unique_odors[i:(i+len(available_valve_pins))]
+        # Generating each config only as it is needed, so the first can be written (and
+        # run) before the rest are generated.
+        def generate_config_dicts():
+            i = 0
+            while True:
+                odor_subset = unique_odors[i:(i+len(available_valve_pins))]
 
-            # without this check, would currently get one final config with empty odors
-            if len(odor_subset) == 0:
-                assert len(generated_config_dicts) > 0
-                return generated_config_dicts
+                # without this check, would currently get one final config with empty
+                # odors
+                if len(odor_subset) == 0:
+                    assert i > 0
+                    return
 
-            subset_input_config_dict = deepcopy(generator_config_yaml_dict)
-            subset_input_config_dict['odors'] = odor_subset
+                subset_input_config_dict = deepcopy(generator_config_yaml_dict)
+                subset_input_config_dict['odors'] = odor_subset
 
-            generated_config_dict = make_config_dict(subset_input_config_dict)
-            generated_config_dicts.append(generated_config_dict)
+                yield make_config_dict(subset_input_config_dict)
 
-            if len(odor_subset) < len(available_valve_pins):
-                return generated_config_dicts
+                if len(odor_subset) < len(available_valve_pins):
+                    return
 
-            i += len(available_valve_pins)
+                i += len(available_valve_pins)
+
+        return generate_config_dicts()
 
     fit_into_one_manifold_if_possible = data.get('fit_into_one_manifold_if_possible',
         True
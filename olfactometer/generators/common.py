@@ -2,10 +2,16 @@
 Utility functions shared by one or more config generators.
 """
 
-from typing import Dict, Optional, Tuple, List
+from typing import Any, Dict, Optional, Tuple, List
 
 from olfactometer import validation
-from olfactometer.olf import ConfigDict
+
+
+# Defined here rather than in `olf` (which re-exports it), so that importing this does
+# not require importing `olf` (and everything it imports).
+# TODO use elsewhere / check I'm only ever using str as (top-level) keys
+# Replace with TypeAlias if I ever switch to python >= 3.10
+ConfigDict = Dict[str, Any]
 
 
 # TODO maybe have `olfactometer` validate that all generator outputs have a
@@ -209,8 +215,14 @@ def add_pinlist(pinlist_at_each_trial, generated_config_dict) -> None:
     """Adds 'pin_sequence' key to dict, appropriately populated.
 
     pinlist_at_each_trial should be a list of lists, with each terminal element
-    being an int corresponding to a valid pin
+    being an int corresponding to a valid pin, or a `trial_table.TrialTable`.
     """
+    # Not imported at module level, as it requires numpy.
+    from olfactometer.trial_table import TrialTable
+
+    if isinstance(pinlist_at_each_trial, TrialTable):
+        pinlist_at_each_trial = pinlist_at_each_trial.pin_lists()
+
     validate_pinlist_list(pinlist_at_each_trial)
     generated_config_dict['pin_sequence'] = {
         'pin_groups': [{'pins': pins} for pins in pinlist_at_each_trial]
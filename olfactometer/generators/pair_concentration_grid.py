@@ -71,14 +71,15 @@ def make_config_dict(generator_config_yaml_dict):
     generator_config_yaml_dict (str): dict of parsed contents of YAML
       configuration file.
 
-    Returns `dict` representation of YAML config for olfactometer. Also includes
-    a `pins2odors` YAML dictionary which is not used by the olfactometer, but
-    which is for tracking which odors certain pins corresponded to, at analysis
-    time.
+    Yields `dict` representation of YAML config for olfactometer, for each pair.
+    Each also includes a `pins2odors` YAML dictionary which is not used by the
+    olfactometer, but which is for tracking which odors certain pins corresponded to,
+    at analysis time.
 
     When passed a Python file, rather than directly usable configuration YAML,
     the olfactometer will expect the Python file to have a function with this
-    name and this output behavior.
+    name and this output behavior (returning a `dict`, a list of them, or yielding
+    them).
     """
     data = generator_config_yaml_dict
 
@@ -240,7 +241,6 @@ def make_config_dict(generator_config_yaml_dict):
 
 
     # TODO refactor so loop body is just a function call?
-    generated_config_dicts = []
     for pair in odor_pairs:
         generated_config_dict = deepcopy(common_generated_config_dict)
 
@@ -543,13 +543,12 @@ def make_config_dict(generator_config_yaml_dict):
         generated_config_dict['pins2odors'] = pins2odors
         common.add_pinlist(pinlist_at_each_trial, generated_config_dict)
 
-        generated_config_dicts.append(generated_config_dict)
+        yield generated_config_dict
 
     # TODO check log10_conc: None (-> 'null' in YAML) gets parsed correctly back
     # to None during a round trip
 
-    # TODO want to squeeze output if list is only length 1?
-    return generated_config_dicts
+    # TODO want to squeeze output if only one config?
 
 
 # TODO delete / change to something that takes arbitrary input for testing /
@@ -565,7 +564,7 @@ if __name__ == '__main__':
     with open(generator_config_yaml_fname, 'r') as f:
         yaml_dict = yaml.safe_load(f)
 
-    generated_config_dict = make_config_dict(yaml_dict)
+    generated_config_dict = list(make_config_dict(yaml_dict))
 
     from pprint import pprint
     pprint(generated_config_dict)
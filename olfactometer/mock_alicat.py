@@ -0,0 +1,249 @@
+"""
+Simulated Alicat flow controllers, for testing / benchmarking flow control code without
+any connected.
+
+Implements the parts of the `alicat.FlowController` interface we use (`get`,
+`set_flow_rate`, `close` and `is_connected`), plus a `comports` replacement for
+`serial.tools.list_ports.comports` that lists the simulated ports.
+
+Modelled:
+- per-device latency (with jitter) for each get/set
+- first-order flow dynamics (flow approaches setpoint exponentially)
+- bus contention (transactions with devices on the same port are serialized)
+- occasional OSError (as real devices raise when a read fails after retries)
+
+See `flow.use_mock_flow_controllers` for how to select this backend.
+"""
+
+import math
+import random
+import threading
+import time
+from typing import NamedTuple, Optional
+
+
+# Not a real vendor/product ID. Always treated as safe to search for MFCs on, when
+# using the mock backend.
+mock_usb_ids = (0xF055, 0xA1CA)
+
+# Parameters (see `configure`) and their defaults.
+default_params = {
+    # Seconds each get/set takes, not including time waiting for the bus.
+    # Each real get/set seemed to take ~0.05s.
+    'latency_s': 0.05,
+    # Uniformly distributed on [0, latency_jitter_s], added to latency_s.
+    'latency_jitter_s': 0.01,
+    # Time constant of the (first-order) approach of flow to setpoint.
+    'time_constant_s': 0.3,
+    # Probability any one get/set raises OSError.
+    'error_rate': 0.0,
+    'full_scale_sccm': 2000.0,
+    'initial_setpoint_sccm': 0.0,
+    # Number of simulated ports listed by `comports`. Port i has one device, with
+    # address i letters after 'A'.
+    'n_ports': 8,
+    # If not None, a dict of port -> list of addresses on that port, instead of the
+    # layout described above.
+    'ports': None,
+    # Dict of address (or port, for devices on unlisted ports) -> dict overriding any
+    # of the device parameters above (latency / dynamics / errors / range).
+    'devices': None,
+    'seed': None,
+}
+
+_device_param_keys = ('latency_s', 'latency_jitter_s', 'time_constant_s', 'error_rate',
+    'full_scale_sccm', 'initial_setpoint_sccm'
+)
+
+
+class MockPortInfo(NamedTuple):
+    """Like the `ListPortInfo` objects returned by `list_ports.comports`.
+    """
+    device: str
+    vid: int
+    pid: int
+    serial_number: str
+    location: str
+    description: str = 'Mock Alicat flow controller'
+
+
+class _MockDevice:
+    def __init__(self, address, params):
+        self.address = address
+        for k in _device_param_keys:
+            setattr(self, k, params[k])
+
+        self.setpoint = self.initial_setpoint_sccm
+        # Flow at the time of the last setpoint change, and when that happened.
+        self._from_flow = self.setpoint
+        self._change_s = time.time()
+
+    def flow(self, now_s):
+        if self.time_constant_s <= 0:
+            return self.setpoint
+
+        decay = math.exp(-(now_s - self._change_s) / self.time_constant_s)
+        return self.setpoint + (self._from_flow - self.setpoint) * decay
+
+    def set_setpoint(self, sccm, now_s):
+        self._from_flow = self.flow(now_s)
+        self._change_s = now_s
+        self.setpoint = sccm
+
+
+class _MockBus:
+    def __init__(self, port, addresses, params, rng):
+        self.port = port
+        # Held for the duration of each transaction, as only one device on a serial
+        # bus can be talking at once.
+        self.lock = threading.Lock()
+
+        self.address2device = dict()
+        for address in addresses:
+            device_params = dict(params)
+            overrides = (params['devices'] or dict())
+            device_params.update(overrides.get(address, overrides.get(port, dict())))
+            self.address2device[address] = _MockDevice(address, device_params)
+
+        self.rng = rng
+        self.n_transactions = 0
+
+    def transaction(self, address, timeout_s, fn):
+        """Returns fn(device), after simulated latency. Raises OSError on failure.
+        """
+        with self.lock:
+            self.n_transactions += 1
+
+            device = self.address2device.get(address)
+            if device is None:
+                # As real devices do, after retries timeout when nothing responds.
+                time.sleep(timeout_s)
+                raise OSError(f'no response from address {address} on {self.port}')
+
+            time.sleep(device.latency_s + self.rng.uniform(0, device.latency_jitter_s))
+
+            if self.rng.random() < device.error_rate:
+                raise OSError(f'(simulated) failed to communicate with address '
+                    f'{address} on {self.port}'
+                )
+
+            return fn(device)
+
+
+_params = None
+_rng = None
+_port2bus = dict()
+
+def configure(params: Optional[dict] = None) -> None:
+    """Sets simulation parameters (see `default_params`), resetting all device state.
+    """
+    global _params, _rng
+
+    params = dict() if params is None else params
+    unknown = set(params) - set(default_params)
+    if len(unknown) > 0:
+        raise ValueError(f'unknown mock flow controller parameters: {unknown}')
+
+    _params = dict(default_params)
+    _params.update(params)
+    _rng = random.Random(_params['seed'])
+    _port2bus.clear()
+
+
+def _port_layout():
+    if _params['ports'] is not None:
+        return {p: list(addresses) for p, addresses in _params['ports'].items()}
+
+    return {f'/dev/mock_mfc{i}': [chr(ord('A') + i)] for i in range(_params['n_ports'])}
+
+
+def _get_bus(port) -> _MockBus:
+    if _params is None:
+        configure()
+
+    if port not in _port2bus:
+        layout = _port_layout()
+        if port in layout:
+            addresses = layout[port]
+
+        # Unlisted ports (referenced directly, by port, in config) have one device, at
+        # the default Alicat address.
+        elif _params['ports'] is None:
+            addresses = ['A']
+        else:
+            raise OSError(f'could not open port {port}: no such (mock) port')
+
+        _port2bus[port] = _MockBus(port, addresses, _params, _rng)
+
+    return _port2bus[port]
+
+
+def comports():
+    """Returns list of `MockPortInfo` for each simulated port.
+    """
+    if _params is None:
+        configure()
+
+    vid, pid = mock_usb_ids
+    # Serial numbers derived from the devices on each port, so they follow the devices
+    # if ports are renamed (as real adapter serial numbers would).
+    return [MockPortInfo(device=port, vid=vid, pid=pid,
+            serial_number='MOCK-' + ''.join(addresses), location=f'1-{i + 1}'
+        ) for i, (port, addresses) in enumerate(sorted(_port_layout().items()))
+    ]
+
+
+class MockFlowController:
+    def __init__(self, port='/dev/ttyUSB0', address='A', timeout=1.0):
+        self.port = port
+        self.address = address
+        self.timeout = timeout
+        self._bus = _get_bus(port)
+        self.open = True
+
+    def _test_controller_open(self):
+        if not self.open:
+            raise IOError(f'The FlowController with address {self.address} and port '
+                f'{self.port} is not open'
+            )
+
+    def get(self, retries=2):
+        self._test_controller_open()
+
+        def _get(device):
+            flow = device.flow(time.time())
+            return {
+                'pressure': 14.7,
+                'temperature': 22.0,
+                'volumetric_flow': flow,
+                'mass_flow': flow,
+                'setpoint': device.setpoint,
+                'gas': 'Air',
+                'control_point': 'flow',
+            }
+
+        return self._bus.transaction(self.address, self.timeout * (retries + 1), _get)
+
+    def set_flow_rate(self, flow, retries=2):
+        self._test_controller_open()
+
+        def _set(device):
+            if not 0 <= flow <= device.full_scale_sccm:
+                raise OSError(f'setpoint {flow} outside range [0, '
+                    f'{device.full_scale_sccm}] of address {device.address}'
+                )
+            device.set_setpoint(float(flow), time.time())
+
+        self._bus.transaction(self.address, self.timeout * (retries + 1), _set)
+
+    def close(self):
+        self.open = False
+
+    @staticmethod
+    def is_connected(port, address='A', timeout=1.0):
+        try:
+            c = MockFlowController(port, address, timeout=timeout)
+            c.get()
+            return True
+        except OSError:
+            return False
@@ -3,24 +3,23 @@ Core functions to run experiments on the olfactometer. Also functions for top-le
 config handling and communication with the firmware.
 """
 
-import binascii
+from copy import deepcopy
 from datetime import datetime, timedelta
 import glob
 import importlib.util
 from os.path import split, join, isdir, splitext, isfile
 from pprint import pprint
+import queue
+import threading
 import time
 import warnings
-from typing import Dict, Any
+from typing import Iterator, List, Optional, Set, Tuple
 
-import serial
-import pyperclip
 import yaml
-# TODO try to find a way of accessing this type without any prefix '_'s
-from google.protobuf.internal.encoder import _VarintBytes
-from readchar import readkey, key
 
-from olfactometer import config_io, util, upload, validation, flow
+from olfactometer import (config_io, util, upload, validation, flow, flow_schedule,
+    flow_stream, persist
+)
 from olfactometer.generators import common, basic, pair_concentration_grid
 from olfactometer import IN_DOCKER, _DEBUG
 
@@ -52,16 +51,14 @@ from olfactometer import IN_DOCKER, _DEBUG
 # pulse timing case
 
 
-# TODO use elsewhere / check I'm only ever using str as (top-level) keys
-# Replace with TypeAlias if I ever switch to python >= 3.10
-ConfigDict = Dict[str, Any]
+ConfigDict = common.ConfigDict
 
 
 # Using an 8 bit, unsigned type to represent this on the Arduino side.
 MAX_MSG_NUM = 255
 curr_msg_num = 0
 def write_message(ser, msg, verbose=False, use_message_nums=True,
-    arduino_debug_prints=True, ignore_ack=False):
+    arduino_debug_prints=True, ignore_ack=False, encoded=None):
     """
     Args:
     ser (serial.Serial): serial device to receive the message
@@ -75,18 +72,15 @@ def write_message(ser, msg, verbose=False, use_message_nums=True,
     arduino_debug_prints (bool, default=False): if True, reads all bytes in
         buffer before writing message num, to try to ensure the next byte we
         get back is just the message num.
+
+    encoded (bytes, optional): output of `util.encode_message(msg)`, if already
+        computed (e.g. cached by `config_io.load_compiled`).
     """
     # Since we are updating it in here, this is required.
     global curr_msg_num
 
-    serialized = msg.SerializeToString()
-    assert type(serialized) is bytes
-
-    # TODO check this calculation is still correct for stuff with "repeated"
-    # things in them
-    # https://www.datadoghq.com/blog/engineering/protobuf-parsing-in-python/
-    size = len(serialized)
-    varint_size = _VarintBytes(size)
+    if encoded is None:
+        encoded = util.encode_message(msg)
 
     def print_bytes(bs):
         s = bs.hex()
@@ -97,32 +91,16 @@ def write_message(ser, msg, verbose=False, use_message_nums=True,
         n_bytes_written = ser.write(bs)
         assert n_bytes_written == len(bs)
 
-    def crc16_0x1021(bs):
-        # This uses polynomial 0x1021 (same as what I'm using on Arduino side)
-        crc = binascii.crc_hqx(varint_size + serialized, 0xFFFF)
-
-        # TODO also check input size (...why?) / that output of crc *should* fit
-        # into 2 bytes?
-
-        # This 'big' [Endian] byte order works for comparing on Arduino side,
-        # with current code there.
-        crc_bytes = crc.to_bytes(2, 'big')
-        assert type(crc_bytes) is bytes and len(crc_bytes) == 2
-        return crc_bytes
-
     # TODO add unit tests where random parts of data and / or crc are changed
     # (after crc calculation, but before sending) (-> verify failure)
-    crc_bytes = crc16_0x1021(varint_size + serialized)
 
     '''
     if verbose:
-        print('size: ', end='')
-        print_bytes(varint_size)
-        print('serialized: ', end='')
-        print_bytes(serialized)
+        print('encoded: ', end='')
+        print_bytes(encoded)
     '''
 
-    n_bytes = len(varint_size) + len(serialized) + 2
+    n_bytes = len(encoded)
     if use_message_nums:
         n_bytes += 1
 
@@ -140,9 +118,7 @@ def write_message(ser, msg, verbose=False, use_message_nums=True,
     # under and over size)
     #write_bytes(serialized[:12])
 
-    write_bytes(varint_size)
-    write_bytes(serialized)
-    write_bytes(crc_bytes)
+    write_bytes(encoded)
 
     if use_message_nums:
         # TODO maybe do this between write and flush? does that guarantee it
@@ -250,6 +226,10 @@ def check_need_to_preprocess_config(config, hardware_config=None, verbose=False)
 
     # It should be a path to a .json/.yaml config file in this case.
     if type(config) is str:
+        # TODO support generators in (some of the documents of) these?
+        if config_io.is_config_stream(config):
+            return config
+
         # TODO refactor so json case isn't left out from generator handling
         # (or just drop json support, which might make more sense...)
         if config.endswith('.json'):
@@ -268,7 +248,7 @@ def check_need_to_preprocess_config(config, hardware_config=None, verbose=False)
         # is set and the config tries to override it? (which errors/things?)
 
         with open(config, 'r') as f:
-            generator_yaml_dict = yaml.safe_load(f)
+            generator_yaml_dict = config_io.safe_load_yaml(f)
 
     elif type(config) is dict:
         generator_yaml_dict = config
@@ -415,8 +395,13 @@ def check_need_to_preprocess_config(config, hardware_config=None, verbose=False)
     # something?
     # (though aren't keys from that in generated yaml anyway? or no?)
 
-    written_yaml_fname_or_dir = config_io.write_timestamped_config(generated_config)
-    return written_yaml_fname_or_dir
+    if isinstance(generated_config, (dict, list)):
+        written_yaml_fname_or_dir = config_io.write_timestamped_config(generated_config)
+        return written_yaml_fname_or_dir
+
+    # Generator output. Each config is generated and written as `config_iter` reaches
+    # it, so the first can run before the rest are generated.
+    return config_io.iter_write_timestamped_configs(generated_config)
 
 
 # TODO TODO maybe add a block=True flag to allow (w/ =False) to return, to not
@@ -424,6 +409,183 @@ def check_need_to_preprocess_config(config, hardware_config=None, verbose=False)
 # olfactometer and other code from one python script. not needed as a command
 # line arg, cause already a separate process at that point.
 # (or would this just make debugging harder, w/o prints from arduino?)
+class SerialLineReader:
+    """Reads whole lines from a serial port in a background thread.
+
+    `serial.Serial.readline` returns whatever it has when its timeout expires, which
+    can be part of a line. Partial reads are joined here, so `readline` only ever
+    returns complete lines, and the caller can wait for them with any timeout
+    (e.g. until the next flow setpoint deadline) without changing the port's.
+    """
+    def __init__(self, ser):
+        self._ser = ser
+        # Of complete lines (bytes, ending with b'\n'), or an exception from reading.
+        self._lines = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_lines, daemon=True)
+
+    def _read_lines(self) -> None:
+        partial = b''
+        try:
+            while not self._stop.is_set():
+                # Returns after at most the port timeout, so we can check _stop.
+                partial += self._ser.readline()
+                if partial.endswith(b'\n'):
+                    self._lines.put(partial)
+                    partial = b''
+
+        except Exception as err:
+            self._lines.put(err)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops reading. Must be called before the port is closed.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def readline(self, timeout_s: float) -> bytes:
+        """Returns next complete line, or b'' if there is none within timeout_s.
+
+        Re-raises any error from reading the port.
+        """
+        try:
+            if timeout_s <= 0:
+                line = self._lines.get_nowait()
+            else:
+                line = self._lines.get(timeout=timeout_s)
+
+        except queue.Empty:
+            return b''
+
+        if isinstance(line, Exception):
+            raise line
+
+        return line
+
+
+def _read_until_finished(line_reader: SerialLineReader, plan, start_time_s: float,
+    flow_senders=(), worker=None, follow_hardware_timing: bool = False,
+    print_lines: bool = True, max_wait_s: float = 0.1
+    ) -> Tuple[float, Set[int], List[float]]:
+    """Prints trial status and sends flow setpoints until firmware prints `Finished`.
+
+    Args:
+        plan: `run_plan.RunPlan` for the config being run.
+
+        flow_senders: started `flow_schedule.FlowSetpointScheduler` and / or
+            `flow_stream.FlowStreamer`, polled between lines.
+
+        worker: `flow_worker.FlowWorker` the flow_senders send to, polled for
+            completions. Required if there are any flow_senders.
+
+        print_lines: whether to print lines from the firmware (rather than the
+            precomputed `plan.trial_strs`).
+
+        max_wait_s: longest to wait for each line, if no flow setpoint is due sooner.
+
+    Returns time `Finished` was read, indices of trials seen, and seconds spent
+    waiting for each line.
+    """
+    from olfactometer.run_plan import finished_line
+
+    seen_trial_indices = set()
+    last_trial_idx = None
+    readline_times = []
+
+    # Number of trial status lines the Arduino has printed so far.
+    n_trial_lines = 0
+    warned_trial_line_mismatch = False
+
+    while True:
+        if not follow_hardware_timing:
+            # Couldn't parse output of readline() below in
+            # follow_hardware_timing case, because those prints come at [I
+            # believe] the odor pulse offsets there, so we would at least
+            # need to hardcode some delays or something.
+            trial_idx = plan.trial_index(time.time() - start_time_s)
+
+            # possible that trial_idx could be returned as None very briefly
+            # at the end
+            if trial_idx != last_trial_idx and trial_idx is not None:
+                # TODO maybe also suffix w/ pins in parens if verbose
+
+                # TODO get rid of '(s)' and just make plural when approp
+                # TODO fix how in case where using flow controllers + no
+                # pins2odors, printing order / spacing is diff on the first one
+                # (wrt the 'trial: ...' line)
+                if plan.trial_strs is not None:
+                    print(plan.trial_strs[trial_idx])
+                    # TODO maybe try to suffix w/ coarse tqdm progress
+                    # within each trial, to get an indication of when next
+                    # one is up.
+                    # https://stackoverflow.com/questions/62048408
+                    # maybe even visually change / mark odor region/onset
+                    # on progress bar?
+
+                last_trial_idx = trial_idx
+                seen_trial_indices.add(trial_idx)
+
+        # Only waiting for a line until the next flow setpoint is due, so that changes
+        # are not made up to max_wait_s late.
+        wait_s = max_wait_s
+        if len(flow_senders) > 0:
+            for sender in flow_senders:
+                sender.poll()
+
+            for result in worker.poll():
+                for sender in flow_senders:
+                    sender.record_completion(result['id'], result['completed_s'])
+
+            for sender in flow_senders:
+                until_next_s = sender.seconds_until_next()
+                if until_next_s is not None:
+                    wait_s = min(wait_s, max(0.0, until_next_s))
+
+        readline_t0 = time.time()
+
+        line = line_reader.readline(wait_s)
+
+        readline_times.append(time.time() - readline_t0)
+
+        if len(line) > 0:
+            try:
+                line = line.decode()
+                # still letting arduino do printing in this case for now,
+                # cause way i'm doing it in !follow_hardware_timing case
+                # relies on the known timing info.
+                if print_lines:
+                    print(line, end='')
+
+                if line.strip() == finished_line:
+                    return time.time(), seen_trial_indices, readline_times
+
+                # Checking trial pins reported match those we sent, by comparing
+                # to the precomputed lines.
+                # (might be useful to print odors in follow_hardware_timing
+                # case too, but not sure i care that much about that case
+                # anymore)
+                if line.startswith('trial: '):
+                    if not warned_trial_line_mismatch and (
+                        n_trial_lines >= plan.n_trials or line.strip() !=
+                        plan.firmware_events[n_trial_lines].line):
+
+                        warnings.warn('unexpected trial status from Arduino: '
+                            f'{line.strip()!r}'
+                        )
+                        warned_trial_line_mismatch = True
+
+                    n_trial_lines += 1
+
+            # Docs say decoding errors will be a ValueError or a subclass.
+            # UnicodeDecodeError, for instance, is a subclass.
+            except ValueError as e:
+                print(e)
+                print(line)
+
+
 # TODO TODO make sure version_mismatch checks that installed version is the used
 # version, if/when doing things that way (e.g. catch the case where the version
 # of util.py from the cwd, if cwd=~/src/olfactometer) has changes not reflected
@@ -436,10 +598,19 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
     """Runs a single configuration file on the olfactometer.
 
     Args:
-    config (str|dict|None): path to YAML or JSON file with settings
-        defining the olfactometer behavior. If `None` is passed, the config is
-        read from stdin.
+    config (str|dict|None|config_io.LoadedConfig): path to YAML or JSON file with
+        settings defining the olfactometer behavior. If `None` is passed, the config is
+        read from stdin. `LoadedConfig`s (as yielded by `config_iter`) are used
+        without loading or validating again.
     """
+    # Only needed to actually run a config. Imported here so that importing this module
+    # (e.g. for `config_iter`, in commands that only read configs) stays cheap.
+    import serial
+    import pyperclip
+    from readchar import readkey, key
+    from olfactometer import flow_worker
+    from olfactometer.run_plan import make_run_plan
+
     global curr_msg_num
     global baud_rate
     # We want to reset this at the beginning of each run of a single config
@@ -447,9 +618,37 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
     curr_msg_num = 0
 
     # TODO rename all_required_data to indicate it is the protobuf message(s)?
-    all_required_data, config_dict = config_io.load(config)
+    # TODO TODO make the function named `validate` work on config_dict, and
+    # rename current `validate` to something more specific, indicating it should
+    # be used w/ the AllRequiredData object (the settings that get communicated
+    # to the firmware)
+    if type(config) is config_io.LoadedConfig:
+        _, all_required_data, config_dict, flows = config
+        if config.path is not None:
+            # Already in memory, from when config_iter loaded it.
+            encoded_messages = config_io.load_compiled(config.path).encoded_messages
+        else:
+            # Will be encoded as they are sent.
+            encoded_messages = dict()
+
+        # Path (or None), for the parts below that only apply to configs from files.
+        config = config.path
+    else:
+        # Also validates (raising ValueError if invalid), and caches the results (and
+        # the encoded messages) for configs loaded from files.
+        all_required_data, config_dict, encoded_messages, flows = (
+            config_io.load_compiled(config)
+        )
+
+    if speed_factor is not None or ignore_ack:
+        # The loaded message may be shared with other callers (see
+        # `config_io.load_compiled`), so we must not modify it in place.
+        all_required_data = deepcopy(all_required_data)
 
     if speed_factor is not None:
+        # Cached encoding would not reflect the changes below.
+        encoded_messages = dict()
+
         warnings.warn('speeding up valve off periods by a factor of '
             f'{speed_factor} for testing faster'
         )
@@ -491,14 +690,6 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
             print('Additional config data:')
             pprint(extra_config)
 
-    # TODO TODO make the function named `validate` work on config_dict, and
-    # rename current `validate` to something more specific, indicating it should
-    # be used w/ the AllRequiredData object (the settings that get communicated
-    # to the firmware)
-    warn = True
-    validation.validate_config_dict(config_dict, warn=warn)
-    validation.validate_protobuf(all_required_data, warn=warn)
-
     if check_set_flows and flow.flow_setpoints_sequence_key not in config_dict:
         raise ValueError('check_set_flows=True only valid if '
             f'{flow.flow_setpoints_sequence_key} is appropriately populated in '
@@ -508,16 +699,14 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
     if try_parse:
         return
 
-    if check_set_flows:
-        # TODO maybe just err if not _DEBUG then?
-        warnings.warn('check_set_flows should only be used for debugging')
-
     if ignore_ack:
         if _first_run:
             warnings.warn('ignore_ack should only be used for debugging')
 
         # Default is False
         settings.no_ack = True
+        # Cached encoding would not reflect this change.
+        encoded_messages = dict()
 
     port, fqbn = upload.get_port_and_fqbn(port=port, fqbn=fqbn)
 
@@ -622,11 +811,12 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
     # Opening flow controllers and setting initial flows.
     # Want this to happen after Enter press for the same reason as below.
     flow_setpoints_sequence = None
+    worker = None
     if flow.flow_setpoints_sequence_key in config_dict:
         try:
-            mfc_id2flow_controller, are_flows_constant = flow.open_alicat_controllers(
-                config_dict, verbose=verbose
-            )
+            # All flow controller I/O happens in this worker process, so that slow or
+            # hung flow controllers can not delay the serial reads below.
+            worker = flow_worker.get_worker(config_dict, flows=flows, verbose=verbose)
             flow_setpoints_sequence = config_dict[flow.flow_setpoints_sequence_key]
 
         except flow.FlowHardwareNotFound as err:
@@ -636,16 +826,24 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
 
     if flow_setpoints_sequence is not None:
         if not verbose:
-            print('Initial ', end='')
-
-        flow.set_flow_setpoints(mfc_id2flow_controller, flow_setpoints_sequence[0],
-            verbose=verbose
+            # flush so this is printed before the worker's output
+            print('Initial ', end='', flush=True)
+
+        # Initial setpoints are outside of timed part of run, so we can afford to wait
+        # for these (and for opening / searching for flow controllers).
+        worker.set_flow_setpoints(flow_setpoints_sequence[0], verbose=verbose,
+            # Each MFC can take a few get/set round trips.
+            timeout_s=5.0
         )
+        worker.wait()
 
         # TODO TODO replace w/ checking flows and continuing once they get within some
         # tolerance
         # TODO skip if current flows (read before Enter) are same as requested?
-        mfc_settling_wait_s = 2.0
+        # (uses profiles saved by olf-mfc-response, if there are any for all MFCs)
+        mfc_settling_wait_s = flow.settling_time_s(worker.mfc_ids,
+            default=flow.default_mfc_settling_wait_s
+        )
         print(f'Waiting {mfc_settling_wait_s:.1f}s for MFCs to reach set points...',
             end='', flush=True
         )
@@ -662,14 +860,60 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
 
     pins2odors = util.get_pins2odors(config_dict)
 
-    n_trials = util.number_of_trials(all_required_data)
-    one_trial_s = util.seconds_per_trial(all_required_data)
+    # Everything needed at each trial boundary is computed here, before connecting, so
+    # the loop below only needs to index into this.
+    plan = make_run_plan(all_required_data, config_dict, flows=flows)
+    n_trials = plan.n_trials
+    # None if following hardware timing.
+    one_trial_s = plan.trial_s
+    # None if no pins2odors.
+    trial_strs = plan.trial_strs
+
+    # validate_config_dict should have already checked flow setpoints are not used in
+    # follow_hardware_timing case.
+    flow_scheduler = None
+    flow_senders = []
+    if flow_setpoints_sequence is not None:
+        are_flows_constant = worker.are_flows_constant
+
+        def set_scheduled_flow_setpoints(trial_setpoints, changed_mfc_ids=None):
+            # TODO even if not verbose, should print something if flow is anything
+            # other than either default or initial flows when MFCs were turned on. or
+            # just always. just fit in the same line? or one line after?
+            # Returns as soon as command is queued. Completion is recorded when
+            # polling the worker in the loop below.
+            return worker.set_flow_setpoints(trial_setpoints,
+                check_set_flows=check_set_flows, silent=are_flows_constant,
+                verbose=verbose, blank_line=not are_flows_constant,
+                changed_mfc_ids=changed_mfc_ids
+            )
+
+        flow_scheduler = flow_schedule.FlowSetpointScheduler(plan.flow_changes,
+            set_scheduled_flow_setpoints, pass_changed_mfc_ids=True
+        )
+        flow_senders.append(flow_scheduler)
+
+        if flow_stream.has_waveforms(flow_setpoints_sequence):
+            def send_waveform_samples(setpoints):
+                return worker.set_flow_setpoints(setpoints, silent=True)
+
+            flow_streamer = flow_stream.FlowStreamer(
+                flow_stream.make_stream(all_required_data, flow_setpoints_sequence,
+                    rate_hz=config_dict.get(flow_stream.flow_stream_rate_hz_key,
+                        flow_stream.default_flow_stream_rate_hz
+                    )
+                ),
+                send_waveform_samples
+            )
+            flow_senders.append(flow_streamer)
+
+    readline_timeout_s = 0.1
 
     # TODO TODO define some class that has its own context manager that maybe
     # essentially wraps the Serial one? (just so people don't need that much
     # boilerplate, including explicit calls to pyserial, when using this in
     # other python code)
-    with serial.Serial(port, baud_rate, timeout=0.1) as ser:
+    with serial.Serial(port, baud_rate, timeout=readline_timeout_s) as ser:
         if verbose:
             print('Connected')
 
@@ -706,132 +950,44 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
                 print('Python version:', py_version_str)
                 print('Arduino version:', arduino_version_str)
 
-        write_message(ser, settings, ignore_ack=ignore_ack, verbose=verbose)
+        write_message(ser, settings, ignore_ack=ignore_ack, verbose=verbose,
+            encoded=encoded_messages.get('settings')
+        )
 
-        write_message(ser, pin_sequence, ignore_ack=ignore_ack, verbose=verbose)
+        write_message(ser, pin_sequence, ignore_ack=ignore_ack, verbose=verbose,
+            encoded=encoded_messages.get('pin_sequence')
+        )
 
         # TODO maybe use:
         # if settings.WhichOneof('control') == 'follow_hardware_timing':
         # here? seems to work though...
         if settings.follow_hardware_timing:
             print('Ready (waiting for hardware triggers)')
-        else:
-            if verbose:
-                print('Starting')
-
-            seen_trial_indices = set()
-            last_trial_idx = None
+        elif verbose:
+            print('Starting')
 
         # TODO err in not settings.follow_hardware_timing case, if enough time
         # has passed before we get first trial status print?
 
         start_time_s = time.time()
 
-        readline_times = []
+        if flow_scheduler is not None:
+            for sender in flow_senders:
+                sender.start(start_time_s)
 
-        while True:
-            if not settings.follow_hardware_timing:
-                # Couldn't parse output of readline() below in
-                # follow_hardware_timing case, because those prints come at [I
-                # believe] the odor pulse offsets there, so we would at least
-                # need to hardcode some delays or something.
-                trial_idx = util.curr_trial_index(start_time_s, one_trial_s,
-                    n_trials
-                )
-
-                # If there were much worry that some of the `ser.readline()`
-                # calls below (the only other thing in this loop that should be
-                # slow) could take long, we might want to set these flow
-                # setpoints in some parallel thread/process / use non-blocking
-                # IO in place of this readline() call. However, when I measured
-                # these delays they seemed stable around ~0.10[1-3]s. Most are
-                # right on 0.100s, but maybe slightly longer if actually reading
-                # data?
-
-                # possible that trial_idx could be returned as None very briefly
-                # at the end
-                if trial_idx != last_trial_idx and trial_idx is not None:
-                    trial_pins = util.get_trial_pins(pin_sequence, trial_idx)
-
-                    # TODO maybe also suffix w/ pins in parens if verbose
-
-                    # TODO get rid of '(s)' and just make plural when approp
-                    # TODO fix how in case where using flow controllers + no
-                    # pins2odors, printing order / spacing is diff on the first one
-                    # (wrt the 'trial: ...' line)
-                    if pins2odors is not None:
-                        # p not in pins2odors when it's an explicit balance pin
-                        print(f'trial: {trial_idx + 1}/{n_trials}, odor(s):',
-                            util.format_mixture_pins(pins2odors, trial_pins,
-                                show_abbrevs=False
-                            )
-                        )
-                        # TODO maybe try to suffix w/ coarse tqdm progress
-                        # within each trial, to get an indication of when next
-                        # one is up.
-                        # https://stackoverflow.com/questions/62048408
-                        # maybe even visually change / mark odor region/onset
-                        # on progress bar?
-
-                    # for the most part, this seemed to get printed some
-                    # *roughly* 0.1-0.5s after the old print passed through from
-                    # the arduino. could be consistent w/ just the ~0.1s i
-                    # observed for max_readline_s
-                    #print('trial_idx:', trial_idx)
-
-                    if flow_setpoints_sequence is not None:
-                        # TODO even if not verbose, should print something if flow is
-                        # anything other than either default or initial flows when MFCs
-                        # were turned on. or just always. just fit in the same line? or
-                        # one line after?
-                        flow.set_flow_setpoints(
-                            mfc_id2flow_controller,
-                            flow_setpoints_sequence[trial_idx],
-                            check_set_flows=check_set_flows,
-                            silent=are_flows_constant,
-                            verbose=verbose,
-                        )
-                        if not are_flows_constant:
-                            print()
-
-                    last_trial_idx = trial_idx
-                    seen_trial_indices.add(trial_idx)
-
-            readline_t0 = time.time()
-
-            line = ser.readline()
-
-            readline_t1 = time.time()
-            readline_s = readline_t1 - readline_t0
-            readline_times.append(readline_s)
-
-            if len(line) > 0:
-                try:
-                    line = line.decode()
-                    # still letting arduino do printing in this case for now,
-                    # cause way i'm doing it in !follow_hardware_timing case
-                    # relies on the known timing info.
-                    if pins2odors is None or settings.follow_hardware_timing:
-                        print(line, end='')
-
-                    if line.strip() == 'Finished':
-                        finish_time_s = time.time()
-                        break
-
-                    # TODO mayyybe could parse trial pins reported and compare
-                    # to expected. a bit paranoid though...
-                    # (might be useful to print odors in follow_hardware_timing
-                    # case too, but not sure i care that much about that case
-                    # anymore)
-                    #pins = [
-                    #    int(p) for p in line.split(':')[-1].strip().split(',')
-                    #]
-
-                # Docs say decoding errors will be a ValueError or a subclass.
-                # UnicodeDecodeError, for instance, is a subclass.
-                except ValueError as e:
-                    print(e)
-                    print(line)
+        # Lines are read in a background thread, so that waiting for them can be
+        # bounded by the next flow deadline, without ever splitting a line.
+        line_reader = SerialLineReader(ser)
+        line_reader.start()
+        try:
+            finish_time_s, seen_trial_indices, readline_times = _read_until_finished(
+                line_reader, plan, start_time_s, flow_senders=flow_senders,
+                worker=worker, follow_hardware_timing=settings.follow_hardware_timing,
+                print_lines=pins2odors is None or settings.follow_hardware_timing,
+                max_wait_s=readline_timeout_s
+            )
+        finally:
+            line_reader.stop()
 
         max_readline_s = max(readline_times)
         # Were all right around 0.1s last I measured
@@ -841,6 +997,16 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
                 f'({max_readline_s:.3f}s)'
             )
 
+        if flow_scheduler is not None:
+            # Any changes still outstanding should have finished well before now.
+            for result in worker.wait():
+                for sender in flow_senders:
+                    sender.record_completion(result['id'], result['completed_s'])
+
+            for sender in flow_senders:
+                sender.report()
+            worker.report()
+
         duration_s = finish_time_s - start_time_s
 
         # If we are just triggering off of input pulses, as in
@@ -859,7 +1025,8 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
             expected_seen_trials_indices = set(range(n_trials))
             if not seen_trial_indices == expected_seen_trials_indices:
                 missing = expected_seen_trials_indices - seen_trial_indices
-                warnings.warn('flow controller updating might have missed '
+                # (flow setpoint changes are tracked separately, by flow_scheduler)
+                warnings.warn('trial status printing might have missed '
                     'some trials!'
                 )
 
@@ -880,14 +1047,24 @@ def run(config, port=None, fqbn=None, do_upload=False, timeout_s=2.0,
 
 
 # TODO maybe add a flag like verbose but just for this fn?
-# TODO maybe this should also call load and yield (all_required_data, config_dict)
-# (to avoid duplicating logic testing what type config is and branching on that)
 def config_iter(config, hardware_config=None, _skip_config_preprocess_check=False,
-    verbose=False):
-    """Generates a sequences of config (str | dict), each as `run` input
-
-    config (str|dict|None): str can be a path to a config file or a directory containing
-        a sequence of them (must be numbered following convention)
+    verbose=False, parallel_load=None):
+    """Generates a sequence of `config_io.LoadedConfig`, each as `run` input
+
+    config (str|dict|None): str can be a path to a config file, a directory containing
+        a sequence of them (must be numbered following convention), or a file with a
+        sequence of configs (multi-document YAML or JSON lines, see
+        `config_io.load_stream`). None reads config(s) from stdin, in any of the
+        formats a file could have.
+
+    Each config is loaded and validated once (raising ValueError if invalid), and
+    files are only loaded once per process (see `config_io.load_compiled`).
+
+    parallel_load (bool|None): whether to load the files in a directory in parallel.
+        If None, only does so for directories with at least
+        `config_io.parallel_load_min_files` files. Either way, all files are loaded
+        before any are yielded, and errors from all invalid files are reported
+        together.
     """
     if IN_DOCKER and config is not None:
         # TODO reword to be inclusive of directory case?
@@ -924,13 +1101,38 @@ def config_iter(config, hardware_config=None, _skip_config_preprocess_check=Fals
     # TODO maybe refactor so that run no longer takes None for config (-> using
     # sys.stdin in load call early in run), or even only take a dict. might make it
     # easier to compose with other functions...
-    if config is None or type(config) is dict or (
-        type(config) is str and isfile(config)):
+    # Generated configs may still be being written in the background.
+    if type(config) is str:
+        persist.wait_for(config)
+
+    # Documents in streams are loaded (and validated) one at a time, just before each
+    # is run, so (unlike for directories) invalid configs later in the stream are only
+    # found when they are reached.
+    if config is None or config_io.is_config_stream(config):
+        for i, config_dict in enumerate(config_io.iter_stream_config_dicts(config)):
+            if i > 0:
+                print()
+
+            if config is not None:
+                print(f'Config document {i + 1} from {config}')
+
+            all_required_data, config_dict, _, flows = config_io.load_compiled(
+                config_dict
+            )
+            yield config_io.LoadedConfig(None, all_required_data, config_dict, flows)
 
-        yield config
+    elif type(config) is dict or (type(config) is str and isfile(config)):
+
+        all_required_data, config_dict, _, flows = config_io.load_compiled(config)
+        path = config if type(config) is str else None
+        yield config_io.LoadedConfig(path, all_required_data, config_dict, flows)
 
     elif type(config) is str and isdir(config):
-        config_files = glob.glob(join(config, '*'))
+        # Failures (of the writes that matter here) will show up as missing files.
+        persist.flush(raise_errors=False)
+        config_files = [f for f in glob.glob(join(config, '*'))
+            if not f.endswith(config_io.config_sidecar_suffix)
+        ]
 
         # We expect each config file to follow this naming convention:
         # <x>_<n>.[yaml/json], where <x> can be anything (including containing
@@ -951,43 +1153,74 @@ def config_iter(config, hardware_config=None, _skip_config_preprocess_check=Fals
         config_files = [f for _, f in sorted(zip(order_nums, config_files),
             key=lambda x: x[0]
         )]
+        yield from _iter_loaded_config_files(config_files, parallel_load=parallel_load)
+
+    # Paths of generated configs, each written just before it is yielded (see
+    # `check_need_to_preprocess_config`). Each is loaded and validated as it arrives,
+    # and forgotten once run, so neither memory nor time to the first run grow with
+    # the number generated. Unlike for directories, there is no pins2odors summary of
+    # all configs up front, and an invalid config only fails when it is reached.
+    elif isinstance(config, Iterator):
+        for i, config_file in enumerate(config):
+            if i > 0:
+                print()
 
-        if len(config_files) > 1:
-            all_configs_pins2odors_delim = '#' * 80
+            print(f'Config file: {config_file} ({i+1})')
 
-            print(all_configs_pins2odors_delim)
+            all_required_data, config_dict, _, flows = config_io.load_compiled(
+                config_file
+            )
+            try:
+                yield config_io.LoadedConfig(config_file, all_required_data,
+                    config_dict, flows
+                )
+            finally:
+                config_io.forget_compiled(config_file)
 
-            # could refactor so load only happens once but whatever
-            for i, config_file in enumerate(config_files):
+    else:
+        # TODO TODO does this break docker stdin based config specification? fix
+        # if so.
+        raise ValueError(f'config type {type(config)} not recognized. must be '
+            'str path to file/directory, dict, or None to use stdin.'
+        )
 
-                all_required_data, config_dict = config_io.load(config_file)
 
-                print(f'{config_file} ({i+1}/{len(config_files)})')
-                util.print_pins2odors(config_dict, header=False)
-                print()
+def _iter_loaded_config_files(config_files, parallel_load=None):
+    """Loads all config_files, prints pins2odors of each, then yields `LoadedConfig`s.
+    """
+    loaded_configs = [
+        config_io.LoadedConfig(config_file, all_required_data, config_dict, flows)
+        for config_file, (all_required_data, config_dict, _, flows) in zip(config_files,
+            config_io.load_compiled_many(config_files, parallel=parallel_load)
+        )
+    ]
+
+    if len(config_files) > 1:
+        all_configs_pins2odors_delim = '#' * 80
 
-            print(all_configs_pins2odors_delim)
+        print(all_configs_pins2odors_delim)
+
+        for i, (config_file, _, config_dict, _) in enumerate(loaded_configs):
+            print(f'{config_file} ({i+1}/{len(config_files)})')
+            util.print_pins2odors(config_dict, header=False)
             print()
 
-        for i, config_file in enumerate(config_files):
-            # TODO maybe (in addition to some abstractions / standards for
-            # formatting odors in trials (rather than pins)) also have some
-            # faculties for summarizing config files, and print that alongside /
-            # in place of the file name? (e.g. the odors in the pair, for the
-            # pair conc grid experiments)?
-            print(f'Config file: {config_file} ({i+1}/{len(config_files)})')
+        print(all_configs_pins2odors_delim)
+        print()
 
-            yield config_file
+    for i, loaded_config in enumerate(loaded_configs):
+        config_file = loaded_config.path
+        # TODO maybe (in addition to some abstractions / standards for
+        # formatting odors in trials (rather than pins)) also have some
+        # faculties for summarizing config files, and print that alongside /
+        # in place of the file name? (e.g. the odors in the pair, for the
+        # pair conc grid experiments)?
+        print(f'Config file: {config_file} ({i+1}/{len(config_files)})')
 
-            if i < len(config_files) - 1:
-                print()
+        yield loaded_config
 
-    else:
-        # TODO TODO does this break docker stdin based config specification? fix
-        # if so.
-        raise ValueError(f'config type {type(config)} not recognized. must be '
-            'str path to file/directory, dict, or None to use stdin.'
-        )
+        if i < len(config_files) - 1:
+            print()
 
 
 # TODO type hint config -> remove type stuff from doc
@@ -996,11 +1229,13 @@ def config_iter(config, hardware_config=None, _skip_config_preprocess_check=Fals
 # olf-retry/similar that way too? to restart a sequence from the file that was
 # interrupted?)
 def main(config, hardware_config=None, _skip_config_preprocess_check=False,
-    verbose=False, **kwargs):
+    verbose=False, parallel_load=None, **kwargs):
     """Runs one or several configuration inputs on the olfactometer.
 
     config (str|dict|None): str can be a path to a config file or a directory containing
         a sequence of them (must be numbered following convention)
+
+    parallel_load (bool|None): see `config_iter`
     """
 
     # TODO add arg for excluding pins (e.g. for running basic.py configured w/
@@ -1015,7 +1250,8 @@ def main(config, hardware_config=None, _skip_config_preprocess_check=False,
     first_run = True
 
     for single_run_config in config_iter(config, hardware_config=hardware_config,
-        verbose=verbose, _skip_config_preprocess_check=False):
+        verbose=verbose, _skip_config_preprocess_check=False,
+        parallel_load=parallel_load):
 
         run(single_run_config, _first_run=first_run, verbose=verbose, **kwargs)
 
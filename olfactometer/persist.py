@@ -0,0 +1,251 @@
+"""
+Write-behind persistence of files (generated configs, caches, run records), so that
+slow disks (e.g. network home directories) do not delay interactive steps.
+
+Writes are queued and done, in order, by one background thread. Each goes to a temporary
+file in the same directory, which is fsync-ed before being renamed over the destination,
+so readers never see partial files. Anything that needs written files should first call
+`wait_for` (for particular files) or `flush` (for everything). Pending writes are
+flushed when the process exits.
+"""
+
+import atexit
+from collections import Counter, deque
+import os
+from os.path import split
+import threading
+import time
+import warnings
+from typing import Callable, Optional, Union
+
+from olfactometer import _DEBUG
+
+
+class PersistenceError(OSError):
+    pass
+
+
+# Set False to do all writes synchronously, in the calling thread.
+write_behind = True
+
+# Set in child processes created by forking (e.g. the flow controller worker). The
+# writer thread does not exist there, and those processes may exit without running
+# atexit handlers, so writes are done synchronously instead.
+_in_forked_child = False
+
+
+def write_atomic(path, data: Union[bytes, str]) -> None:
+    """Writes data to path, so that path either has its old contents or all of data.
+    """
+    path = str(path)
+    if type(data) is str:
+        data = data.encode()
+
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # So the rename itself survives a crash. Not possible on Windows.
+    if os.name == 'posix':
+        dir_fd = os.open(split(os.path.abspath(path))[0], os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class PersistenceWorker:
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Of (path or None, function doing the write).
+        self._jobs = deque()
+        # path -> number of queued / in progress writes to it.
+        self._pending = Counter()
+        # path -> error from last failed write to it, for `wait_for` to raise.
+        self._path2error = dict()
+        # Errors not yet reported by `flush`.
+        self._errors = []
+        self._thread = None
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='olf-persistence',
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, path, fn: Callable[[], None]) -> None:
+        """Queues `fn` (which should write `path`, if not None) to run in background.
+        """
+        if path is not None:
+            path = str(path)
+
+        with self._condition:
+            if self._thread is None:
+                self._start()
+
+            self._jobs.append((path, fn))
+            if path is not None:
+                self._pending[path] += 1
+                self._path2error.pop(path, None)
+
+            self._condition.notify_all()
+
+    def write(self, path, data: Union[bytes, str]) -> None:
+        self.submit(path, lambda: write_atomic(path, data))
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while len(self._jobs) == 0:
+                    self._condition.wait()
+
+                path, fn = self._jobs[0]
+
+            start_s = time.time()
+            error = None
+            try:
+                fn()
+            except Exception as err:
+                error = err
+
+            if _DEBUG:
+                print(f'persisting {path} took {time.time() - start_s:.3f}s')
+
+            with self._condition:
+                self._jobs.popleft()
+                if path is not None:
+                    self._pending[path] -= 1
+                    if self._pending[path] == 0:
+                        del self._pending[path]
+
+                if error is not None:
+                    self._errors.append((path, error))
+                    if path is not None:
+                        self._path2error[path] = error
+
+                self._condition.notify_all()
+
+    def wait_for(self, path, timeout_s: Optional[float] = None,
+        raise_errors: bool = True) -> None:
+        """Waits for queued writes to path. Reports if the last one failed.
+
+        Raises PersistenceError if it failed and `raise_errors`, otherwise warns.
+        """
+        path = str(path)
+        with self._condition:
+            if not self._condition.wait_for(lambda: path not in self._pending,
+                timeout=timeout_s):
+
+                raise PersistenceError(f'timed out waiting to write {path}')
+
+            error = self._path2error.pop(path, None)
+
+        if error is None:
+            return
+
+        msg = f'writing {path} failed: {error}'
+        if raise_errors:
+            raise PersistenceError(msg) from error
+        else:
+            warnings.warn(msg)
+
+    def flush(self, timeout_s: Optional[float] = None, raise_errors: bool = True
+        ) -> None:
+        """Waits for all queued writes. Reports any failures since the last flush.
+
+        Raises PersistenceError if any failed and `raise_errors`, otherwise warns.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: len(self._jobs) == 0,
+                timeout=timeout_s):
+
+                raise PersistenceError(f'timed out waiting for {len(self._jobs)} '
+                    'queued writes'
+                )
+
+            errors = self._errors
+            self._errors = []
+
+        if len(errors) == 0:
+            return
+
+        msg = 'failed to write: ' + ', '.join(f'{path} ({err})' for path, err in errors)
+        if raise_errors:
+            raise PersistenceError(msg) from errors[0][1]
+        else:
+            warnings.warn(msg)
+
+
+_worker = None
+def get_worker() -> Optional[PersistenceWorker]:
+    """Returns the process-wide worker, or None if writes should be synchronous.
+    """
+    global _worker
+    if not write_behind or _in_forked_child:
+        return None
+
+    if _worker is None:
+        _worker = PersistenceWorker()
+
+    return _worker
+
+
+def submit(path, fn: Callable[[], None]) -> None:
+    """Runs `fn` in the background (or now, if writes are synchronous).
+
+    `path` should be the file `fn` writes (for `wait_for`), or None.
+    """
+    worker = get_worker()
+    if worker is None:
+        fn()
+    else:
+        worker.submit(path, fn)
+
+
+def write(path, data: Union[bytes, str]) -> None:
+    """Atomically writes data to path, in the background. See `write_atomic`.
+    """
+    worker = get_worker()
+    if worker is None:
+        write_atomic(path, data)
+    else:
+        worker.write(path, data)
+
+
+def wait_for(path, timeout_s: Optional[float] = None, raise_errors: bool = True
+    ) -> None:
+    """Returns once any queued writes to path are done. Call before reading path.
+    """
+    if _worker is not None:
+        _worker.wait_for(path, timeout_s=timeout_s, raise_errors=raise_errors)
+
+
+def flush(timeout_s: Optional[float] = None, raise_errors: bool = True) -> None:
+    """Returns once all queued writes are done.
+    """
+    if _worker is not None:
+        _worker.flush(timeout_s=timeout_s, raise_errors=raise_errors)
+
+
+def _after_fork_in_child() -> None:
+    global _worker, _in_forked_child
+    _worker = None
+    _in_forked_child = True
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+atexit.register(flush, raise_errors=False)
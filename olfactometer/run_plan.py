@@ -0,0 +1,158 @@
+"""
+`RunPlan`: everything `olf.run` needs at each trial boundary, computed before it
+connects to the Arduino, so that the run loop only has to index into it.
+
+Does not need any hardware, so the plan for a config can be inspected (and tested)
+offline.
+"""
+
+import math
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from olfactometer import flow, flow_schedule, util
+from olfactometer.trial_table import TrialTable
+
+
+# As printed by `finish` in firmware/olfactometer/olfactometer.ino
+finished_line = 'Finished'
+
+def firmware_trial_line(trial_index: int, pins: List[int]) -> str:
+    """Returns line firmware prints at the start of a trial (`print_trial_status`).
+    """
+    return f"trial: {trial_index + 1}, pin(s): {','.join(str(p) for p in pins)}"
+
+
+class FirmwareEvent(NamedTuple):
+    # Seconds from the start of the sequence the line should be printed at. None if
+    # following hardware timing.
+    expected_s: Optional[float]
+    line: str
+
+
+class RunPlan(NamedTuple):
+    trial_table: TrialTable
+    # Seconds per trial. This and the times below are None if following hardware
+    # timing.
+    trial_s: Optional[float]
+    # Expected valve onset / offset for each trial, in seconds from start.
+    onset_s: Optional[np.ndarray]
+    offset_s: Optional[np.ndarray]
+    # What to print at the start of each trial. None if config has no pins2odors (in
+    # which case the firmware output is printed instead).
+    trial_strs: Optional[List[str]]
+    # Setpoint changes after the first trial (see `flow_schedule.make_schedule`). None
+    # if no flow setpoints (which can not be used with follow_hardware_timing).
+    flow_changes: Optional[List[flow_schedule.ScheduledSetpointChange]]
+    # Lines we expect the firmware to print, in order, ending with `finished_line`.
+    firmware_events: List[FirmwareEvent]
+
+    @property
+    def n_trials(self) -> int:
+        return len(self.trial_table)
+
+    def duration_s(self) -> Optional[float]:
+        return self.trial_table.duration_s()
+
+    def trial_index(self, since_start_s: float) -> Optional[int]:
+        """Returns index of trial running `since_start_s` seconds after start.
+
+        None if past the end of the last trial. Like `util.curr_trial_index`, assumes
+        every trial takes exactly `trial_s`.
+        """
+        trial_index = math.floor(since_start_s / self.trial_s)
+        return trial_index if trial_index < self.n_trials else None
+
+
+def flow_change_lead_s(all_required_data, config_dict, mfc_ids,
+    response_profiles=None) -> Optional[float]:
+    """Returns `flow_schedule.make_schedule` `lead_s` for config.
+
+    Uses the config value if there is one. Otherwise, if we have measured how long the
+    MFCs take to settle (see `flow.settling_time_s`), makes sure changes start at least
+    that long before valve onset. Otherwise None (changes happen at the start of each
+    trial).
+
+    Args:
+        response_profiles: as returned by `flow.load_response_profiles`, which is called
+            if this is not passed.
+    """
+    lead_s = config_dict.get(flow_schedule.flow_change_lead_s_key)
+    if lead_s is not None:
+        return lead_s
+
+    measured_settling_s = flow.settling_time_s(mfc_ids, profiles=response_profiles)
+    if measured_settling_s is None:
+        return None
+
+    pre_pulse_s = all_required_data.settings.timing.pre_pulse_us / 1e6
+    return max(pre_pulse_s, measured_settling_s)
+
+
+def make_run_plan(all_required_data, config_dict, flows=None,
+    response_profiles=None) -> RunPlan:
+    """Returns `RunPlan` for config (validated `olf_pb2.AllRequiredData` and dict).
+
+    Args:
+        flows: `trial_table.FlowSetpoints` already parsed from config_dict (e.g. by
+            `config_io.load_compiled`), if any.
+
+        response_profiles: see `flow_change_lead_s`. Pass to not depend on profiles
+            saved on this computer.
+    """
+    table = TrialTable.from_all_required_data(all_required_data, config_dict,
+        flows=flows
+    )
+    n_trials = len(table)
+    pin_lists = table.pin_lists()
+
+    trial_strs = None
+    pins2odors = util.get_pins2odors(config_dict)
+    if pins2odors is not None:
+        # Many trials tend to share the same pins, so only formatting each group once.
+        pins2str = dict()
+        trial_strs = []
+        for trial_index, pins in enumerate(pin_lists):
+            key = tuple(pins)
+            odor_str = pins2str.get(key)
+            if odor_str is None:
+                # p not in pins2odors when it's an explicit balance pin
+                odor_str = util.format_mixture_pins(pins2odors, pins,
+                    show_abbrevs=False
+                )
+                pins2str[key] = odor_str
+
+            trial_strs.append(f'trial: {trial_index + 1}/{n_trials}, odor(s): '
+                f'{odor_str}'
+            )
+
+    flow_changes = None
+    flows = table.flows
+    if flows is not None and table.trial_s is not None:
+        flow_changes = flow_schedule.make_schedule(all_required_data,
+            config_dict[flow.flow_setpoints_sequence_key],
+            lead_s=flow_change_lead_s(all_required_data, config_dict, flows.mfc_ids,
+                response_profiles=response_profiles
+            ),
+            flows=flows
+        )
+
+    # Simulated from the firmware timing (see `timeline`).
+    if table.timeline is not None:
+        trial_starts_s = (table.timeline.trial_start_us / 1e6).tolist()
+        finish_s = table.timeline.duration_s()
+    else:
+        trial_starts_s = [None] * n_trials
+        finish_s = None
+
+    firmware_events = [
+        FirmwareEvent(start_s, firmware_trial_line(trial_index, pins))
+        for trial_index, (start_s, pins) in enumerate(zip(trial_starts_s, pin_lists))
+    ]
+    firmware_events.append(FirmwareEvent(finish_s, finished_line))
+
+    return RunPlan(trial_table=table, trial_s=table.trial_s, onset_s=table.onset_s,
+        offset_s=table.offset_s, trial_strs=trial_strs, flow_changes=flow_changes,
+        firmware_events=firmware_events
+    )
@@ -0,0 +1,202 @@
+"""
+Offline simulation of the firmware's timing (`run_sequence` in
+firmware/olfactometer/olfactometer.ino), to predict when everything in a config will
+happen, and how long it will take, without an Arduino.
+
+Models:
+- `busy_wait_us`, which returns on the first `micros()` reading at least the interval
+  after the end of the previous wait. `micros()` only has a resolution of
+  `micros_resolution_us`, so each wait takes its interval rounded up to that, and since
+  each wait is timed from the end of the last, this rounding accumulates over a run.
+  Time spent between waits (writing pins, printing trial status) does not.
+- Pulse trains, which run whole on / off cycles until at least `pulse_us` has passed,
+  so they can take up to one cycle longer than `pulse_us`.
+- `last_change_us` being set when the Arduino boots, so the first pre-pulse wait is
+  shortened by however long the Arduino took to receive the config (`since_boot_us`).
+
+All times are integer microseconds, relative to the start of `run_sequence` (where the
+status of the first trial is printed) unless noted. The functions computing timing from
+the `PulseTiming` values take Python ints or NumPy arrays of them (to simulate many
+configs at once), and do not need NumPy for ints.
+"""
+
+from typing import NamedTuple, Optional, Sequence
+
+
+# `micros()` resolution on 16MHz AVR boards (e.g. the Mega). 8 on 8MHz boards.
+micros_resolution_us = 4
+
+# `delay(18000)` in `loop()`, after the last trigger in the follow_hardware_timing case,
+# before "Finished" is printed.
+follow_hardware_finish_delay_us = 18_000_000
+
+
+def wait_us(interval_us, resolution_us: int = micros_resolution_us):
+    """Returns how long `busy_wait_us(interval_us)` takes.
+    """
+    return -(-interval_us // resolution_us) * resolution_us
+
+
+class TrialTiming(NamedTuple):
+    # First valve onset, relative to trial start (the end of the pre-pulse wait).
+    onset_us: int
+    # Last valve offset, relative to trial start.
+    offset_us: int
+    # Number of times the valves open (1 unless using a pulse train).
+    n_pulses: int
+    # Time from one pulse onset to the next in a pulse train (0 if not using one).
+    pulse_period_us: int
+    trial_us: int
+
+
+def _trial_timing(pre_pulse_us, pulse_us, post_pulse_us, pulse_train_on_us,
+    pulse_train_off_us, resolution_us) -> TrialTiming:
+
+    # Only arithmetic (no branching), so this works the same on ints and arrays.
+    pre_us = wait_us(pre_pulse_us, resolution_us)
+    on_us = wait_us(pulse_train_on_us, resolution_us)
+    off_us = wait_us(pulse_train_off_us, resolution_us)
+    single_us = wait_us(pulse_us, resolution_us)
+
+    train = (pulse_train_on_us > 0) & (pulse_train_off_us > 0)
+    not_train = 1 - train
+
+    cycle_us = on_us + off_us
+    # `while (micros() - pulse_start_us < pulse_us)` is only checked at the end of each
+    # cycle. The (cycle_us == 0) term just avoids dividing by zero.
+    n_cycles = -(-pulse_us // (cycle_us + (cycle_us == 0)))
+
+    pulse_section_us = train * n_cycles * cycle_us + not_train * single_us
+    # Each cycle ends with the valves closed for off_us.
+    last_offset_us = pulse_section_us - train * (n_cycles > 0) * off_us
+
+    return TrialTiming(
+        onset_us=pre_us,
+        offset_us=pre_us + last_offset_us,
+        n_pulses=train * n_cycles + not_train,
+        pulse_period_us=train * cycle_us,
+        trial_us=pre_us + pulse_section_us + wait_us(post_pulse_us, resolution_us),
+    )
+
+
+def trial_timing(timing, resolution_us: int = micros_resolution_us) -> TrialTiming:
+    """Returns `TrialTiming` for `olf_pb2.PulseTiming` (same for every trial).
+    """
+    return _trial_timing(timing.pre_pulse_us, timing.pulse_us, timing.post_pulse_us,
+        timing.pulse_train_on_us, timing.pulse_train_off_us, resolution_us
+    )
+
+
+class Timeline(NamedTuple):
+    trial: TrialTiming
+    # Arrays with one element per trial. trial_start_us is when the trial status line
+    # is printed. onset_us / offset_us are the first valve onset / last valve offset.
+    trial_start_us: 'np.ndarray'
+    onset_us: 'np.ndarray'
+    offset_us: 'np.ndarray'
+    # When "Finished" is printed.
+    finish_us: int
+
+    @property
+    def n_trials(self) -> int:
+        return len(self.trial_start_us)
+
+    def duration_s(self) -> float:
+        return self.finish_us / 1e6
+
+    def pulse_onsets_us(self) -> 'np.ndarray':
+        """Returns array of shape (n_trials, n_pulses) of all valve onsets.
+        """
+        import numpy as np
+        return (self.onset_us[:, None] +
+            np.arange(self.trial.n_pulses) * self.trial.pulse_period_us
+        )
+
+    def pulse_offsets_us(self) -> 'np.ndarray':
+        """Returns array of shape (n_trials, n_pulses) of all valve offsets.
+        """
+        onsets_us = self.pulse_onsets_us()
+        # Each pulse is as long as the last.
+        return onsets_us + (self.offset_us[:, None] - onsets_us[:, -1:])
+
+    def events(self):
+        """Returns list of (time_us, trial_index, kind), sorted by time.
+
+        kind is one of 'trial' (status printed), 'valve_on', 'valve_off' or 'finished'.
+        trial_index is None for 'finished'.
+        """
+        import numpy as np
+
+        n_trials = self.n_trials
+        n_pulses = self.trial.n_pulses
+        times = np.concatenate([self.trial_start_us, self.pulse_onsets_us().ravel(),
+            self.pulse_offsets_us().ravel()
+        ])
+        trial_indices = np.concatenate([np.arange(n_trials),
+            np.repeat(np.arange(n_trials), n_pulses),
+            np.repeat(np.arange(n_trials), n_pulses)
+        ])
+        kinds = np.repeat(np.arange(3), [n_trials, n_trials * n_pulses,
+            n_trials * n_pulses
+        ])
+        # Kinds are numbered in the order they happen within a trial, so ties (e.g. with
+        # a pre-pulse of 0) stay in the order the firmware would do them.
+        order = np.lexsort((kinds, trial_indices, times))
+
+        kind_names = ('trial', 'valve_on', 'valve_off')
+        events = [(t, i, kind_names[k]) for t, i, k in zip(times[order].tolist(),
+            trial_indices[order].tolist(), kinds[order].tolist())
+        ]
+        events.append((self.finish_us, None, 'finished'))
+        return events
+
+
+def simulate(settings, n_trials: int, since_boot_us: int = 0,
+    resolution_us: int = micros_resolution_us) -> Optional[Timeline]:
+    """Returns `Timeline` for `olf_pb2.Settings`, or None if following hardware timing.
+
+    Args:
+        since_boot_us: time from the Arduino booting (when Python opens the serial
+            port) to the start of the sequence, which comes out of the first pre-pulse.
+            Mainly the time to send the config. 0 (the default) is an upper bound on
+            the duration.
+    """
+    if settings.follow_hardware_timing:
+        return None
+
+    import numpy as np
+
+    trial = trial_timing(settings.timing, resolution_us=resolution_us)
+    first_pre_us = max(0, trial.onset_us - since_boot_us)
+    shift_us = trial.onset_us - first_pre_us
+
+    trial_starts_us = np.arange(n_trials, dtype=np.int64) * trial.trial_us - shift_us
+    onset_us = trial_starts_us + trial.onset_us
+    offset_us = trial_starts_us + trial.offset_us
+    if n_trials > 0:
+        trial_starts_us[0] = 0
+
+    return Timeline(trial=trial, trial_start_us=trial_starts_us, onset_us=onset_us,
+        offset_us=offset_us, finish_us=max(0, n_trials * trial.trial_us - shift_us)
+    )
+
+
+def sequence_durations_us(timings: Sequence, n_trials: Sequence[int],
+    resolution_us: int = micros_resolution_us) -> 'np.ndarray':
+    """Returns durations of many sequences at once.
+
+    Args:
+        timings: `olf_pb2.PulseTiming` of each sequence
+        n_trials: number of trials in each sequence
+    """
+    import numpy as np
+
+    fields = ('pre_pulse_us', 'pulse_us', 'post_pulse_us', 'pulse_train_on_us',
+        'pulse_train_off_us'
+    )
+    values = np.array([[getattr(t, f) for f in fields] for t in timings],
+        dtype=np.int64
+    ).reshape(-1, len(fields))
+
+    trial = _trial_timing(*values.T, resolution_us)
+    return np.asarray(n_trials, dtype=np.int64) * trial.trial_us
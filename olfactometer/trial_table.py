@@ -0,0 +1,466 @@
+"""
+`TrialTable`: the per-trial data of a config (pins, flow setpoints, and optionally
+expected valve timing), held in a few NumPy arrays rather than lists of small dicts.
+
+Converts to / from the config dict (YAML / JSON) form and `olf_pb2` messages. Used by
+`run_plan` (for `olf.run`) and `export`. Generators can also pass one to
+`generators.common.add_pinlist`.
+
+`FlowSetpoints` is the flow setpoint part on its own, for code that only needs that
+(validation of `flow_setpoints_sequence`, and flow controller setup).
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from olfactometer import timeline, validation
+from olfactometer.flow import flow_setpoints_sequence_key
+
+
+# Pins are also stored as one bit per pin, in a uint64 per trial.
+max_mask_pin = 63
+
+_id_types = ('address', 'port')
+
+
+class FlowSetpoints:
+    """`flow_setpoints_sequence`, as an index of MFC IDs and a 2-D array of setpoints.
+
+    Parsed once per config, so validation, constancy checks and finding which flow
+    controllers change between trials are all array operations.
+
+    Attributes:
+        id_type: 'address' or 'port' (None if there are no trials).
+        mfc_ids: flow controller IDs, in the order of the columns of `sccm` (the order
+            they are listed in on the first trial).
+        mfc_id2column: inverse of `mfc_ids`.
+        sccm: array of shape (n_trials, len(mfc_ids)). Integer dtype if all setpoints
+            were ints, otherwise float.
+        extras: (trial index, column of `sccm`) -> dict of any other keys in that
+            setpoint (e.g. waveforms, see `flow_stream`).
+    """
+    __slots__ = ('id_type', 'mfc_ids', 'mfc_id2column', 'sccm', 'extras',
+        '_changed_mfc_ids'
+    )
+
+    def __init__(self, id_type: Optional[str], mfc_ids: Sequence[str], sccm,
+        extras: Optional[Dict[Tuple[int, int], Dict[str, Any]]] = None) -> None:
+
+        self.id_type = id_type
+        self.mfc_ids = tuple(mfc_ids)
+        self.mfc_id2column = {x: i for i, x in enumerate(self.mfc_ids)}
+        self.sccm = sccm
+        self.extras = dict() if extras is None else extras
+        self._changed_mfc_ids = None
+
+    def __len__(self) -> int:
+        return len(self.sccm)
+
+    def __repr__(self) -> str:
+        return (f'FlowSetpoints(n_trials={len(self)}, {self.id_type}s='
+            f'{list(self.mfc_ids)})'
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FlowSetpoints):
+            return NotImplemented
+
+        return (self.id_type == other.id_type and self.mfc_ids == other.mfc_ids and
+            np.array_equal(self.sccm, other.sccm) and self.extras == other.extras
+        )
+
+    @classmethod
+    def from_sequence(cls, flow_setpoints_sequence) -> 'FlowSetpoints':
+        """Parses `flow_setpoints_sequence`, in one pass over its dicts.
+
+        Raises ValueError if any setpoint is missing keys, if ports and addresses are
+        mixed, or if each trial does not have setpoints for the same flow controllers.
+        Checks on the values themselves are in
+        `validation.validate_flow_setpoints_sequence`.
+        """
+        key = flow_setpoints_sequence_key
+        if len(flow_setpoints_sequence) == 0:
+            return cls(None, (), np.zeros((0, 0)))
+
+        id_type = None
+        mfc_ids = []
+        mfc_id2column = dict()
+        rows = []
+        extras = dict()
+        for trial_index, trial_setpoints in enumerate(flow_setpoints_sequence):
+            row = [None] * len(mfc_ids)
+            for setpoint in trial_setpoints:
+                # TODO am i actually setting flows in terms of sccm (thats a unit of
+                # mass flow, right?) does it depend on hardware settings? is it
+                # possible to set flows in volumetric units?
+                if 'sccm' not in setpoint:
+                    raise ValueError('sccm must be set for each trial, for each flow '
+                        'controller'
+                    )
+
+                if id_type is None:
+                    if 'address' in setpoint:
+                        id_type = 'address'
+                    elif 'port' in setpoint:
+                        id_type = 'port'
+
+                if id_type is None or id_type not in setpoint:
+                    if any(x in setpoint for x in _id_types):
+                        raise ValueError('only use either ports or addresses to '
+                            'reference flow controllers'
+                        )
+
+                    raise ValueError('port or address must be set for each trial, for '
+                        'each flow controller. always use one or the other.'
+                    )
+
+                if any(x in setpoint for x in _id_types if x != id_type):
+                    raise ValueError('only use either ports or addresses to reference '
+                        'flow controllers'
+                    )
+
+                mfc_id = setpoint[id_type]
+                if type(mfc_id) is not str:
+                    raise ValueError(f'{id_type}s in {key} must be of type str')
+
+                if trial_index == 0:
+                    if mfc_id in mfc_id2column:
+                        raise ValueError(f'{id_type} {mfc_id!r} referenced more than '
+                            f'once in the first element of {key}'
+                        )
+
+                    column = len(mfc_ids)
+                    mfc_id2column[mfc_id] = column
+                    mfc_ids.append(mfc_id)
+                    row.append(setpoint['sccm'])
+                else:
+                    column = mfc_id2column.get(mfc_id)
+                    if column is None:
+                        raise ValueError(f'each {id_type} must be referenced in each '
+                            f'element of {key}. trial {trial_index + 1} has '
+                            f'{mfc_id!r}, which trial 1 is missing'
+                        )
+                    row[column] = setpoint['sccm']
+
+                if len(setpoint) > 2:
+                    extras[(trial_index, column)] = {k: v for k, v in setpoint.items()
+                        if k not in (id_type, 'sccm')
+                    }
+
+            if trial_index > 0 and any(x is None for x in row):
+                missing = {x for x, sccm in zip(mfc_ids, row) if sccm is None}
+                raise ValueError(f'each {id_type} must be referenced in each element '
+                    f'of {key}. trial {trial_index + 1} missing: {missing}'
+                )
+
+            rows.append(row)
+
+        sccm = np.array(rows)
+        if sccm.dtype.kind not in 'iuf':
+            try:
+                sccm = sccm.astype(float)
+            except (TypeError, ValueError):
+                raise ValueError(f'sccm values in {key} must be numeric')
+
+        return cls(id_type, mfc_ids, sccm, extras)
+
+    def trial_setpoints(self, trial_index: int) -> List[Dict[str, Any]]:
+        """Returns setpoints for trial, as in one element of `flow_setpoints_sequence`.
+        """
+        id_type = self.id_type
+        trial_setpoints = []
+        for column, (mfc_id, sccm) in enumerate(zip(self.mfc_ids,
+            self.sccm[trial_index].tolist())):
+
+            setpoint = {id_type: mfc_id, 'sccm': sccm}
+            extras = self.extras.get((trial_index, column))
+            if extras is not None:
+                setpoint.update(extras)
+
+            trial_setpoints.append(setpoint)
+
+        return trial_setpoints
+
+    def to_sequence(self) -> List[List[Dict[str, Any]]]:
+        return [self.trial_setpoints(i) for i in range(len(self))]
+
+    def mfc_id2flows(self) -> Dict[str, list]:
+        """Returns dict of MFC ID -> list of setpoints (one per trial).
+        """
+        return dict(zip(self.mfc_ids, self.sccm.T.tolist()))
+
+    def are_constant(self) -> bool:
+        """True if each MFC only has one flow for the whole experiment.
+        """
+        return not (self.sccm[1:] != self.sccm[:-1]).any()
+
+    def trials_with_key(self, key: str) -> Set[int]:
+        """Returns indices of trials with `key` (e.g. 'waveform') in any setpoint.
+        """
+        return {t for (t, _), extras in self.extras.items() if key in extras}
+
+    def trials_with_changed_extras(self) -> Set[int]:
+        """Returns indices of trials whose `extras` differ from those of the previous.
+        """
+        trial2extras = dict()
+        for (trial_index, column), extras in self.extras.items():
+            trial2extras.setdefault(trial_index, dict())[column] = extras
+
+        candidates = set(trial2extras) | {t + 1 for t in trial2extras
+            if t + 1 < len(self)
+        }
+        return {t for t in candidates
+            if t > 0 and trial2extras.get(t) != trial2extras.get(t - 1)
+        }
+
+    @property
+    def changed_mfc_ids(self) -> List[Tuple[str, ...]]:
+        """IDs of MFCs whose setpoint differs from the previous trial, for each trial.
+
+        All MFCs on the first trial. Does not consider `extras` (e.g. waveforms).
+        """
+        if self._changed_mfc_ids is None:
+            changed = [()] * len(self)
+            if len(self) > 0:
+                changed[0] = self.mfc_ids
+
+            # Only looping over the (few) changes, rather than all trials.
+            trial2changed = dict()
+            trial_indices, columns = np.nonzero(self.sccm[1:] != self.sccm[:-1])
+            for trial_index, column in zip((trial_indices + 1).tolist(),
+                columns.tolist()):
+
+                trial2changed.setdefault(trial_index, []).append(self.mfc_ids[column])
+
+            for trial_index, mfc_ids in trial2changed.items():
+                changed[trial_index] = tuple(mfc_ids)
+
+            self._changed_mfc_ids = changed
+
+        return self._changed_mfc_ids
+
+
+class TrialTable:
+    """Per-trial pins, flow setpoints and (optionally) expected valve times.
+
+    Attributes:
+        pins: uint8 array of all pins, in order, for all trials (flattened).
+        group_starts: indices into `pins` where each trial starts, followed by
+            `len(pins)`. Pins of trial i are `pins[group_starts[i]:group_starts[i + 1]]`.
+        pin_masks: uint64 array with bit p set on trial i if pin p is used on it.
+
+        flows: `FlowSetpoints` (None if no flow setpoints). `mfc_id_type`, `mfc_ids`,
+            `sccm` and `setpoint_extras` are shortcuts to its `id_type`, `mfc_ids`,
+            `sccm` and `extras` (None / empty if no flow setpoints).
+
+        timeline: `timeline.Timeline` simulated from the settings.
+        trial_s: seconds per trial. onset_s, offset_s: float arrays of expected (first)
+            valve onset / (last) offset, in seconds from start. All None if following
+            hardware timing (or timing not set).
+    """
+    __slots__ = ('pins', 'group_starts', 'pin_masks', 'flows', 'timeline', 'trial_s',
+        'onset_s', 'offset_s'
+    )
+
+    def __init__(self, pins, group_starts) -> None:
+        pins = np.asarray(pins)
+        if len(pins) > 0 and (pins.min() < 0 or pins.max() > max_mask_pin):
+            raise ValueError(f'pins must be in [0, {max_mask_pin}]')
+
+        self.pins = pins.astype(np.uint8)
+        self.group_starts = np.asarray(group_starts, dtype=np.intp)
+
+        group_indices = np.repeat(np.arange(len(self)), np.diff(self.group_starts))
+        self.pin_masks = np.zeros(len(self), dtype=np.uint64)
+        np.bitwise_or.at(self.pin_masks, group_indices,
+            np.left_shift(np.uint64(1), self.pins.astype(np.uint64))
+        )
+
+        self.flows = None
+        self.timeline = None
+        self.trial_s = None
+        self.onset_s = None
+        self.offset_s = None
+
+    def __len__(self) -> int:
+        return len(self.group_starts) - 1
+
+    def __repr__(self) -> str:
+        return (f'TrialTable(n_trials={len(self)}, mfc_ids={list(self.mfc_ids)}, '
+            f'timing={self.onset_s is not None})'
+        )
+
+    @property
+    def mfc_id_type(self) -> Optional[str]:
+        return None if self.flows is None else self.flows.id_type
+
+    @property
+    def mfc_ids(self) -> Tuple[str, ...]:
+        return () if self.flows is None else self.flows.mfc_ids
+
+    @property
+    def sccm(self):
+        return None if self.flows is None else self.flows.sccm
+
+    @property
+    def setpoint_extras(self) -> Dict[Tuple[int, int], Dict[str, Any]]:
+        return dict() if self.flows is None else self.flows.extras
+
+    @classmethod
+    def from_pin_lists(cls, pin_lists: Sequence[Sequence[int]]) -> 'TrialTable':
+        """Takes a list of pins for each trial (e.g. generator `pinlist_at_each_trial`).
+        """
+        group_starts = np.zeros(len(pin_lists) + 1, dtype=np.intp)
+        np.cumsum([len(x) for x in pin_lists], out=group_starts[1:])
+        pins = np.fromiter((p for x in pin_lists for p in x), dtype=np.int64,
+            count=int(group_starts[-1])
+        )
+        return cls(pins, group_starts)
+
+    @classmethod
+    def from_config_dict(cls, config_dict: Dict[str, Any],
+        flows: Optional[FlowSetpoints] = None) -> 'TrialTable':
+        """Takes pins (and flow setpoints, if any) from config dict.
+
+        Args:
+            flows: already parsed from config_dict (e.g. by validation), if available.
+        """
+        table = cls.from_pin_lists(
+            [g['pins'] for g in config_dict['pin_sequence']['pin_groups']]
+        )
+        if flow_setpoints_sequence_key in config_dict:
+            table._set_flows_from_config(config_dict[flow_setpoints_sequence_key], flows)
+
+        return table
+
+    @classmethod
+    def from_all_required_data(cls, all_required_data,
+        config_dict: Optional[Dict[str, Any]] = None,
+        flows: Optional[FlowSetpoints] = None) -> 'TrialTable':
+        """Takes pins and timing from `olf_pb2.AllRequiredData` (flows from config_dict).
+
+        See `from_config_dict` for `flows`.
+        """
+        pins, group_sizes = validation.pin_sequence_arrays(all_required_data.pin_sequence)
+        group_starts = np.zeros(len(group_sizes) + 1, dtype=np.intp)
+        np.cumsum(group_sizes, out=group_starts[1:])
+
+        table = cls(pins, group_starts)
+        table.set_timing(all_required_data.settings)
+
+        if config_dict is not None and flow_setpoints_sequence_key in config_dict:
+            table._set_flows_from_config(config_dict[flow_setpoints_sequence_key], flows)
+
+        return table
+
+    def trial_pins(self, trial_index: int) -> List[int]:
+        start, stop = self.group_starts[trial_index:(trial_index + 2)]
+        return self.pins[start:stop].tolist()
+
+    def pin_lists(self) -> List[List[int]]:
+        # Slicing Python lists is faster than converting many small arrays.
+        pins = self.pins.tolist()
+        group_starts = self.group_starts.tolist()
+        return [pins[start:stop] for start, stop in zip(group_starts[:-1],
+            group_starts[1:])
+        ]
+
+    def trials_using_pin(self, pin: int) -> np.ndarray:
+        """Returns indices of trials using pin.
+        """
+        return np.flatnonzero(self.pin_masks & np.uint64(1 << pin))
+
+    def pin_sequence_dict(self) -> Dict[str, Any]:
+        """Returns 'pin_sequence' value for config dicts.
+        """
+        return {'pin_groups': [{'pins': x} for x in self.pin_lists()]}
+
+    def fill_pin_sequence(self, pin_sequence) -> None:
+        """Sets pin groups of (empty) `olf_pb2.PinSequence` to those of this table.
+        """
+        add_pin_group = pin_sequence.pin_groups.add
+        for pins in self.pin_lists():
+            add_pin_group().pins.extend(pins)
+
+    def set_timing(self, settings) -> None:
+        """Sets expected valve onset / offset times from `olf_pb2.Settings`.
+        """
+        self.timeline = timeline.simulate(settings, len(self))
+        if self.timeline is None:
+            self.trial_s = None
+            self.onset_s = None
+            self.offset_s = None
+            return
+
+        # Same as `util.seconds_per_trial` / `flow_schedule.trial_valve_times_s`.
+        self.trial_s = self.timeline.trial.trial_us / 1e6
+        self.onset_s = self.timeline.onset_us / 1e6
+        self.offset_s = self.timeline.offset_us / 1e6
+
+    def duration_s(self) -> Optional[float]:
+        """Returns expected duration (None if following hardware timing).
+
+        Like `util.time_config_will_take_s`, does not include waiting for flow
+        controllers.
+        """
+        if self.timeline is None:
+            return None
+
+        return self.timeline.duration_s()
+
+    def set_flows(self, mfc_id_type: str, mfc_ids: Sequence[str], sccm) -> None:
+        """Sets flow setpoints. `sccm` is either one row (for all trials) or one / trial.
+        """
+        if mfc_id_type not in _id_types:
+            raise ValueError(f'mfc_id_type must be one of {_id_types}')
+
+        sccm = np.asarray(sccm)
+        shape = (len(self), len(mfc_ids))
+        if sccm.shape != shape:
+            # Stays a read-only view (no copying) if one row was passed.
+            sccm = np.broadcast_to(sccm, shape)
+
+        self.flows = FlowSetpoints(mfc_id_type, mfc_ids, sccm)
+
+    def _set_flows_from_config(self, flow_setpoints_sequence,
+        flows: Optional[FlowSetpoints] = None) -> None:
+
+        if len(flow_setpoints_sequence) != len(self):
+            raise ValueError(f'len({flow_setpoints_sequence_key}) != number of trials '
+                f'({len(flow_setpoints_sequence)} != {len(self)})'
+            )
+
+        if len(self) == 0:
+            return
+
+        if flows is None:
+            flows = FlowSetpoints.from_sequence(flow_setpoints_sequence)
+
+        self.flows = flows
+
+    def trial_setpoints(self, trial_index: int) -> List[Dict[str, Any]]:
+        """Returns setpoints for trial, as in one element of `flow_setpoints_sequence`.
+        """
+        return self.flows.trial_setpoints(trial_index)
+
+    def flow_setpoints_sequence(self) -> Optional[List[List[Dict[str, Any]]]]:
+        """Returns setpoints in `flow_setpoints_sequence` form (None if no flows set).
+        """
+        if self.flows is None:
+            return None
+
+        return self.flows.to_sequence()
+
+    def to_config_dict(self, config_dict: Optional[Dict[str, Any]] = None
+        ) -> Dict[str, Any]:
+        """Returns copy of config_dict with pin_sequence (and flow setpoints) set.
+        """
+        config_dict = dict() if config_dict is None else dict(config_dict)
+        config_dict['pin_sequence'] = self.pin_sequence_dict()
+
+        flow_setpoints_sequence = self.flow_setpoints_sequence()
+        if flow_setpoints_sequence is not None:
+            config_dict[flow_setpoints_sequence_key] = flow_setpoints_sequence
+
+        return config_dict
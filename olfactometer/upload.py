@@ -2,13 +2,16 @@
 
 from subprocess import Popen, DEVNULL, check_output
 import os
-from os.path import join, split, splitext, exists, abspath, realpath
+from os.path import join, split, splitext, exists, abspath, realpath, relpath
 import glob
+import hashlib
 import shutil
 import tempfile
 import warnings
 import sys
 import json
+from pathlib import Path
+from typing import Optional
 
 import olfactometer
 from olfactometer import util, THIS_PACKAGE_DIR
@@ -23,12 +26,95 @@ nanopb_dir = join(THIS_PACKAGE_DIR, 'nanopb')
 assert exists(sketch_path), f'sketch_path={sketch_path} does not exist'
 assert exists(nanopb_dir), f'nanopb_dir={nanopb_dir} does not exist'
 
+# Number of most recently used compiled firmware builds to keep in the build cache.
+max_cached_firmware = 8
 
-def generate_nanopb_code(sketch_dir):
+
+def build_cache_dir(mkdir=False) -> Path:
+    """Returns Path to directory with cached firmware builds and nanopb outputs.
+
+    Compiled firmware is cached by a hash of everything it was compiled from (see
+    `firmware_cache_key`), so re-uploading unchanged firmware only takes as long as
+    flashing it.
+    """
+    cache_dir = util.user_data_dir(mkdir=mkdir) / 'firmware_build_cache'
+    if mkdir:
+        cache_dir.mkdir(exist_ok=True)
+
+    return cache_dir
+
+
+def _proto_files():
     proto_files = glob.glob(join(THIS_PACKAGE_DIR, '*.proto'))
     assert len(proto_files) == 1, \
         f'len(proto_files) != 1, proto_files={proto_files}'
     proto_file = proto_files[0]
+    options_file = f'{splitext(proto_file)[0]}.options'
+    return proto_file, options_file
+
+
+def _hash_files(h, root, paths) -> None:
+    """Updates hash object with the path (relative to root) and contents of each file.
+    """
+    for path in sorted(paths):
+        h.update(relpath(path, root).encode())
+        h.update(b'\0')
+        # Following symlinks (see `make_arduino_sketch_and_libraries`).
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+
+
+def _nanopb_generator_version() -> Optional[str]:
+    """Returns version of installed nanopb (PyPi) package, or None if not found.
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        # Python < 3.8
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution('nanopb').version
+        except pkg_resources.DistributionNotFound:
+            return None
+
+    try:
+        return version('nanopb')
+    except PackageNotFoundError:
+        return None
+
+
+def nanopb_cache_key() -> Optional[str]:
+    """Returns hash of nanopb generator inputs, or None if they can not all be found.
+    """
+    generator_version = _nanopb_generator_version()
+    if generator_version is None:
+        return None
+
+    h = hashlib.sha256(generator_version.encode())
+    _hash_files(h, THIS_PACKAGE_DIR, [x for x in _proto_files() if exists(x)])
+    return h.hexdigest()
+
+
+def _copy_files(paths, dst_dir) -> None:
+    for path in paths:
+        shutil.copyfile(path, join(dst_dir, split(path)[1]))
+
+
+def generate_nanopb_code(sketch_dir, use_cache: bool = True):
+    """Generates nanopb C code for olf.proto in sketch_dir.
+
+    If use_cache, outputs are cached (by `nanopb_cache_key`), and the generator is only
+    run if they are not already cached.
+    """
+    cache_key = nanopb_cache_key() if use_cache else None
+    if cache_key is not None:
+        cached_dir = build_cache_dir() / 'nanopb' / cache_key
+        cached_outputs = glob.glob(join(cached_dir, '*.pb.[ch]'))
+        if len(cached_outputs) > 0:
+            _copy_files(cached_outputs, sketch_dir)
+            return
+
+    proto_file, _ = _proto_files()
 
     # Just like protoc, the nanopb generator whines if this isn't passed (if not
     # called from the directory containing the *.proto and *.options files).
@@ -64,9 +150,21 @@ def generate_nanopb_code(sketch_dir):
     if failure:
         raise RuntimeError('nanopb code generation failed')
 
+    if cache_key is not None:
+        cached_dir.parent.mkdir(parents=True, exist_ok=True)
+        # Written to a temporary directory first, so the cache never has a partial set
+        # of outputs.
+        temp_dir = tempfile.mkdtemp(dir=cached_dir.parent)
+        _copy_files(glob.glob(join(sketch_dir, '*.pb.[ch]')), temp_dir)
+        try:
+            os.replace(temp_dir, cached_dir)
+        except OSError:
+            # Another process cached the same outputs first.
+            shutil.rmtree(temp_dir)
+
 
 def make_arduino_sketch_and_libraries(sketch_dir, arduino_lib_dir,
-    use_symlinks: bool = True):
+    use_symlinks: bool = True, use_cache: bool = True):
 
     sketch_dir = abspath(sketch_dir)
     arduino_lib_dir = abspath(arduino_lib_dir)
@@ -102,7 +200,7 @@ def make_arduino_sketch_and_libraries(sketch_dir, arduino_lib_dir,
     if not exists(dest):
         copy_or_link(sketch_path, dest)
     del dest
-    generate_nanopb_code(sketch_dir)
+    generate_nanopb_code(sketch_dir, use_cache=use_cache)
 
     ###########################################################################
     # Create the Arduino libraries
@@ -253,6 +351,55 @@ def get_port_and_fqbn(port=None, fqbn=None, will_upload=True):
     return found_port, found_fqbn
 
 
+def toolchain_version(fqbn) -> str:
+    """Returns arduino-cli version and the installed version of the core for fqbn.
+    """
+    cli_version = check_output(['arduino-cli', 'version']).decode().strip()
+
+    # e.g. 'arduino:avr' for 'arduino:avr:mega'
+    platform_id = ':'.join(fqbn.split(':')[:2])
+    core_lines = [x.strip() for x in
+        check_output(['arduino-cli', 'core', 'list']).decode().splitlines()
+        if x.startswith(f'{platform_id} ')
+    ]
+    return '\n'.join([cli_version] + core_lines)
+
+
+def firmware_cache_key(sketch_dir, arduino_lib_dir, fqbn, extra_flags: str,
+    toolchain: str) -> str:
+    """Returns hash of everything that goes into compiling the firmware.
+
+    Includes the sketch (the .ino and the nanopb code generated from olf.proto and
+    olf.options), the libraries, and olf.proto / olf.options themselves.
+    """
+    h = hashlib.sha256()
+    for root in (sketch_dir, arduino_lib_dir):
+        h.update(b'\0' + split(abspath(root))[1].encode())
+        _hash_files(h, root, [join(dirpath, f)
+            for dirpath, _, fnames in os.walk(root, followlinks=True) for f in fnames
+        ])
+
+    _hash_files(h, THIS_PACKAGE_DIR, [x for x in _proto_files() if exists(x)])
+
+    for x in (fqbn, extra_flags, toolchain):
+        h.update(b'\0' + x.encode())
+
+    return h.hexdigest()
+
+
+def _prune_firmware_cache(firmware_cache_dir: Path) -> None:
+    """Deletes all but the `max_cached_firmware` most recently used builds.
+    """
+    # Names starting with '.' are compilations still in progress.
+    builds = sorted((x for x in firmware_cache_dir.iterdir()
+            if x.is_dir() and not x.name.startswith('.')
+        ),
+        key=lambda x: x.stat().st_mtime, reverse=True
+    )
+    for build in builds[max_cached_firmware:]:
+        shutil.rmtree(build, ignore_errors=True)
+
+
 def yes_or_no(question):
     while True:
         reply = str(input(question + ' (y/n): ')).lower().strip()
@@ -389,40 +536,98 @@ def version_str(update_check=False, update_on_prompt=False):
 # TODO maybe thread fqbn through args so arduino-cli lookup not always needed
 def upload(sketch_dir, arduino_lib_dir, fqbn=None, port=None,
     build_root=None, dry_run=False, show_properties=False,
-    arduino_debug_prints=False, verbose=False):
+    arduino_debug_prints=False, verbose=False, use_cache=True):
+    """Compiles and uploads firmware (unless dry_run / show_properties).
 
-    # TODO maybe just like arduino-cli handle the build + build_cache_path now?
-    # (at least, if they'll both be under my root tmpdir anyway...)
+    If use_cache, compiled firmware is looked up in `build_cache_dir` first, and only
+    flashed if found. Otherwise, it is compiled (incrementally, re-using the build
+    directories from the last compilation for the same board) and added to the cache.
+    """
+    will_upload = not (dry_run or show_properties)
+    port, fqbn = get_port_and_fqbn(port=port, fqbn=fqbn, will_upload=will_upload)
 
-    if build_root is None:
-        # TODO TODO TODO make sure there are no windows-specific problems with
-        # this usage of TemporaryDirectory, as there may have been w/
-        # NamedTemp...
-        td_tmp_build_dir = tempfile.TemporaryDirectory()
-        build_root = td_tmp_build_dir.name
-    else:
-        td_tmp_build_dir = None
+    extra_flag_list = []
 
-    # This does need to be absolute (tmp_build_dir path is absolute I'm
-    # assuming, from behavior of <tempfile.TemporaryDirectory>.name)
-    build_path = join(build_root, 'build')
-    if exists(build_path):
-        shutil.rmtree(build_path)
+    vstr = version_str()
+    print(f'Version string being compiled into firmware: {vstr}')
 
-    # arduino-cli's default seemed to be <sketch_dir>/build for me.
-    # might depend on where it was run from though?
-    build_cache_path = join(build_root, 'build-cache')
-    if exists(build_cache_path):
-        shutil.rmtree(build_cache_path)
+    extra_flag_list.append(f'-DOLFACTOMETER_VERSION_STR={vstr}')
 
-    port, fqbn = get_port_and_fqbn(port=port, fqbn=fqbn,
-        will_upload=not (dry_run or show_properties)
-    )
+    if arduino_debug_prints:
+        extra_flag_list.append('-DDEBUG_PRINTS')
+
+    extra_flags = ' '.join(extra_flag_list)
+
+    # Nothing to cache when just showing properties.
+    use_cache = use_cache and not show_properties
+
+    td_tmp_build_dir = None
+    firmware_dir = None
+    if use_cache:
+        cache_dir = build_cache_dir(mkdir=True)
+        firmware_cache_dir = cache_dir / 'firmware'
+        firmware_cache_dir.mkdir(exist_ok=True)
+
+        firmware_dir = firmware_cache_dir / firmware_cache_key(sketch_dir,
+            arduino_lib_dir, fqbn, extra_flags, toolchain_version(fqbn)
+        )
+        if firmware_dir.is_dir():
+            # So pruning keeps the most recently *used* builds.
+            os.utime(firmware_dir)
+            print(f'Using cached firmware build {firmware_dir}')
+
+            if not will_upload:
+                return
+
+            cmd = (f'arduino-cli upload -b {fqbn} -p {port} -t '
+                f'--input-dir {firmware_dir}'
+            )
+            if verbose:
+                cmd += ' -v'
+
+            print(cmd)
+            p = Popen(cmd, shell=True)
+            p.communicate()
+            if p.returncode:
+                raise RuntimeError('upload failed')
+            return
+
+        # Compiled files are exported here, then moved to firmware_dir if successful.
+        output_dir = tempfile.mkdtemp(dir=firmware_cache_dir, prefix='.')
+
+    keep_build_dirs = use_cache and build_root is None
+    if keep_build_dirs:
+        # Kept between compilations, so arduino-cli only recompiles what changed
+        # (which always includes the sketch, since it's in a new directory each time).
+        build_path = str(cache_dir / 'build' / fqbn.replace(':', '_'))
+        build_cache_path = str(cache_dir / 'core-cache')
+    else:
+        if build_root is None:
+            # TODO TODO TODO make sure there are no windows-specific problems with
+            # this usage of TemporaryDirectory, as there may have been w/
+            # NamedTemp...
+            td_tmp_build_dir = tempfile.TemporaryDirectory()
+            build_root = td_tmp_build_dir.name
+
+        # This does need to be absolute (tmp_build_dir path is absolute I'm
+        # assuming, from behavior of <tempfile.TemporaryDirectory>.name)
+        build_path = join(build_root, 'build')
+        if exists(build_path):
+            shutil.rmtree(build_path)
+
+        # arduino-cli's default seemed to be <sketch_dir>/build for me.
+        # might depend on where it was run from though?
+        build_cache_path = join(build_root, 'build-cache')
+        if exists(build_cache_path):
+            shutil.rmtree(build_cache_path)
 
     cmd = (f'arduino-cli compile -b {fqbn} {sketch_dir} '
         f'--libraries {arduino_lib_dir} '
         f'--build-path {build_path} --build-cache-path {build_cache_path}'
     )
+    if firmware_dir is not None:
+        cmd += f' --output-dir {output_dir}'
+
     if show_properties:
         cmd += ' --show-properties'
 
@@ -432,30 +637,18 @@ def upload(sketch_dir, arduino_lib_dir, fqbn=None, port=None,
         # (which I've seen after switching to arduino-cli 0.32)
         cmd += ' --quiet'
 
-    extra_flag_list = []
-
-    vstr = version_str()
-    print(f'Version string being compiled into firmware: {vstr}')
-
-    extra_flag_list.append(f'-DOLFACTOMETER_VERSION_STR={vstr}')
-
-    if arduino_debug_prints:
-        extra_flag_list.append('-DDEBUG_PRINTS')
-
-    if len(extra_flag_list) > 0:
-        extra_flags = ' '.join(extra_flag_list)
-        # Was between this and compiler.c.extra_flags and / or
-        # compiler.cpp.extra_flags. I'm assuming this sets both of those?
-        # https://github.com/arduino/arduino-cli/issues/210 warns that this can
-        # / will override similar flags specified in boards.txt, though I'm not
-        # sure that will be an issue we encounter.
-        cmd += f' --build-property build.extra_flags="{extra_flags}"'
+    # Was between this and compiler.c.extra_flags and / or
+    # compiler.cpp.extra_flags. I'm assuming this sets both of those?
+    # https://github.com/arduino/arduino-cli/issues/210 warns that this can
+    # / will override similar flags specified in boards.txt, though I'm not
+    # sure that will be an issue we encounter.
+    cmd += f' --build-property build.extra_flags="{extra_flags}"'
 
     if verbose:
         cmd += ' -v'
 
     upload_args = f' -u -t -p {port}'
-    if not (dry_run or show_properties):
+    if will_upload:
         cmd += upload_args
 
     print(cmd)
@@ -477,26 +670,40 @@ def upload(sketch_dir, arduino_lib_dir, fqbn=None, port=None,
     p = Popen(cmd, shell=True)
     p.communicate()
 
-    if td_tmp_build_dir is None:
-        if exists(build_path):
-            shutil.rmtree(build_path)
-
-        if exists(build_cache_path):
-            shutil.rmtree(build_cache_path)
-    else:
-        # This should delete the contents, as in the if above, without needing
-        # to do so explicitly.
-        td_tmp_build_dir.cleanup()
-
     # This p.returncode is set by p.communicate() above.
     failure = bool(p.returncode)
+
+    if firmware_dir is not None:
+        if failure:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        else:
+            try:
+                os.replace(output_dir, firmware_dir)
+            except OSError:
+                # Another process cached the same build first.
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+            _prune_firmware_cache(firmware_cache_dir)
+
+    if not keep_build_dirs:
+        if td_tmp_build_dir is None:
+            if exists(build_path):
+                shutil.rmtree(build_path)
+
+            if exists(build_cache_path):
+                shutil.rmtree(build_cache_path)
+        else:
+            # This should delete the contents, as in the if above, without needing
+            # to do so explicitly.
+            td_tmp_build_dir.cleanup()
+
     if failure:
         raise RuntimeError('compilation or upload failed')
 
 
 def main(port=None, fqbn=None, dry_run=False, show_properties=False,
     arduino_debug_prints=False, build_root=None, use_symlinks=True,
-    verbose=False):
+    verbose=False, use_cache=True):
 
     if build_root is None:
         # TODO will this just err if it can't be created?
@@ -515,12 +722,16 @@ def main(port=None, fqbn=None, dry_run=False, show_properties=False,
     # This function will create the folders at the paths in the sketch_dir and
     # arduino_lib_dir arguments.
     make_arduino_sketch_and_libraries(sketch_dir, arduino_lib_dir,
-        use_symlinks=use_symlinks
+        use_symlinks=use_symlinks, use_cache=use_cache
     )
 
-    upload(sketch_dir, arduino_lib_dir, build_root=build_root,
+    # Unless specified, upload uses the persistent build directories under
+    # build_cache_dir when caching, rather than ones under this temporary directory.
+    upload(sketch_dir, arduino_lib_dir,
+        build_root=None if use_cache and td_tmp_build_dir is not None else build_root,
         port=port, fqbn=fqbn, dry_run=dry_run, show_properties=show_properties,
-        arduino_debug_prints=arduino_debug_prints, verbose=verbose
+        arduino_debug_prints=arduino_debug_prints, verbose=verbose,
+        use_cache=use_cache
     )
     if td_tmp_build_dir is not None:
         td_tmp_build_dir.cleanup()
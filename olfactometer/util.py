@@ -1,8 +1,8 @@
 
+import binascii
 import os
 from os.path import split, join
 import time
-import subprocess
 import warnings
 from datetime import timedelta
 import math
@@ -11,6 +11,8 @@ from pathlib import Path
 from typing import Dict, Any, Optional
 
 import appdirs
+# TODO try to find a way of accessing this type without any prefix '_'s
+from google.protobuf.internal.encoder import _VarintBytes
 # TODO use to make functions for printing vid/pid (or other unique ids for usb
 # devices), which can be used to reference specific MFCs / arduinos in config
 # (and also for listing ports corresponding to such devices).
@@ -20,28 +22,44 @@ import appdirs
 # that if the wrong arduino is connected it can be detected?
 
 from olfactometer import IN_DOCKER, THIS_PACKAGE_DIR, _DEBUG
-from olfactometer.config_io import DEFAULT_HARDWARE_ENVVAR, HARDWARE_DIR_ENVVAR
+from olfactometer import persist, _protogen, timeline
 
 
 # TODO rename from 'outputs' to 'python' or something, if this isn't also generating C
 # side of things
 def generate_protobuf_outputs():
-    # TODO maybe only do this if installed editable / not installed and being
-    # used from within source tree? (would probably have to be a way to include
-    # build in setup.py... and not sure there is)
-    # TODO only do this if proto_file has changed since the python outputs have
+    """Regenerates olf_pb2.py from olf.proto, whether or not it is out of date.
+
+    Importing the package already does this when olf.proto has changed.
+    """
     # TODO TODO wait, why doesn't this need to use the nanopdb_generator, or
     # otherwise reference that? doesn't it need to be symmetric w/ firmware
     # definitions generated via nanopb?
-    proto_file = join(THIS_PACKAGE_DIR, 'olf.proto')
-    proto_path, _ = split(proto_file)
-    p = subprocess.Popen(['protoc', f'--python_out={THIS_PACKAGE_DIR}',
-        f'--proto_path={proto_path}', proto_file
-    ])
-    p.communicate()
-    failure = bool(p.returncode)
-    if failure:
-        raise RuntimeError(f'generating python code from {proto_file} failed')
+    _protogen.generate(THIS_PACKAGE_DIR)
+
+
+def encode_message(msg) -> bytes:
+    """Returns bytes to send to the Arduino for protobuf message (not incl. msg num).
+
+    Bytes are: <varint size of serialized message><serialized message><CRC16>
+    """
+    serialized = msg.SerializeToString()
+    assert type(serialized) is bytes
+
+    # TODO check this calculation is still correct for stuff with "repeated"
+    # things in them
+    # https://www.datadoghq.com/blog/engineering/protobuf-parsing-in-python/
+    varint_size = _VarintBytes(len(serialized))
+
+    # This uses polynomial 0x1021 (same as what I'm using on Arduino side)
+    crc = binascii.crc_hqx(varint_size + serialized, 0xFFFF)
+
+    # This 'big' [Endian] byte order works for comparing on Arduino side,
+    # with current code there.
+    crc_bytes = crc.to_bytes(2, 'big')
+    assert type(crc_bytes) is bytes and len(crc_bytes) == 2
+
+    return varint_size + serialized + crc_bytes
 
 
 def in_windows():
@@ -147,10 +165,8 @@ def seconds_per_trial(all_required_data):
     if settings.WhichOneof('control') == 'follow_hardware_timing':
         raise ValueError('follow_hardware_timing case not supported')
 
-    timing = settings.timing
-    # TODO also calculate (expected) overrun of pulse_us depending on pulse train
-    # settings
-    return (timing.pre_pulse_us + timing.pulse_us + timing.post_pulse_us) / 1e6
+    # Includes pulse train overrun and firmware timer rounding (see `timeline`).
+    return timeline.trial_timing(settings.timing).trial_us / 1e6
 
 
 def number_of_trials(all_required_data):
@@ -222,7 +238,12 @@ def get_trial_pins(pin_sequence, trial_index):
 def get_pins2odors(config_dict):
     """Returns dict: int -> odor or None if not in config_dict
     """
-    return config_dict.get('pins2odors')
+    pins2odors = config_dict.get('pins2odors')
+    if pins2odors is None:
+        return None
+
+    # Keys are str in JSON configs.
+    return {int(p): o for p, o in pins2odors.items()}
 
 
 def print_pins2odors(config_dict, header=True, **format_odor_kwargs) -> bool:
@@ -283,6 +304,7 @@ def get_last_attempted():
         raise RuntimeError('can not get last attempted config file in Docker')
 
     last_attempted_cache_fname = get_last_attempted_cache_fname()
+    persist.wait_for(last_attempted_cache_fname)
 
     if not last_attempted_cache_fname.exists():
         raise IOError('no record of previously attempted config file!')
@@ -313,7 +335,8 @@ def write_last_attempted_config_file(config_fname) -> None:
     last_attempted_cache_fname = get_last_attempted_cache_fname(mkdir=True)
 
     cache_contents = f'{config_fname}\n{Path(config_fname).resolve()}'
-    last_attempted_cache_fname.write_text(cache_contents)
+    # In the background, as this happens right before a run starts.
+    persist.write(last_attempted_cache_fname, cache_contents)
 
 
 def argparse_config_args(parser: Optional[ArgumentParser] = None, *,
@@ -329,6 +352,10 @@ def argparse_config_args(parser: Optional[ArgumentParser] = None, *,
         )
 
     if hardware:
+        # Not imported at module level, as config_io imports this module (and importing
+        # util alone should not require importing config_io).
+        from olfactometer.config_io import DEFAULT_HARDWARE_ENVVAR, HARDWARE_DIR_ENVVAR
+
         # TODO document OLFACTOMETER_DEFAULT_HARDWARE, and interactions with the
         # same keys already present in some YAML
         parser.add_argument('-r', '--hardware', action='store', default=None,
@@ -342,6 +369,30 @@ def argparse_config_args(parser: Optional[ArgumentParser] = None, *,
     return parser
 
 
+def argparse_serial_load_arg(parser: Optional[ArgumentParser] = None, *,
+    dest: str = 'parallel_load', min_files: Optional[int] = None,
+    description: str = 'load and validate config files in a directory'
+    ) -> ArgumentParser:
+    """Returns CLI parser with --serial-load arg.
+
+    Sets `dest` to False if passed, and None (so the parallelism is decided by the
+    number of files, at least `min_files`) otherwise.
+    """
+    if parser is None:
+        parser = ArgumentParser()
+
+    if min_files is None:
+        # Not imported at module level, for the same reason as in argparse_config_args.
+        from olfactometer.config_io import parallel_load_min_files
+        min_files = parallel_load_min_files
+
+    parser.add_argument('--serial-load', action='store_const', const=False,
+        default=None, dest=dest, help=f'{description} one at a time, rather than in '
+        f'parallel (the default when at least {min_files} files need to be loaded)'
+    )
+    return parser
+
+
 # TODO maybe move both of these argparse fns to cli_entry_points.py.
 # one reason not to would be if i wanted to "from cli_entry_points import *"
 # in __init__.py (need a line for each entrypoint for setup.py entry points to
@@ -2,13 +2,19 @@
 Validation, primarily of config and hardware state.
 """
 
+from itertools import chain
 from os.path import join
 import warnings
+from typing import NamedTuple, Optional, Tuple
 
 from google.protobuf import pyext
 
 from olfactometer import THIS_PACKAGE_DIR, _DEBUG
-from olfactometer.flow import flow_setpoints_sequence_key
+from olfactometer.flow import flow_setpoints_sequence_key, mock_flow_controllers_key
+from olfactometer.flow_schedule import flow_change_lead_s_key
+from olfactometer.flow_stream import (waveform_key, flow_stream_rate_hz_key,
+    default_flow_stream_rate_hz, validate_waveform, waveform_samples
+)
 
 
 nanopb_options_path = join(THIS_PACKAGE_DIR, 'olf.options')
@@ -16,24 +22,67 @@ with open(nanopb_options_path, 'r') as f:
     lines = [x.strip() for x in f.readlines()]
 nanopb_options_lines = [x for x in lines if len(x) > 0 and not x[0] == '#']
 
-def max_count(name):
-    """Returns the int max_count field associated with name in olf.options.
+def _parse_max_counts():
+    """Returns dict of name -> int max_count, for all such fields in olf.options.
     """
     field_and_sep = 'max_count:'
+    name2max_count = dict()
     for line in nanopb_options_lines:
-        if line.startswith(name):
-            rhs = line.split()[1]
-            if rhs.startswith(field_and_sep):
-                try:
-                    return int(rhs[len(field_and_sep):])
-                except ValueError as e:
-                    # Parsing could fail if there is a comment right after int,
-                    # but should just avoid making lines like that in the
-                    # options file.
-                    print('Fix this line in the olf.options file:')
-                    print(line)
-                    raise
-    raise ValueError(f'no lines starting with name={name}')
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+
+        name, rhs = parts[:2]
+        if rhs.startswith(field_and_sep):
+            try:
+                name2max_count[name] = int(rhs[len(field_and_sep):])
+            except ValueError as e:
+                # Parsing could fail if there is a comment right after int,
+                # but should just avoid making lines like that in the
+                # options file.
+                print('Fix this line in the olf.options file:')
+                print(line)
+                raise
+    return name2max_count
+
+_name2max_count = _parse_max_counts()
+
+def max_count(name):
+    """Returns the int max_count field associated with name in olf.options.
+    """
+    try:
+        return _name2max_count[name]
+    except KeyError:
+        raise ValueError(f'no lines starting with name={name}')
+
+
+# Used by `validate_pin`. Pins 0 and 1 are used for Serial communication.
+reserved_pins = (0, 1)
+# Assuming an Arduino Mega, which should have 53 as the highest valid digital pin number
+# (they start at 0).
+max_pin = 53
+
+class ValidationSchema(NamedTuple):
+    """Limits that pin sequences are validated against. See `get_schema`.
+    """
+    max_pin_groups: int
+    max_pins_per_group: int
+    reserved_pins: Tuple[int, ...]
+    max_pin: int
+
+_schema = None
+def get_schema() -> ValidationSchema:
+    """Returns limits from olf.options (and above), only building them on first call.
+    """
+    global _schema
+    if _schema is None:
+        _schema = ValidationSchema(
+            max_pin_groups=max_count('PinSequence.pin_groups'),
+            max_pins_per_group=max_count('PinGroup.pins'),
+            reserved_pins=reserved_pins,
+            max_pin=max_pin,
+        )
+    return _schema
 
 
 def validate_port(port):
@@ -85,9 +134,38 @@ def validate_settings(settings, **kwargs):
         raise ValueError('only -k command line arg should set settings.no_ack')
 
 
+def pin_sequence_arrays(pin_sequence):
+    """Returns arrays of all pins (flattened, in order) and of the # of pins per group.
+    """
+    # Deferred, so that commands not validating anything (e.g. only reading cached
+    # configs) do not need to import numpy.
+    import numpy as np
+
+    pin_groups = pin_sequence.pin_groups
+    group_sizes = np.fromiter([len(g.pins) for g in pin_groups], dtype=np.intp,
+        count=len(pin_groups)
+    )
+    pins = np.fromiter(chain.from_iterable([g.pins for g in pin_groups]),
+        dtype=np.int64, count=int(group_sizes.sum())
+    )
+    return pins, group_sizes
+
+
+def _trial_str(group_index) -> str:
+    return f'trial {group_index + 1} (pin_groups[{group_index}])'
+
+
 def validate_pin_sequence(pin_sequence, warn=True):
-    # Could make the max count validation automatic, but not really worth it.
-    mc = max_count('PinSequence.pin_groups')
+    """Raises ValueError if pin_sequence, or any of its pin groups, is invalid.
+
+    Pins from all groups are checked together (see `pin_sequence_arrays`), rather
+    than with `validate_pin_group` / `validate_pin` on each, which dominated validation
+    time for long sequences. Errors are about the first offending group.
+    """
+    import numpy as np
+
+    schema = get_schema()
+    mc = schema.max_pin_groups
     gc = len(pin_sequence.pin_groups)
     if gc == 0:
         raise ValueError('PinSequence should not be empty')
@@ -96,9 +174,53 @@ def validate_pin_sequence(pin_sequence, warn=True):
             f'({gc} > {mc})'
         )
 
+    pins, group_sizes = pin_sequence_arrays(pin_sequence)
+    group_indices = np.repeat(np.arange(gc, dtype=np.int64), group_sizes)
+
+    bad_groups = (group_sizes == 0) | (group_sizes > schema.max_pins_per_group)
+
+    # Same checks as `validate_pin`.
+    bad_pins = (pins < 0) | (pins > schema.max_pin)
+    for reserved_pin in schema.reserved_pins:
+        bad_pins |= pins == reserved_pin
+    bad_groups[group_indices[bad_pins]] = True
+
+    # Sorted by group, then pin, so any duplicates within a group are adjacent.
+    order = np.lexsort((pins, group_indices))
+    sorted_groups = group_indices[order]
+    sorted_pins = pins[order]
+    duplicates = ((sorted_groups[1:] == sorted_groups[:-1]) &
+        (sorted_pins[1:] == sorted_pins[:-1])
+    )
+    bad_groups[sorted_groups[1:][duplicates]] = True
+
+    bad_group_indices = np.flatnonzero(bad_groups)
+    if len(bad_group_indices) > 0:
+        i = int(bad_group_indices[0])
+        start = int(group_sizes[:i].sum())
+        stop = start + int(group_sizes[i])
+        group_pins = pins[start:stop]
+
+        # Reporting the first problem `validate_pin_group` would, for the same group.
+        if len(group_pins) == 0:
+            err = 'PinGroup should not be empty'
+
+        elif len(group_pins) > schema.max_pins_per_group:
+            err = (f'PinGroup has {len(group_pins)} pins (> max '
+                f'{schema.max_pins_per_group}): {group_pins.tolist()}'
+            )
+
+        elif np.any(sorted_groups[1:][duplicates] == i):
+            err = f'PinGroup has duplicate pins: {group_pins.tolist()}'
+
+        else:
+            err = _invalid_pin_message(int(group_pins[bad_pins[start:stop]][0]))
+
+        raise ValueError(f'{_trial_str(i)}: {err}')
+
     # TODO delete?
     if _DEBUG and warn:
-        glens = {len(g.pins) for g in pin_sequence.pin_groups}
+        glens = set(group_sizes.tolist())
         if len(glens) > 1:
             # TODO don't do this if we have some odors presented alone as well as some
             # air mixtures? (doesn't really matter since just warning in _DEBUG case
@@ -119,23 +241,31 @@ def validate_pin(pin):
     on the Arduino, nor which version of an Arduino is being used.
     """
     assert type(pin) is int
+    err = _invalid_pin_message(pin)
+    if err is not None:
+        raise ValueError(err)
+
+
+def _invalid_pin_message(pin: int) -> Optional[str]:
+    """Returns why `validate_pin` would reject pin, or None if it would not.
+    """
     if pin < 0:
-        raise ValueError('pin must be positive')
-    elif pin in (0, 1):
-        raise ValueError('pins 0 and 1 and reserved for Serial communication')
+        return 'pin must be positive'
+    elif pin in reserved_pins:
+        return 'pins 0 and 1 and reserved for Serial communication'
     # TODO can the arduino mega analog input pins also be used as digital
     # outputs? do they occupy the integers just past 53?
-    # Assuming an Arduino Mega, which should have 53 as the highest valid
-    # digital pin number (they start at 0).
-    elif pin > 53:
-        raise ValueError('pin numbers >53 invalid')
+    elif pin > max_pin:
+        return f'pin numbers >{max_pin} invalid'
+
+    return None
 
 
 # TODO why do i have this taking **kwargs again?
 def validate_pin_group(pin_group, **kwargs):
     """Raises ValueError if invalid pin_group is detected.
     """
-    mc = max_count('PinGroup.pins')
+    mc = get_schema().max_pins_per_group
     gc = len(pin_group.pins)
     if gc == 0:
         raise ValueError('PinGroup should not be empty')
@@ -143,7 +273,7 @@ def validate_pin_group(pin_group, **kwargs):
         raise ValueError(f'PinGroup has {gc} pins (> max {mc}): {pin_group}')
 
     if len(pin_group.pins) != len(set(pin_group.pins)):
-        raise ValueError('PinGroup has duplicate pins: {pin_group}')
+        raise ValueError(f'PinGroup has duplicate pins: {pin_group}')
 
     for p in pin_group.pins:
         validate_pin(p)
@@ -152,11 +282,16 @@ def validate_pin_group(pin_group, **kwargs):
 # TODO rename to _full_name... if i end up switching to that one
 # Each function in here should take either **kwargs (if no potential warnings)
 # or warn=True kwarg. They should return None and may raise ValueError.
+# PinGroups are validated (all at once) by `validate_pin_sequence`.
 _name2validate_fn = {
     'Settings': validate_settings,
     'PinSequence': validate_pin_sequence,
-    'PinGroup': validate_pin_group
 }
+# Fields of these are not recursed into by `validate_protobuf`, as the functions above
+# already validated everything in them. This also skips the `IsInitialized` /
+# `UnknownFields` checks on each PinGroup, which can not fail for the (proto3) messages
+# we build from configs.
+_validated_in_full = {'PinSequence'}
 # TODO try to find a means of referencing these types that works in both the
 # ubuntu / windows deployments. maybe the second syntax would work in both
 # cases? test on ubuntu.
@@ -194,12 +329,11 @@ def validate_protobuf(msg, warn=True, _first_call=True):
 
         # TODO remove any of the following checks that are redundant w/ the
         # (from json) parsers
+        # (`FindInitializationErrors` is only non-empty if this is False, and is much
+        # slower, walking all fields of all submessages)
         if not msg.IsInitialized():
             raise ValueError()
 
-        elif msg.FindInitializationErrors() != []:
-            raise ValueError()
-
         elif len(msg.UnknownFields()) != 0:
             raise ValueError()
 
@@ -221,8 +355,11 @@ def validate_protobuf(msg, warn=True, _first_call=True):
 
     if name in _name2validate_fn:
         _name2validate_fn[name](msg, warn=warn)
-        # Not returning here, so that i don't have to also implement recursion
-        # in PinSequence -> PinGroup
+        # Not returning here (for most types), so that i don't have to also implement
+        # recursion in them.
+
+    if name in _validated_in_full:
+        return
 
     # The first element of each tuple returned by ListFields is a
     # FieldDescriptor object, but we are using (the seemingly equivalent)
@@ -231,105 +368,100 @@ def validate_protobuf(msg, warn=True, _first_call=True):
         validate_protobuf(value, warn=warn, _first_call=False)
 
 
-def validate_flow_setpoints_sequence(flow_setpoints_sequence, warn=True):
+def validate_flow_setpoints_sequence(flow_setpoints_sequence, warn=True,
+    flow_stream_rate_hz=default_flow_stream_rate_hz):
+    """Raises ValueError if flow_setpoints_sequence is invalid.
 
-    all_seen_ports = set()
-    all_seen_addresses = set()
+    Any waveforms are sampled (at `flow_stream_rate_hz`, as they would be streamed) and
+    checked like the trial setpoints.
 
-    trial_setpoint_sums = set()
-
-    for trial_setpoints in flow_setpoints_sequence:
-
-        curr_trial_setpoint_sum = 0.0
-        for one_controller_setpoint in trial_setpoints:
-
-            # TODO am i actually setting flows in terms of sccm (thats a unit of mass
-            # flow, right?) does it depend on hardware settings? as i commented
-            # elsewhere, is it possible to set flows in volumetric units?
-            if 'sccm' not in one_controller_setpoint:
-                raise ValueError('sccm must be set for each trial, for each flow '
-                    'controller'
-                )
-
-            if ('port' not in one_controller_setpoint and
-                'address' not in one_controller_setpoint):
-                raise ValueError('port or address must be set for each trial, for each'
-                    'flow controller. always use one or the other.'
-                )
-
-            if 'port' in one_controller_setpoint:
-                port = one_controller_setpoint['port']
-                all_seen_ports.add(port)
-                if type(port) is not str:
-                    raise ValueError(f'ports in {flow_setpoints_sequence_key} '
-                        'must be of type str'
-                    )
-
-            if 'address' in one_controller_setpoint:
-                address = one_controller_setpoint['address']
-                all_seen_addresses.add(address)
-                if type(address) is not str:
-                    raise ValueError(f'addresses in {flow_setpoints_sequence_key} '
-                        'must be of type str'
-                    )
-
-            try:
-                setpoint = float(one_controller_setpoint['sccm'])
-            except ValueError:
-                raise ValueError(f'sccm values in {flow_setpoints_sequence_key}'
-                    ' must be numeric'
-                )
-
-            if setpoint < 0:
-                raise ValueError(f'sccm values in {flow_setpoints_sequence_key}'
-                    ' must be non-negative'
-                )
-            curr_trial_setpoint_sum += setpoint
+    Returns the parsed `trial_table.FlowSetpoints`, so callers need not parse it again.
+    """
+    # Imported here for the same reason as numpy in `pin_sequence_arrays`.
+    import numpy as np
+    from olfactometer.trial_table import FlowSetpoints
 
-        trial_setpoint_sums.add(curr_trial_setpoint_sum)
+    # Checks structure (keys present, only ports or only addresses, and the same flow
+    # controllers referenced on each trial, for simplicity of downstream code).
+    flows = FlowSetpoints.from_sequence(flow_setpoints_sequence)
 
-    if len(all_seen_ports) > 0 and len(all_seen_addresses) > 0:
-        raise ValueError('only use either ports or addresses to reference flow '
-            'controllers'
+    if (flows.sccm < 0).any():
+        raise ValueError(f'sccm values in {flow_setpoints_sequence_key}'
+            ' must be non-negative'
         )
 
-    # False if using ports.
-    using_addresses = len(all_seen_addresses) > 0
+    # trial index -> column -> (sample times, sample values)
+    trial2waveform_samples = dict()
+    for (trial_index, column), extras in flows.extras.items():
+        if waveform_key not in extras:
+            continue
+
+        waveform = extras[waveform_key]
+        validate_waveform(waveform)
+
+        times_s, values = zip(*waveform_samples(waveform,
+            float(flows.sccm[trial_index, column]), rate_hz=flow_stream_rate_hz,
+            clip=False
+        ))
+        if min(values) < 0:
+            raise ValueError(f'{waveform_key} in {flow_setpoints_sequence_key} (trial '
+                f'{trial_index + 1}, {flows.mfc_ids[column]}) must not go below 0 sccm'
+            )
 
-    if warn and len(trial_setpoint_sums) > 1:
-        warnings.warn('setpoint sum is not the same on each trial! '
-            f'unique sums: {trial_setpoint_sums}'
+        trial2waveform_samples.setdefault(trial_index, dict())[column] = (
+            np.array(times_s), np.array(values)
         )
 
-    # For now, we are going to require that each port/address that is referenced is
-    # referenced in the list for each trial, for simplicity of downstream code.
-    for trial_setpoints in flow_setpoints_sequence:
+    if warn and len(flows) > 0:
+        trial_setpoint_sums = flows.sccm.astype(float).sum(axis=1)
+        if (trial_setpoint_sums != trial_setpoint_sums[0]).any():
+            warnings.warn('setpoint sum is not the same on each trial! '
+                f'unique sums: {set(np.unique(trial_setpoint_sums).tolist())}'
+            )
 
-        if using_addresses:
-            trial_addresses = {x['address'] for x in trial_setpoints}
-            if trial_addresses != all_seen_addresses:
-                missing = all_seen_addresses - trial_addresses
-                raise ValueError('each address must be referenced in each element '
-                    f'of flow_setpoints_sequence. current trial missing: {missing}'
+        for trial_index, column2samples in trial2waveform_samples.items():
+            # Setpoints of every flow controller at each time any waveform changes,
+            # holding each at its last sample (or the trial setpoint, before the first).
+            times_s = np.unique(np.concatenate([t for t, _ in column2samples.values()]))
+            setpoints = np.tile(flows.sccm[trial_index].astype(float),
+                (len(times_s), 1)
+            )
+            for column, (sample_times_s, values) in column2samples.items():
+                last_sample = np.searchsorted(sample_times_s, times_s, side='right') - 1
+                setpoints[:, column] = np.where(last_sample >= 0, values[last_sample],
+                    setpoints[:, column]
                 )
-        else:
-            trial_ports = {x['port'] for x in trial_setpoints}
-            if trial_ports != all_seen_ports:
-                missing = all_seen_ports - trial_ports
-                raise ValueError('each port must be referenced in each element '
-                    f'of flow_setpoints_sequence. current trial missing: {missing}'
+
+            waveform_sums = setpoints.sum(axis=1)
+            if not np.allclose(waveform_sums, trial_setpoint_sums[0]):
+                warnings.warn(f'setpoint sum changes during trial {trial_index + 1} '
+                    f'({waveform_key}s)! ranges from {waveform_sums.min():.6g} to '
+                    f'{waveform_sums.max():.6g}'
                 )
 
+    return flows
+
 
 def validate_config_dict(config_dict, warn=True):
     """Raises ValueError if config_dict has some invalid data.
 
     Doesn't check firmware settings in the `AllRequiredData` object, which is
     currently handled by `validate`.
+
+    Returns the `trial_table.FlowSetpoints` parsed from `flow_setpoints_sequence`, or
+    None if config has none.
     """
     # there's other stuff that could be checked here, but just dealing w/ some
     # of the possible config problems when adding flow controller support for
     # now
+    flows = None
+
+    # Checked first, since any waveforms are sampled at this rate to validate them.
+    if flow_stream_rate_hz_key in config_dict:
+        rate_hz = config_dict[flow_stream_rate_hz_key]
+        if type(rate_hz) not in (int, float) or rate_hz <= 0:
+            raise ValueError(f'{flow_stream_rate_hz_key} must be a positive number')
+
     if flow_setpoints_sequence_key in config_dict:
         # TODO test this w/ actual valid input to enable follow_hardware_timing
         settings = config_dict['settings']
@@ -355,5 +487,24 @@ def validate_config_dict(config_dict, warn=True):
                 f'pin_sequence.pin_groups) ({f_len} != {p_len})'
             )
 
-        validate_flow_setpoints_sequence(flow_setpoints_sequence, warn=warn)
+        flows = validate_flow_setpoints_sequence(flow_setpoints_sequence, warn=warn,
+            flow_stream_rate_hz=config_dict.get(flow_stream_rate_hz_key,
+                default_flow_stream_rate_hz
+            )
+        )
+
+    if flow_change_lead_s_key in config_dict:
+        lead_s = config_dict[flow_change_lead_s_key]
+        if type(lead_s) not in (int, float) or lead_s < 0:
+            raise ValueError(f'{flow_change_lead_s_key} must be a non-negative number '
+                'of seconds'
+            )
+
+    if mock_flow_controllers_key in config_dict:
+        mock_params = config_dict[mock_flow_controllers_key]
+        if type(mock_params) not in (bool, dict):
+            raise ValueError(f'{mock_flow_controllers_key} must be either true/false or '
+                'a mapping of simulation parameters'
+            )
 
+    return flows
@@ -1,10 +1,38 @@
 #!/usr/bin/env python3
 
+import importlib.util
+from os.path import join, split, abspath
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+
+package_dir = join(split(abspath(__file__))[0], 'olfactometer')
+
+def _load_protogen():
+    # Loading by path, as importing the package would try to generate this itself.
+    spec = importlib.util.spec_from_file_location('_protogen',
+        join(package_dir, '_protogen.py')
+    )
+    protogen = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(protogen)
+    return protogen
+
+
+class BuildPyWithProtobuf(build_py):
+    """Generates olf_pb2.py (if olf.proto changed) before copying package files.
+
+    So importing the installed package does not need to run protoc.
+    """
+    def run(self):
+        _load_protogen().ensure_generated(package_dir)
+        super().run()
+
 
 setup(
     name='olfactometer',
     packages=find_packages(),
+    cmdclass={'build_py': BuildPyWithProtobuf},
     install_requires=[
         # For nanopb (does it not refer to them though? this might have just been when I
         # was using the submodule, rather than the one also in install_requires
@@ -55,7 +83,14 @@ setup(
         # for reading single characters without the Enter press builtin input(...)
         # requires. only tried 4.0.5
         'readchar',
+
+        # For vectorized validation of pin sequences.
+        'numpy',
     ],
+    extras_require={
+        # For olf-export to .parquet / .arrow (.csv works without).
+        'export': ['pyarrow'],
+    },
     # This just duplicates what's in test_requirements.txt, because apparently
     # pip doesn't actually provide any way to install these...
     tests_require=[
@@ -77,9 +112,11 @@ setup(
             'olf-test-valves=olfactometer:valve_test_cli',
             'olf-one-valve=olfactometer:one_valve_cli',
             'olf-flush=olfactometer:flush_cli',
+            'olf-mfc-response=olfactometer:mfc_response_cli',
 
             'olf-time=olfactometer:print_config_time_cli',
             'olf-pins2odors=olfactometer:show_pins2odors_cli',
+            'olf-export=olfactometer:export_cli',
             # See TODO in upload.version_str definition. until it's addressed,
             # that function won't be able to provide any meaningful output
             #'olf-version-str=olfactometer:version_str',
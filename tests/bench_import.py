@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compares time to `import olfactometer` (in a fresh interpreter) when olf_pb2.py is up to
+date (only the olf.proto hash check) vs when protoc needs to regenerate it (what every
+import used to do).
+
+Also times the imports different commands need. Use `python -X importtime -c <code>`
+with the code below for a breakdown.
+"""
+
+from os.path import join
+import subprocess
+import sys
+import time
+
+from olfactometer import THIS_PACKAGE_DIR, _protogen
+
+
+# Description -> code importing what that command needs.
+command2import_code = {
+    'entry point lookup (any olf-* command)':
+        'import olfactometer; olfactometer.main_cli',
+    'olf-lastrun': 'from olfactometer import util',
+    'olf-time / olf-pins2odors': 'from olfactometer import olf',
+    'olf (running configs)': 'from olfactometer import olf, flow_worker; '
+        'import serial, alicat, readchar, pyperclip',
+}
+
+
+def best_import_time_s(n=10, setup=None, code='import olfactometer'):
+    times_s = []
+    for _ in range(n):
+        if setup is not None:
+            setup()
+
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        times_s.append(time.perf_counter() - t0)
+
+    return min(times_s)
+
+
+def python_startup_s(n=10):
+    times_s = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times_s.append(time.perf_counter() - t0)
+
+    return min(times_s)
+
+
+def main():
+    startup_s = python_startup_s()
+
+    def make_stale():
+        # Dropping the recorded hash, as if olf.proto had changed.
+        path = join(THIS_PACKAGE_DIR, _protogen.generated_fname)
+        with open(path) as f:
+            lines = [x for x in f if not x.startswith(_protogen.proto_hash_var)]
+        with open(path, 'w') as f:
+            f.writelines(lines)
+
+    try:
+        regenerate_s = best_import_time_s(setup=make_stale)
+    finally:
+        _protogen.generate(THIS_PACKAGE_DIR)
+
+    check_only_s = best_import_time_s()
+
+    print(f'python startup: {startup_s:.3f}s')
+    print(f'import, regenerating olf_pb2.py: {regenerate_s - startup_s:.3f}s')
+    print(f'import, olf_pb2.py up to date: {check_only_s - startup_s:.3f}s')
+    print(f'hash check alone: {best_hash_check_s() * 1e3:.3f}ms')
+
+    print()
+    for command, code in command2import_code.items():
+        print(f'{command}: {best_import_time_s(code=code) - startup_s:.3f}s')
+
+
+def best_hash_check_s(n=100):
+    times_s = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        assert not _protogen.is_stale(THIS_PACKAGE_DIR)
+        times_s.append(time.perf_counter() - t0)
+
+    return min(times_s)
+
+
+if __name__ == '__main__':
+    main()
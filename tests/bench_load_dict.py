@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Compares time to convert generated config dicts to `AllRequiredData`, between
+`json_format.ParseDict` and the builder `config_io.load_dict` uses.
+"""
+
+import time
+
+from google.protobuf import json_format
+
+from olfactometer import config_io, olf_pb2
+from conftest import make_generated_config
+
+
+def best_time_s(fn, n=20):
+    times_s = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        times_s.append(time.perf_counter() - t0)
+    return min(times_s)
+
+
+def parse_dict(config_dict):
+    message = olf_pb2.AllRequiredData()
+    json_format.ParseDict(config_dict, message, ignore_unknown_fields=True)
+    return message
+
+
+def main():
+    for n_trials in (100, 1000, 10000):
+        generated_config = make_generated_config(n_trials=n_trials)
+
+        assert config_io.load_dict(generated_config)[0] == parse_dict(
+            generated_config
+        )
+
+        parse_dict_s = best_time_s(lambda: parse_dict(generated_config))
+        load_dict_s = best_time_s(lambda: config_io.load_dict(generated_config))
+
+        print(f'{n_trials} trials: {parse_dict_s * 1e3:.1f}ms (ParseDict) -> '
+            f'{load_dict_s * 1e3:.2f}ms ({parse_dict_s / load_dict_s:.1f}x)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Compares time to validate maximum size pin sequences, between the vectorized
+`validation.validate_pin_sequence` and checking each group with `validate_pin_group`
+(how `validate_protobuf` used to check them).
+"""
+
+import random
+import time
+
+from olfactometer import validation
+from conftest import make_pin_sequence
+
+
+def best_time_s(fn, n=200):
+    times_s = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        times_s.append(time.perf_counter() - t0)
+    return min(times_s)
+
+
+def per_group(pin_sequence):
+    for pin_group in pin_sequence.pin_groups:
+        validation.validate_pin_group(pin_group)
+
+
+def main():
+    rng = random.Random(0)
+    schema = validation.get_schema()
+    pin_sequence = make_pin_sequence([
+        rng.sample(range(2, schema.max_pin + 1), schema.max_pins_per_group)
+        for _ in range(schema.max_pin_groups)
+    ])
+
+    per_group_s = best_time_s(lambda: per_group(pin_sequence))
+    vectorized_s = best_time_s(lambda: validation.validate_pin_sequence(pin_sequence))
+
+    print(f'{schema.max_pin_groups} groups of {schema.max_pins_per_group} pins: '
+        f'per group: {per_group_s * 1e3:.3f}ms, vectorized: {vectorized_s * 1e3:.3f}ms '
+        f'({per_group_s / vectorized_s:.1f}x)'
+    )
+
+
+if __name__ == '__main__':
+    main()
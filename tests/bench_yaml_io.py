@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Compares YAML load / write times for a generated 1000-trial config, between PyYAML's
+pure Python implementation and the libyaml one `config_io` uses (when available).
+"""
+
+import time
+
+import yaml
+
+from olfactometer import config_io
+from conftest import make_generated_config
+
+
+class PurePythonNoAliasDumper(yaml.SafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+
+def best_time_s(fn, n=5):
+    times_s = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        times_s.append(time.perf_counter() - t0)
+    return min(times_s)
+
+
+def main():
+    generated_config = make_generated_config(n_trials=1000)
+    kwargs = dict(default_flow_style=False, sort_keys=False)
+
+    pure_dump_s = best_time_s(lambda: yaml.dump(generated_config,
+        Dumper=PurePythonNoAliasDumper, **kwargs
+    ))
+    dump_s = best_time_s(lambda: yaml.dump(generated_config,
+        Dumper=config_io.NoAliasDumper, **kwargs
+    ))
+
+    yaml_str = yaml.dump(generated_config, Dumper=config_io.NoAliasDumper, **kwargs)
+    assert yaml_str == yaml.dump(generated_config, Dumper=PurePythonNoAliasDumper,
+        **kwargs
+    )
+
+    pure_load_s = best_time_s(lambda: yaml.load(yaml_str, Loader=yaml.SafeLoader))
+    load_s = best_time_s(lambda: config_io.safe_load_yaml(yaml_str))
+
+    print(f'libyaml available: {yaml.__with_libyaml__}')
+    print(f'YAML size: {len(yaml_str) / 1024:.0f} KiB')
+    print(f'dump: {pure_dump_s * 1e3:.1f}ms (pure Python) -> {dump_s * 1e3:.1f}ms '
+        f'({pure_dump_s / dump_s:.1f}x)'
+    )
+    print(f'load: {pure_load_s * 1e3:.1f}ms (pure Python) -> {load_s * 1e3:.1f}ms '
+        f'({pure_load_s / load_s:.1f}x)'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Helpers shared by tests (as fixtures) and benchmarks (which import them from here, as
+they are run as scripts from this directory), and fixtures used by all tests.
+"""
+
+import random
+
+import pytest
+
+from olfactometer import util
+from olfactometer.olf_pb2 import PinSequence
+
+
+@pytest.fixture(autouse=True)
+def user_data_dir(monkeypatch, tmp_path):
+    """Points `util.user_data_dir` at tmp_path, so no test reads or writes the caches
+    (configs, MFC ports, firmware, etc) of whoever is running the tests.
+    """
+    monkeypatch.setattr(util, 'user_data_dir', lambda mkdir=False: tmp_path)
+    return tmp_path
+
+
+def make_generated_config(n_trials=1000, seed=0):
+    """Returns config dict shaped like generator output (e.g. pair_concentration_grid).
+    """
+    rng = random.Random(seed)
+
+    odors = [{'name': f'odor {i}', 'log10_conc': -rng.randint(2, 6),
+        'abbrev': f'o{i}'} for i in range(40)
+    ]
+    pins = list(range(2, 42))
+    pins2odors = dict(zip(pins, odors))
+
+    # Same objects referenced many times, which PyYAML would write as aliases by
+    # default.
+    trial_flows = [
+        [{'address': 'A', 'sccm': 200.0}, {'address': 'B', 'sccm': 1800.0}],
+        [{'address': 'A', 'sccm': 20.0}, {'address': 'B', 'sccm': 1980.0}],
+    ]
+    return {
+        'settings': {
+            'timing': {'pre_pulse_us': 2000000, 'pulse_us': 1000000,
+                'post_pulse_us': 11000000
+            },
+            'balance_pin': 50,
+        },
+        'pin_sequence': {'pin_groups': [{'pins': rng.sample(pins, 2)}
+            for _ in range(n_trials)
+        ]},
+        'pins2odors': pins2odors,
+        'odors': odors,
+        'flow_setpoints_sequence': [rng.choice(trial_flows) for _ in range(n_trials)],
+    }
+
+
+def make_pin_sequence(pin_lists):
+    pin_sequence = PinSequence()
+    for pins in pin_lists:
+        pin_sequence.pin_groups.add().pins.extend(pins)
+    return pin_sequence
+
+
+@pytest.fixture(name='make_generated_config')
+def _make_generated_config_fixture():
+    return make_generated_config
+
+
+@pytest.fixture(name='make_pin_sequence')
+def _make_pin_sequence_fixture():
+    return make_pin_sequence
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+import shutil
+
+import pytest
+
+from olfactometer import config_io, util, persist
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+@pytest.fixture
+def cache_dir(user_data_dir):
+    return user_data_dir / 'config_cache'
+
+
+def test_load_cached(cache_dir, tmp_path):
+    config_path = str(tmp_path / 'flow_steps.yaml')
+    shutil.copy(flow_steps_yaml, config_path)
+
+    # Plain loads only read the cache, unless asked to write it.
+    all_required_data, config_dict = config_io.load(config_path)
+    persist.flush()
+    assert len(list(cache_dir.glob('*.pkl'))) == 0
+
+    config_io.load(config_path, write_cache=True)
+    # Cache entries are written in the background.
+    persist.flush()
+    assert len(list(cache_dir.glob('*.pkl'))) == 1
+
+    cached_all_required_data, cached_config_dict = config_io.load(config_path)
+    assert cached_all_required_data == all_required_data
+    assert cached_config_dict == config_dict
+
+    compiled = config_io.load_compiled(config_path)
+    assert compiled.all_required_data == all_required_data
+    assert compiled.encoded_messages['settings'] == util.encode_message(
+        all_required_data.settings
+    )
+    # Validation / encoding added to the same entry.
+    persist.flush()
+    assert len(list(cache_dir.glob('*.pkl'))) == 1
+    assert config_io.load_compiled(config_path) == compiled
+
+    # Changing contents should not re-use the old entry.
+    with open(config_path, 'a') as f:
+        f.write('\nflow_change_lead_s: 1.0\n')
+
+    config_dict = config_io.load_compiled(config_path).config_dict
+    assert config_dict['flow_change_lead_s'] == 1.0
+    persist.flush()
+    assert len(list(cache_dir.glob('*.pkl'))) == 2
+
+
+def test_cache_eviction(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(config_io, 'max_config_cache_entries', 2)
+
+    config_paths = []
+    for i in range(3):
+        config_path = str(tmp_path / f'config_{i}.yaml')
+        with open(flow_steps_yaml, 'r') as src, open(config_path, 'w') as dst:
+            dst.write(src.read() + f'\n# {i}\n')
+
+        config_io.load_compiled(config_path)
+        config_paths.append(config_path)
+
+    persist.flush()
+    assert len(list(cache_dir.glob('*.pkl'))) == 2
+    # First one was least recently used.
+    assert config_io._read_config_cache(config_paths[0]) is None
+    assert config_io._read_config_cache(config_paths[2]) is not None
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+import shutil
+
+import pytest
+
+from olfactometer import config_io, olf
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def test_config_iter_loads_once(monkeypatch, tmp_path):
+    n_loads = []
+    _load_compiled = config_io._load_compiled
+    def counting_load_compiled(config, **kwargs):
+        n_loads.append(config)
+        return _load_compiled(config, **kwargs)
+
+    monkeypatch.setattr(config_io, '_load_compiled', counting_load_compiled)
+
+    config_dir = tmp_path / 'configs'
+    config_dir.mkdir()
+    config_paths = [str(config_dir / f'flow_steps_{i}.yaml') for i in (2, 0, 1)]
+    for config_path in config_paths:
+        shutil.copy(flow_steps_yaml, config_path)
+
+    def loaded_configs():
+        return list(olf.config_iter(str(config_dir),
+            _skip_config_preprocess_check=True
+        ))
+
+    loaded = loaded_configs()
+    assert [x.path for x in loaded] == sorted(config_paths)
+    assert len(n_loads) == 3
+
+    path, all_required_data, config_dict, _ = loaded[0]
+    assert all_required_data.settings.timing.pulse_us == 1000000
+    assert 'flow_setpoints_sequence' in config_dict
+
+    # Already loaded, in this process.
+    assert [x.path for x in loaded_configs()] == sorted(config_paths)
+    assert len(n_loads) == 3
+
+    # Changed files are loaded again.
+    with open(config_paths[0], 'a') as f:
+        f.write('\nflow_change_lead_s: 1.0\n')
+
+    loaded_configs()
+    assert len(n_loads) == 4
+
+    # Running with the yielded record does not load the config again.
+    olf.run(loaded[0], try_parse=True)
+    assert len(n_loads) == 4
+
+
+def test_parallel_load(monkeypatch, tmp_path):
+    config_dir = tmp_path / 'configs'
+    config_dir.mkdir()
+    for i in range(10):
+        shutil.copy(flow_steps_yaml, config_dir / f'flow_steps_{i}.yaml')
+
+    serial = list(olf.config_iter(str(config_dir), parallel_load=False,
+        _skip_config_preprocess_check=True
+    ))
+
+    # So none are already loaded in this process.
+    monkeypatch.setattr(config_io, '_path2compiled', dict())
+    parallel = list(olf.config_iter(str(config_dir),
+        _skip_config_preprocess_check=True
+    ))
+    assert parallel == serial
+    assert [split(x.path)[1] for x in parallel] == [f'flow_steps_{i}.yaml'
+        for i in range(10)
+    ]
+
+
+def test_load_errors_aggregated(tmp_path):
+    config_paths = []
+    for i in range(4):
+        config_path = str(tmp_path / f'flow_steps_{i}.yaml')
+        with open(flow_steps_yaml, 'r') as src, open(config_path, 'w') as dst:
+            dst.write(src.read())
+            if i == 1:
+                dst.write('\nsettings:\n  no_ack: 7\n')
+            elif i == 3:
+                dst.write('\n{\n')
+
+        config_paths.append(config_path)
+
+    for parallel in (False, True):
+        with pytest.raises(ValueError) as exc_info:
+            config_io.load_compiled_many(config_paths, parallel=parallel)
+
+        message = str(exc_info.value)
+        assert message.startswith('2/4 configs invalid')
+        assert config_paths[1] in message and config_paths[3] in message
+        assert config_paths[0] not in message
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+from os.path import split, join, exists
+import shutil
+import struct
+
+from olfactometer import config_io, olf, persist
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def test_sidecar(monkeypatch, tmp_path):
+    monkeypatch.setattr(config_io, 'use_config_cache', False)
+
+    config_path = str(tmp_path / 'flow_steps.yaml')
+    shutil.copy(flow_steps_yaml, config_path)
+    expected = config_io.load(config_path)
+
+    sidecar_path = config_io.write_config_sidecar(config_path, *expected)
+    assert sidecar_path == str(tmp_path / 'flow_steps.pb')
+
+    n_yaml_loads = []
+    load_yaml = config_io.load_yaml
+    def counting_load_yaml(*args, **kwargs):
+        n_yaml_loads.append(None)
+        return load_yaml(*args, **kwargs)
+
+    monkeypatch.setattr(config_io, 'load_yaml', counting_load_yaml)
+
+    assert config_io.load(config_path) == expected
+    assert len(n_yaml_loads) == 0
+
+    # YAML is authoritative. Sidecar no longer matches, so it is not used.
+    with open(config_path, 'a') as f:
+        f.write('\nflow_change_lead_s: 1.0\n')
+
+    _, config_dict = config_io.load(config_path)
+    assert config_dict['flow_change_lead_s'] == 1.0
+    assert len(n_yaml_loads) == 1
+
+
+def test_timestamped_config_sidecars(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    _, config_dict = config_io.load(flow_steps_yaml)
+    config_dir = config_io.write_timestamped_config([config_dict] * 2, verbose=False)
+
+    timestamp_str = config_dir[:-len('_stimuli')]
+    persist.flush()
+    for i in range(2):
+        assert exists(join(config_dir, f'{timestamp_str}_stimuli_{i}.pb'))
+
+    # Sidecars are not treated as configs in the sequence.
+    loaded = list(olf.config_iter(config_dir, _skip_config_preprocess_check=True))
+    assert [split(x.path)[1] for x in loaded] == [
+        f'{timestamp_str}_stimuli_{i}.yaml' for i in range(2)
+    ]
+
+
+def test_sidecar_metadata_is_json(tmp_path):
+    config_path = str(tmp_path / 'flow_steps.yaml')
+    shutil.copy(flow_steps_yaml, config_path)
+    all_required_data, config_dict = config_io.load(config_path)
+
+    sidecar_path = config_io.write_config_sidecar(config_path, all_required_data,
+        config_dict
+    )
+    persist.flush()
+    with open(sidecar_path, 'rb') as f:
+        data = f.read()
+
+    offset = len(config_io.config_sidecar_magic) + 32
+    (serialized_len,) = struct.unpack_from('>I', data, offset)
+    offset += 4 + serialized_len + 4
+    metadata = json.loads(data[offset:])
+    assert 'pins2odors' in metadata
+
+    # Int pins2odors keys are restored on load.
+    assert config_io._read_config_sidecar(config_path)[1] == config_dict
+
+    # Not written if config dict can not be stored exactly.
+    config_dict = dict(config_dict, date=datetime.date(2026, 1, 1))
+    assert config_io.write_config_sidecar(config_path, all_required_data,
+        config_dict
+    ) is None
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import io
+import json
+from os.path import split, join
+import sys
+
+import pytest
+import yaml
+
+from olfactometer import config_io, olf
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def flow_steps_config_dicts(n=3):
+    with open(flow_steps_yaml, 'r') as f:
+        config_dict = config_io.safe_load_yaml(f)
+
+    config_dicts = []
+    for i in range(n):
+        config_dict = dict(config_dict)
+        config_dict['flow_change_lead_s'] = float(i)
+        config_dicts.append(config_dict)
+
+    return config_dicts
+
+
+def test_multi_document_yaml(tmp_path):
+    config_dicts = flow_steps_config_dicts()
+    config_path = str(tmp_path / 'stream.yaml')
+    with open(config_path, 'w') as f:
+        yaml.dump_all(config_dicts, f, Dumper=config_io.NoAliasDumper,
+            explicit_start=True
+        )
+
+    assert config_io.is_config_stream(config_path)
+    assert not config_io.is_config_stream(flow_steps_yaml)
+
+    loaded = list(olf.config_iter(config_path))
+    assert [x.config_dict for x in loaded] == config_dicts
+    assert all(x.path is None for x in loaded)
+    assert loaded[0].all_required_data == config_io.load(flow_steps_yaml)[0]
+
+
+def test_jsonl(tmp_path):
+    config_dicts = flow_steps_config_dicts()
+    config_path = str(tmp_path / 'stream.jsonl')
+    with open(config_path, 'w') as f:
+        for config_dict in config_dicts:
+            f.write(json.dumps(config_dict) + '\n')
+
+    # JSON turns the int keys of pins2odors to str.
+    expected = [json.loads(json.dumps(x)) for x in config_dicts]
+    assert [x.config_dict for x in olf.config_iter(config_path)] == expected
+
+
+def test_stdin(monkeypatch):
+    config_dicts = flow_steps_config_dicts()
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(
+        '\n'.join(json.dumps(x, indent=2) for x in config_dicts)
+    ))
+    with pytest.warns(UserWarning):
+        loaded = list(olf.config_iter(None))
+
+    assert [x.config_dict for x in loaded] == [json.loads(json.dumps(x))
+        for x in config_dicts
+    ]
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(yaml.dump(config_dicts[0])))
+    _, config_dict = config_io.load()
+    assert config_dict == config_dicts[0]
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(yaml.dump_all(config_dicts)))
+    with pytest.raises(ValueError):
+        config_io.load()
+
+
+def test_lazy_parsing(monkeypatch):
+    monkeypatch.setattr(config_io, 'json_stream_chunk_size', 16)
+
+    # Only invalid after the first document, which should still be yielded first.
+    stream = io.StringIO('{"a": 1,\n "b": [2, 3]}\n{"c": 4}\n{"d": ')
+    config_dicts = config_io.iter_config_dicts(stream)
+    assert next(config_dicts) == {'a': 1, 'b': [2, 3]}
+    assert stream.tell() < len(stream.getvalue())
+    assert next(config_dicts) == {'c': 4}
+
+    with pytest.raises(json.JSONDecodeError):
+        next(config_dicts)
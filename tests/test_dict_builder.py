@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+
+from google.protobuf import json_format
+import pytest
+
+from olfactometer import config_io, olf_pb2
+
+
+this_script_path = split(__file__)[0]
+examples_dir = join(this_script_path, '..', 'examples')
+
+def parse_dict(config_dict):
+    message = olf_pb2.AllRequiredData()
+    json_format.ParseDict(config_dict, message, ignore_unknown_fields=True)
+    return message
+
+
+def assert_equivalent(config_dict):
+    all_required_data, _ = config_io.load_dict(config_dict)
+    expected = parse_dict(config_dict)
+    assert all_required_data == expected
+    assert (all_required_data.SerializeToString(deterministic=True) ==
+        expected.SerializeToString(deterministic=True)
+    )
+    assert (all_required_data.settings.WhichOneof('control') ==
+        expected.settings.WhichOneof('control')
+    )
+
+
+@pytest.mark.parametrize('example', ['example.yaml', 'flow_steps.yaml'])
+def test_examples(example):
+    with open(join(examples_dir, example), 'r') as f:
+        config_dict = config_io.safe_load_yaml(f)
+
+    assert_equivalent(config_dict)
+
+
+def test_generated(make_generated_config):
+    assert_equivalent(make_generated_config(n_trials=1000))
+
+
+@pytest.mark.parametrize('config_dict', [
+    {},
+    {'settings': {}},
+    {'settings': {'timing': {}}},
+    {'settings': {'follow_hardware_timing': True}},
+    {'settings': {'follow_hardware_timing': False, 'balance_pin': 0}},
+    {'pin_sequence': {'pin_groups': []}},
+    {'pin_sequence': {'pin_groups': [{}, {'pins': []}, {'pins': [2, 3]}]}},
+    # Fall back to ParseDict for these.
+    {'settings': {'timing': {'pulseUs': 1000}, 'balancePin': 2}},
+    {'settings': {'timing': {'pulse_us': 1000.0}}},
+    {'settings': {'timing': {'pulse_us': '1000'}}},
+    {'pinSequence': {'pinGroups': [{'pins': [2]}]}},
+    {'pin_sequence': {'pin_groups': [{'pins': [2.0, 3]}]}},
+    {'settings': {'unknown': 1}, 'pin_sequence': {'pin_groups': [{'x': 1}]}},
+])
+def test_equivalence(config_dict):
+    assert_equivalent(config_dict)
+
+
+@pytest.mark.parametrize('config_dict', [
+    {'settings': {'follow_hardware_timing': True, 'timing': {'pulse_us': 1}}},
+    {'settings': {'timing': {'pulse_us': -1}}},
+    {'settings': {'no_ack': 1}},
+    {'pin_sequence': {'pin_groups': [{'pins': [2 ** 32]}]}},
+    {'pin_sequence': {'pin_groups': [{'pins': 2}]}},
+])
+def test_invalid(config_dict):
+    with pytest.raises(json_format.ParseError):
+        parse_dict(config_dict)
+
+    with pytest.raises(json_format.ParseError):
+        config_io.load_dict(config_dict)
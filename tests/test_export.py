@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import os
+from os.path import join, split
+import shutil
+
+import pytest
+
+from olfactometer import config_io, export, persist
+
+
+this_script_path = split(__file__)[0]
+example_config_dir = join(this_script_path, '..', 'examples')
+
+
+def test_trial_rows():
+    config_path = join(example_config_dir, 'flow_steps.yaml')
+    all_required_data, config_dict = config_io.load(config_path)
+
+    rows = export.trial_rows(config_path, all_required_data, config_dict)
+    assert len(rows) == len(all_required_data.pin_sequence.pin_groups)
+
+    for i, row in enumerate(rows):
+        assert set(row.keys()) == set(export.columns)
+        assert row['trial_index'] == i
+        assert row['pins'] == list(all_required_data.pin_sequence.pin_groups[i].pins)
+
+        pins2odors = config_dict['pins2odors']
+        assert row['odor_names'] == [
+            pins2odors[p]['name'] for p in row['pins'] if p in pins2odors
+        ]
+        assert row['flow_sccm'] == [
+            float(x['sccm']) for x in config_dict['flow_setpoints_sequence'][i]
+        ]
+
+    # pre 5s, pulse 1s, post 14s
+    assert rows[0]['expected_onset_s'] == pytest.approx(5.0)
+    assert rows[1]['expected_onset_s'] == pytest.approx(25.0)
+    assert rows[1]['expected_offset_s'] == pytest.approx(26.0)
+
+
+def test_export_csv_incremental(tmp_path):
+    config_dir = tmp_path / 'configs'
+    (config_dir / 'sub').mkdir(parents=True)
+    shutil.copy(join(example_config_dir, 'flow_steps.yaml'), config_dir / 'a.yaml')
+    shutil.copy(join(example_config_dir, 'flow_steps.yaml'),
+        config_dir / 'sub' / 'b.yaml'
+    )
+    # Not a run config. Should be skipped.
+    (config_dir / 'hardware.yaml').write_text('balance_pin: 3\n')
+
+    output_path = str(tmp_path / 'trials.csv')
+    n_rows = export.export([str(config_dir)], output_path, parallel=False)
+    persist.flush()
+
+    with open(output_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    assert len(rows) == n_rows == 2 * 6
+    assert tuple(rows[0].keys()) == export.columns
+    assert {r['file'] for r in rows} == {
+        str(config_dir / 'a.yaml'), str(config_dir / 'sub' / 'b.yaml')
+    }
+    assert type(json.loads(rows[0]['pins'])) is list
+
+    # Nothing changed, so nothing should be parsed again.
+    parsed = []
+    orig_file_rows = export._file_rows
+    def counting_file_rows(config_path):
+        parsed.append(config_path)
+        return orig_file_rows(config_path)
+
+    export._file_rows = counting_file_rows
+    try:
+        assert export.export([str(config_dir)], output_path, parallel=False) == n_rows
+        assert parsed == []
+
+        changed = config_dir / 'a.yaml'
+        changed.write_text(changed.read_text() + '\n# changed\n')
+        persist.flush()
+
+        assert export.export([str(config_dir)], output_path, parallel=False) == n_rows
+        assert parsed == [str(changed)]
+    finally:
+        export._file_rows = orig_file_rows
+
+
+def test_export_parallel_matches_serial(tmp_path):
+    for i in range(3):
+        shutil.copy(join(example_config_dir, 'flow_steps.yaml'),
+            tmp_path / f'{i}.yaml'
+        )
+
+    paths = export.find_config_files([str(tmp_path)])
+    assert (export.export_rows(paths, parallel=True) ==
+        export.export_rows(paths, parallel=False)
+    )
+
+
+def test_export_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    output_path = str(tmp_path / 'trials.parquet')
+    config_path = join(example_config_dir, 'flow_steps.yaml')
+    n_rows = export.export([config_path], output_path, parallel=False)
+
+    table = pq.read_table(output_path)
+    assert table.num_rows == n_rows
+    assert tuple(table.column_names) == export.columns
+
+
+def test_export_bad_suffix(tmp_path):
+    with pytest.raises(ValueError):
+        export.export([example_config_dir], str(tmp_path / 'trials.txt'))
+
+
+def test_export_skips_invalid_and_reads_streams(tmp_path):
+    _, config_dict = config_io.load(join(example_config_dir, 'flow_steps.yaml'))
+
+    # JSON configs have str pins2odors keys.
+    with open(tmp_path / 'a.json', 'w') as f:
+        json.dump(config_dict, f)
+
+    # Flow setpoints do not match trials. Skipped, rather than failing the export.
+    bad = dict(config_dict,
+        flow_setpoints_sequence=config_dict['flow_setpoints_sequence'][:2]
+    )
+    with open(tmp_path / 'bad.json', 'w') as f:
+        json.dump(bad, f)
+
+    with open(tmp_path / 'stream.jsonl', 'w') as f:
+        for _ in range(2):
+            f.write(json.dumps(config_dict) + '\n')
+
+    paths = export.find_config_files([str(tmp_path)])
+    rows = export.export_rows(paths, parallel=False)
+
+    assert {r['file'] for r in rows} == {str(tmp_path / 'a.json'),
+        str(tmp_path / 'stream.jsonl')
+    }
+    assert all(len(r['odor_names']) > 0 for r in rows)
+
+    stream_rows = [r for r in rows if r['file'].endswith('.jsonl')]
+    assert [r['document_index'] for r in stream_rows] == [0] * 6 + [1] * 6
+
+    # Only reading configs, so nothing written for them.
+    persist.flush()
+    assert not (tmp_path / 'data').exists()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+
+import pytest
+
+from olfactometer import load
+from olfactometer.flow import flow_setpoints_sequence_key
+from olfactometer.flow_schedule import make_schedule, FlowSetpointScheduler
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def test_make_schedule():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+
+    # pre=5s, pulse=1s, post=14s
+    schedule = make_schedule(all_required_data, flow_setpoints_sequence, lead_s=3.0)
+
+    # Trials 1-3 change setpoints, but 4 and 5 are the same as 3.
+    assert [x.trial_index for x in schedule] == [1, 2, 3]
+    assert [x.valve_onset_s for x in schedule] == [25.0, 45.0, 65.0]
+    assert [x.deadline_s for x in schedule] == [22.0, 42.0, 62.0]
+
+    # Each of these changes both flow controllers.
+    assert [x.changed_mfc_ids for x in schedule] == [('COM13', 'COM14')] * 3
+
+    # Default is the start of each trial.
+    schedule = make_schedule(all_required_data, flow_setpoints_sequence)
+    assert [x.deadline_s for x in schedule] == [20.0, 40.0, 60.0]
+
+    # Should not move before offset of previous valve pulse.
+    with pytest.warns(UserWarning):
+        schedule = make_schedule(all_required_data, flow_setpoints_sequence,
+            lead_s=100.0
+        )
+    assert [x.deadline_s for x in schedule] == [6.0, 26.0, 46.0]
+
+
+def test_scheduler():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+    schedule = make_schedule(all_required_data, flow_setpoints_sequence, lead_s=3.0)
+
+    issued = []
+    scheduler = FlowSetpointScheduler(schedule, issued.append)
+    scheduler.start(0.0)
+
+    assert scheduler.seconds_until_next(now_s=20.0) == 2.0
+
+    assert scheduler.poll(now_s=21.9) == 0
+    assert scheduler.poll(now_s=43.0) == 2
+    assert issued == flow_setpoints_sequence[1:3]
+
+    assert scheduler.poll(now_s=62.0) == 1
+    assert scheduler.done()
+    assert scheduler.seconds_until_next() is None
+
+    # Since start time was 0, all changes will be (very) late.
+    assert len(scheduler.missed_deadlines()) == 3
+
+
+def test_scheduler_async_completion():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+    schedule = make_schedule(all_required_data, flow_setpoints_sequence, lead_s=3.0)
+
+    # Like FlowWorker.set_flow_setpoints, returning an ID for each queued command.
+    tokens = iter(range(len(schedule)))
+    scheduler = FlowSetpointScheduler(schedule, lambda _: next(tokens))
+    scheduler.start(0.0)
+
+    assert scheduler.poll(now_s=62.0) == 3
+    assert scheduler.completed_records() == []
+
+    scheduler.record_completion(0, 22.01)
+    scheduler.record_completion(1, 43.0)
+    # Unknown tokens (e.g. results of other commands) are ignored.
+    scheduler.record_completion(100, 0.0)
+
+    completed = scheduler.completed_records()
+    assert [r['trial_index'] for r in completed] == [1, 2]
+    assert completed[0]['achieved_lead_s'] == pytest.approx(2.99)
+    assert [r['trial_index'] for r in scheduler.missed_deadlines()] == [2]
+
+    with pytest.warns(UserWarning):
+        scheduler.report()
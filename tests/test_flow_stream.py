@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from copy import deepcopy
+from os.path import split, join
+import warnings
+
+import pytest
+
+from olfactometer import load
+from olfactometer.flow import flow_setpoints_sequence_key
+from olfactometer.flow_schedule import make_schedule
+from olfactometer.flow_stream import (waveform_samples, make_stream, FlowStreamer,
+    validate_waveform
+)
+from olfactometer.validation import validate_config_dict
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+ramp = {'type': 'ramp', 'start_s': -1.0, 'duration_s': 2.0, 'to_sccm': 300}
+
+def test_waveform_samples():
+    samples = waveform_samples(ramp, 100, rate_hz=2.0)
+    assert samples == [(-1.0, 100.0), (-0.5, 150.0), (0.0, 200.0), (0.5, 250.0),
+        (1.0, 300.0)
+    ]
+
+    sine = {'type': 'sine', 'start_s': 0, 'duration_s': 1.0, 'amplitude_sccm': 50,
+        'period_s': 1.0
+    }
+    values = [v for _, v in waveform_samples(sine, 10, rate_hz=4.0)]
+    assert values == pytest.approx([10, 60, 10, 0, 10])
+
+    steps = {'type': 'steps', 'start_s': 0.5, 'steps': [[0, 20], [0.25, 40]]}
+    assert waveform_samples(steps, 10) == [(0.5, 20.0), (0.75, 40.0)]
+
+    with pytest.raises(ValueError):
+        validate_waveform({'type': 'ramp', 'start_s': 0, 'duration_s': 1.0})
+
+    with pytest.raises(ValueError, match='numeric'):
+        validate_waveform({'type': 'steps', 'start_s': 0, 'steps': [[0, '20']]})
+
+
+def test_waveform_validation():
+    _, config_dict = load(flow_steps_yaml)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+    # Trial 1 setpoints are 1800 and 200 sccm.
+    trial_setpoints = flow_setpoints_sequence[0]
+
+    # Moving flow from one controller to the other keeps the sum constant.
+    trial_setpoints[0]['waveform'] = {'type': 'steps', 'start_s': 0,
+        'steps': [[0, 1700]]
+    }
+    trial_setpoints[1]['waveform'] = {'type': 'steps', 'start_s': 0,
+        'steps': [[0, 300]]
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        validate_config_dict(config_dict)
+
+    trial_setpoints[1]['waveform']['steps'] = [[0, 300], [0.5, 400]]
+    with pytest.warns(UserWarning, match='during trial 1'):
+        validate_config_dict(config_dict)
+
+    del trial_setpoints[1]['waveform']
+    trial_setpoints[0]['waveform'] = {'type': 'sine', 'start_s': 0, 'duration_s': 1.0,
+        'amplitude_sccm': 2000, 'period_s': 1.0
+    }
+    with pytest.raises(ValueError, match='below 0'):
+        validate_config_dict(config_dict, warn=False)
+
+
+def _with_ramp_on_trial(config_dict, trial_index):
+    config_dict = deepcopy(config_dict)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+    flow_setpoints_sequence[trial_index][0]['waveform'] = dict(ramp)
+    # The ramp only changes one of the flows.
+    with pytest.warns(UserWarning, match='during trial'):
+        validate_config_dict(config_dict)
+    return config_dict
+
+
+def test_streamer_coalescing():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    # Trial 4 has same setpoints as trial 3 (so no change normally scheduled for 4).
+    config_dict = _with_ramp_on_trial(config_dict, 3)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+
+    # pre=5s, pulse=1s, post=14s, so valve onset of trial 3 is at 65s.
+    samples = make_stream(all_required_data, flow_setpoints_sequence, rate_hz=2.0)
+    assert [x.time_s for x in samples] == [64.0, 64.5, 65.0, 65.5, 66.0]
+    assert {x.mfc_id for x in samples} == {'COM13'}
+
+    # Flows need to be set back after a trial with a waveform.
+    schedule = make_schedule(all_required_data, flow_setpoints_sequence)
+    assert [x.trial_index for x in schedule] == [1, 2, 3, 4]
+
+    sent = []
+    def set_fn(setpoints):
+        sent.append(setpoints)
+        return len(sent) - 1
+
+    streamer = FlowStreamer(samples, set_fn)
+    streamer.start(0.0)
+    assert streamer.seconds_until_next(now_s=60.0) == 4.0
+
+    assert streamer.poll(now_s=64.0) == 1
+    assert sent == [[{'port': 'COM13', 'sccm': 1800.0}]]
+
+    # Still waiting on first command, so these two are coalesced into one.
+    assert streamer.poll(now_s=65.1) == 0
+    streamer.record_completion(0, 65.2)
+    assert streamer.poll(now_s=65.2) == 1
+    assert sent[-1] == [{'port': 'COM13', 'sccm': 1050.0}]
+    assert streamer.n_coalesced == 1
+
+    streamer.record_completion(1, 65.25)
+    assert streamer.poll(now_s=70.0) == 1
+    streamer.record_completion(2, 70.0)
+    assert streamer.done()
+
+    assert [r['lateness_s'] for r in streamer.completed_records()] == pytest.approx(
+        [1.2, 0.25, 4.0]
+    )
+    with pytest.warns(UserWarning):
+        streamer.report()
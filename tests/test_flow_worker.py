@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+import pickle
+import threading
+
+import pytest
+
+from olfactometer import load, flow
+from olfactometer.flow_worker import (FlowWorker, FlowWorkerError, _error_info,
+    _worker_error
+)
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def test_worker_verification():
+    _, config_dict = load(flow_steps_yaml)
+    config_dict[flow.mock_flow_controllers_key] = {'latency_s': 0.001,
+        'latency_jitter_s': 0.0
+    }
+    flow_setpoints_sequence = config_dict[flow.flow_setpoints_sequence_key]
+
+    worker = FlowWorker(config_dict)
+    worker.start()
+    try:
+        assert worker.mfc_ids == ['COM13', 'COM14']
+
+        ids = [worker.set_flow_setpoints(x, check_set_flows=True, silent=True)
+            for x in flow_setpoints_sequence[1:4]
+        ]
+        results = worker.wait()
+
+        # All three changes verified together, reading each controller once.
+        verifications = [r for r in results if r['kind'] == 'verify']
+        assert len(verifications) == 1
+        assert verifications[0]['command_ids'] == ids
+        assert verifications[0]['n_checked'] == 2
+        assert worker.events == []
+    finally:
+        worker.stop()
+
+
+class _StuckController:
+    def get(self):
+        return {'setpoint': 10.0}
+
+
+def test_check_setpoints():
+    mismatches = flow.check_setpoints({'A': _StuckController()}, {'A': 20.0})
+    assert mismatches == [{'mfc_id': 'A', 'commanded_sccm': 20.0,
+        'reported_sccm': 10.0, 'error': None
+    }]
+    assert flow.check_setpoints({'A': _StuckController()}, {'A': 10.0}) == []
+
+
+class _PortError(OSError):
+    """Like errors from hardware libraries that keep a reference to the port.
+    """
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.port_lock = threading.Lock()
+
+
+def test_worker_errors_sent_without_pickling_error():
+    try:
+        raise _PortError('no response from COM13')
+    except _PortError as err:
+        with pytest.raises(TypeError):
+            pickle.dumps(err)
+
+        error_info = pickle.loads(pickle.dumps(_error_info(err)))
+
+    err = _worker_error(error_info)
+    assert type(err) is FlowWorkerError
+    assert str(err).startswith('_PortError in flow controller worker: no response '
+        'from COM13'
+    )
+    assert 'test_worker_errors_sent_without_pickling_error' in str(err)
+
+    try:
+        raise flow.FlowHardwareNotFound('no flow controllers found')
+    except flow.FlowHardwareNotFound as err:
+        error_info = _error_info(err)
+
+    err = _worker_error(error_info)
+    assert type(err) is flow.FlowHardwareNotFound
+    assert str(err) == 'no flow controllers found'
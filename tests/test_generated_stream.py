@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+from os.path import split, join, exists
+
+import pytest
+
+from olfactometer import config_io, olf
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def test_configs_written_as_generated(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    _, config_dict = config_io.load(flow_steps_yaml)
+
+    n_generated = []
+    def generate_config_dicts():
+        for _ in range(3):
+            n_generated.append(None)
+            yield config_dict
+
+    paths = config_io.iter_write_timestamped_configs(generate_config_dicts(),
+        verbose=False
+    )
+    loaded = olf.config_iter(paths, _skip_config_preprocess_check=True)
+
+    first = next(loaded)
+    assert len(n_generated) == 1
+    assert exists(first.path)
+    assert not exists(first.path.replace('_0.yaml', '_1.yaml'))
+    assert first.config_dict == config_dict
+
+    second = next(loaded)
+    assert len(n_generated) == 2
+    # Configs already run are not kept in memory.
+    assert os.path.abspath(first.path) not in config_io._path2compiled
+
+    rest = [second] + list(loaded)
+    assert len(n_generated) == 3
+    assert [split(x.path)[1][-7:] for x in rest] == ['_1.yaml', '_2.yaml']
+    assert not any(os.path.abspath(x.path) in config_io._path2compiled for x in rest)
+
+    # Same directory can be run again later, as with a list of generated configs.
+    config_dir = split(first.path)[0]
+    assert [x.path for x in olf.config_iter(config_dir,
+        _skip_config_preprocess_check=True)] == [first.path] + [x.path for x in rest]
+
+
+def test_invalid_generated_config_fails_when_reached(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    _, config_dict = config_io.load(flow_steps_yaml)
+    # Fewer flow setpoints than trials.
+    invalid_config_dict = dict(config_dict,
+        flow_setpoints_sequence=config_dict['flow_setpoints_sequence'][:2]
+    )
+
+    paths = config_io.iter_write_timestamped_configs(
+        iter([config_dict, invalid_config_dict]), verbose=False
+    )
+    loaded = olf.config_iter(paths, _skip_config_preprocess_check=True)
+    assert next(loaded).config_dict == config_dict
+    with pytest.raises(ValueError):
+        next(loaded)
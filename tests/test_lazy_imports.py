@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+from os.path import join, split
+import re
+import subprocess
+import sys
+
+import olfactometer
+
+
+this_script_path = split(__file__)[0]
+
+# Only needed to actually run configs on / communicate with hardware.
+hardware_modules = ('serial', 'alicat', 'readchar', 'pyperclip',
+    'olfactometer.flow_worker'
+)
+
+
+def imported_modules(code):
+    """Returns names of modules imported after running code in a fresh interpreter.
+    """
+    p = subprocess.run([sys.executable, '-c',
+        f'import sys\n{code}\nprint("\\n".join(sys.modules))'
+        ], check=True, stdout=subprocess.PIPE, universal_newlines=True
+    )
+    return set(p.stdout.split())
+
+
+def test_entry_points_resolve():
+    with open(join(this_script_path, '..', 'setup.py'), 'r') as f:
+        setup_py = f.read()
+
+    names = re.findall(r"^\s*'olf[\w-]*=olfactometer:(\w+)'", setup_py, re.MULTILINE)
+    assert len(names) > 0
+    for name in names:
+        assert callable(getattr(olfactometer, name))
+        assert name in dir(olfactometer)
+
+
+def test_package_import_is_lazy():
+    modules = imported_modules('import olfactometer')
+    assert 'olfactometer.config_io' not in modules
+    assert 'google.protobuf' not in modules
+
+    # What console_scripts do before calling the function.
+    modules = imported_modules('import olfactometer\nolfactometer.print_config_time_cli')
+    assert 'olfactometer.olf' not in modules
+
+
+def test_reading_configs_does_not_import_hardware_modules():
+    modules = imported_modules(
+        'from olfactometer import olf, config_io\n'
+        f'config_io.load({join(this_script_path, "..", "examples", "flow_steps.yaml")!r})'
+    )
+    assert 'olfactometer.olf' in modules
+    assert not any(m in modules for m in hardware_modules)
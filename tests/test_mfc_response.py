@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import math
+
+import pytest
+
+from olfactometer.flow import (fit_step_response, save_response_profiles,
+    settling_time_s
+)
+
+
+def first_order_step(from_sccm, to_sccm, tau_s, dt_s=0.05, duration_s=5.0):
+    times_s = [i * dt_s for i in range(int(duration_s / dt_s) + 1)]
+    flows_sccm = [to_sccm + (from_sccm - to_sccm) * math.exp(-t / tau_s)
+        for t in times_s
+    ]
+    return times_s, flows_sccm
+
+
+def test_fit_step_response():
+    tau_s = 0.4
+    times_s, flows_sccm = first_order_step(0.0, 200.0, tau_s)
+    fit = fit_step_response(times_s, flows_sccm, 0.0, 200.0)
+
+    # 10-90% rise time of a first order system is tau * ln(9)
+    assert fit['rise_time_s'] == pytest.approx(tau_s * math.log(9), abs=0.06)
+    # Within 2% at ~tau * ln(50)
+    assert fit['settling_time_s'] == pytest.approx(tau_s * math.log(50), abs=0.06)
+    assert fit['overshoot_frac'] == pytest.approx(0.0, abs=1e-3)
+
+    # Steps down should work the same way.
+    times_s, flows_sccm = first_order_step(200.0, 0.0, tau_s)
+    down_fit = fit_step_response(times_s, flows_sccm, 200.0, 0.0)
+    assert down_fit['rise_time_s'] == pytest.approx(fit['rise_time_s'])
+
+    flows_sccm = [f + (20.0 if 3.0 < t < 3.5 else 0.0)
+        for t, f in zip(*first_order_step(0.0, 200.0, tau_s))
+    ]
+    overshoot_fit = fit_step_response(times_s, flows_sccm, 0.0, 200.0)
+    assert overshoot_fit['overshoot_frac'] == pytest.approx(0.1, abs=0.01)
+    assert overshoot_fit['settling_time_s'] >= 3.45
+
+
+def test_save_response_profiles(user_data_dir):
+    save_response_profiles({'A': {'settling_time_s': 1.5}})
+    save_response_profiles({'B': {'settling_time_s': 0.5}})
+
+    assert settling_time_s(['A', 'B']) == 1.5
+    assert settling_time_s(['A', 'C'], default=3.0) == 3.0
+    # Written via a temporary file, renamed over the destination.
+    assert [x.name for x in user_data_dir.iterdir()] == ['mfc_response_profiles.yaml']
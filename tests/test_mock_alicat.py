@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+import time
+
+import pytest
+
+from olfactometer import load, flow, mock_alicat, persist
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+fast_params = {'latency_s': 0.001, 'latency_jitter_s': 0.0, 'time_constant_s': 0.05,
+    'seed': 0
+}
+
+@pytest.fixture
+def mock_flow(monkeypatch):
+    # So each test starts from real backend, and nothing is restored to it after.
+    for name in ('FlowController', '_comports', '_mock_params', '_address2port',
+        '_whitelist_ports', '_mfc_id2last_flow_rate'):
+        monkeypatch.setattr(flow, name, getattr(flow, name))
+
+    monkeypatch.setattr(flow, '_address2port', dict())
+    monkeypatch.setattr(flow, '_address2port_identity', dict())
+    monkeypatch.setattr(flow, '_mfc_id2last_flow_rate', dict())
+    # So atexit restoring of setpoints is not registered for simulated controllers.
+    monkeypatch.setattr(flow, '_called_set_flow_setpoints', True)
+    return flow
+
+
+def test_first_order_dynamics(mock_flow):
+    mock_flow.use_mock_flow_controllers(fast_params)
+
+    c = mock_flow.FlowController(port='/dev/mock_mfc0', address='A')
+    assert c.get()['mass_flow'] == 0.0
+
+    c.set_flow_rate(100.0)
+    time.sleep(0.05)
+    data = c.get()
+    assert data['setpoint'] == 100.0
+    # ~1 time constant later, should be ~63% of the way there.
+    assert 40 < data['mass_flow'] < 90
+
+    time.sleep(0.5)
+    assert c.get()['mass_flow'] == pytest.approx(100.0, abs=0.1)
+
+    # Nothing at this address on this port.
+    assert not mock_flow.FlowController.is_connected('/dev/mock_mfc0', address='B',
+        timeout=0.001
+    )
+
+
+def test_open_and_set(mock_flow):
+    all_required_data, config_dict = load(flow_steps_yaml)
+    config_dict[mock_flow.mock_flow_controllers_key] = fast_params
+
+    mfc_id2flow_controller, _ = mock_flow.open_alicat_controllers(config_dict)
+    assert set(mfc_id2flow_controller) == {'COM13', 'COM14'}
+
+    flow_setpoints_sequence = config_dict[mock_flow.flow_setpoints_sequence_key]
+    mock_flow.set_flow_setpoints(mfc_id2flow_controller, flow_setpoints_sequence[1],
+        check_set_flows=True
+    )
+    for x in flow_setpoints_sequence[1]:
+        assert mfc_id2flow_controller[x['port']].get()['setpoint'] == x['sccm']
+
+    mock_flow.restore_initial_setpoints(mfc_id2flow_controller)
+
+
+def test_mock_envvar(mock_flow, monkeypatch):
+    _, config_dict = load(flow_steps_yaml)
+    monkeypatch.setenv(mock_flow.MOCK_MFCS_ENVVAR, '1')
+
+    # Only takes effect when flow controllers are opened (not on import).
+    assert mock_flow._mock_params is None
+    mfc_id2flow_controller, _ = mock_flow.open_alicat_controllers(config_dict)
+    assert mock_flow._mock_params == dict()
+    assert set(mfc_id2flow_controller) == {'COM13', 'COM14'}
+    mock_flow.restore_initial_setpoints(mfc_id2flow_controller)
+
+
+def test_set_only_changed(mock_flow):
+    all_required_data, config_dict = load(flow_steps_yaml)
+    config_dict[mock_flow.mock_flow_controllers_key] = fast_params
+
+    mfc_id2flow_controller, _ = mock_flow.open_alicat_controllers(config_dict)
+    flow_setpoints_sequence = config_dict[mock_flow.flow_setpoints_sequence_key]
+    mock_flow.set_flow_setpoints(mfc_id2flow_controller, flow_setpoints_sequence[0])
+
+    # Only COM13 is sent its setpoint, even though COM14 also differs.
+    mock_flow.set_flow_setpoints(mfc_id2flow_controller, flow_setpoints_sequence[1],
+        changed_mfc_ids=('COM13',)
+    )
+    assert mfc_id2flow_controller['COM13'].get()['setpoint'] == 1980
+    assert mfc_id2flow_controller['COM14'].get()['setpoint'] == 200
+
+    mock_flow.restore_initial_setpoints(mfc_id2flow_controller)
+
+
+def test_address_discovery(mock_flow):
+    # Two devices on one bus, and one on another.
+    mock_flow.use_mock_flow_controllers(dict(fast_params,
+        ports={'/dev/mock_bus0': ['A', 'B'], '/dev/mock_bus1': ['C']}
+    ))
+    assert mock_flow.find_port_for_controller_address('C',
+        safe_usb_ids_to_check_for_mfcs={mock_alicat.mock_usb_ids}
+    ) == '/dev/mock_bus1'
+
+    with pytest.raises(mock_flow.FlowHardwareNotFound):
+        mock_flow.find_port_for_controller_address('D',
+            safe_usb_ids_to_check_for_mfcs=set()
+        )
+
+
+def test_errors(mock_flow):
+    mock_flow.use_mock_flow_controllers(dict(fast_params, error_rate=1.0))
+    c = mock_flow.mock_alicat.MockFlowController('/dev/mock_mfc0', 'A')
+
+    with pytest.raises(OSError):
+        mock_flow.set_flow_setpoints({'A': c}, [{'address': 'A', 'sccm': 10}],
+            silent=True
+        )
+
+    with pytest.raises(ValueError):
+        mock_alicat.configure({'not_a_param': 1})
+
+
+def _probed_ports():
+    return {p for p, b in mock_alicat._port2bus.items() if b.n_transactions > 0}
+
+
+def test_port_cache(mock_flow, tmp_path):
+    config_dict = {mock_flow.flow_setpoints_sequence_key: [
+        [{'address': 'C', 'sccm': 10}]
+    ]}
+    mock_flow.use_mock_flow_controllers(dict(fast_params,
+        ports={'/dev/ttyUSB0': ['A'], '/dev/ttyUSB1': ['B'], '/dev/ttyUSB2': ['C']}
+    ))
+    mock_flow.open_alicat_controllers(config_dict)
+
+    cache_fname = mock_flow._last_address2port_cache_fname()
+    # Written in the background.
+    persist.flush()
+    assert cache_fname.exists()
+
+    # As if adapters were renumbered after a reboot.
+    mock_flow.use_mock_flow_controllers(dict(fast_params,
+        ports={'/dev/ttyUSB3': ['A'], '/dev/ttyUSB4': ['B'], '/dev/ttyUSB5': ['C']}
+    ))
+    mfc_id2flow_controller, _ = mock_flow.open_alicat_controllers(config_dict)
+    assert mfc_id2flow_controller['C'].port == '/dev/ttyUSB5'
+    # Only the port with the cached serial number should have been probed.
+    assert _probed_ports() == {'/dev/ttyUSB5'}
+
+    # Device path alone (as in old caches) no longer matches anything, so all ports
+    # need to be checked.
+    mock_flow.use_mock_flow_controllers(dict(fast_params, ports={
+        '/dev/ttyUSB6': ['A'], '/dev/ttyUSB7': ['B'], '/dev/ttyUSB8': ['C']
+    }))
+    assert mock_flow.find_port_for_controller_address('C',
+        safe_usb_ids_to_check_for_mfcs={mock_alicat.mock_usb_ids},
+        _last_port='/dev/ttyUSB5'
+    ) == '/dev/ttyUSB8'
+    assert len(_probed_ports()) == 3
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import threading
+
+import pytest
+
+from olfactometer import persist
+
+
+def test_write_behind(tmp_path):
+    worker = persist.PersistenceWorker()
+
+    release = threading.Event()
+    worker.submit(None, release.wait)
+
+    path = tmp_path / 'a.txt'
+    worker.write(path, 'first')
+    worker.write(path, 'second')
+    # Still blocked behind the first job.
+    assert not path.exists()
+
+    release.set()
+    worker.wait_for(path)
+    assert path.read_text() == 'second'
+    # No temporary files left behind.
+    assert [x.name for x in tmp_path.iterdir()] == ['a.txt']
+
+
+def test_errors_reported(tmp_path):
+    worker = persist.PersistenceWorker()
+
+    path = tmp_path / 'missing_dir' / 'a.txt'
+    worker.write(path, 'x')
+    with pytest.raises(persist.PersistenceError):
+        worker.wait_for(path)
+
+    worker.write(path, 'x')
+    with pytest.raises(persist.PersistenceError):
+        worker.flush()
+
+    # Already reported.
+    worker.flush()
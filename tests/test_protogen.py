@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+from os.path import join, split
+import shutil
+import subprocess
+
+import pytest
+
+from olfactometer import THIS_PACKAGE_DIR, _protogen
+
+
+def test_up_to_date_after_import():
+    # Importing olfactometer (done above) should have generated it if needed.
+    assert not _protogen.is_stale(THIS_PACKAGE_DIR)
+
+
+def test_only_regenerates_when_proto_changes(tmp_path, monkeypatch):
+    if shutil.which('protoc') is None:
+        pytest.importorskip('grpc_tools')
+
+    shutil.copy(join(THIS_PACKAGE_DIR, _protogen.proto_fname), tmp_path)
+    package_dir = str(tmp_path)
+
+    assert _protogen.is_stale(package_dir)
+    assert _protogen.ensure_generated(package_dir)
+    assert not _protogen.is_stale(package_dir)
+
+    orig_run = subprocess.run
+    n_protoc_runs = []
+    def counting_run(*args, **kwargs):
+        n_protoc_runs.append(args)
+        return orig_run(*args, **kwargs)
+
+    monkeypatch.setattr(_protogen.subprocess, 'run', counting_run)
+
+    assert not _protogen.ensure_generated(package_dir)
+    assert len(n_protoc_runs) == 0
+
+    with open(join(package_dir, _protogen.proto_fname), 'a') as f:
+        f.write('\nmessage Unused {\n  uint32 x = 1;\n}\n')
+
+    assert _protogen.is_stale(package_dir)
+    assert _protogen.ensure_generated(package_dir)
+    assert len(n_protoc_runs) == 1
+    assert not _protogen.is_stale(package_dir)
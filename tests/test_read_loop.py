@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+import time
+import warnings
+
+from olfactometer import load
+from olfactometer.flow import flow_setpoints_sequence_key
+from olfactometer.flow_stream import make_stream, FlowStreamer
+from olfactometer.olf import SerialLineReader, _read_until_finished
+from olfactometer.run_plan import make_run_plan
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+class FakeSerial:
+    """Returns each of `chunks` from one `readline`, as pyserial does when its timeout
+    expires partway through a line.
+    """
+    def __init__(self, chunks, chunk_interval_s=0.01):
+        self.chunks = list(chunks)
+        self.chunk_interval_s = chunk_interval_s
+
+    def readline(self):
+        time.sleep(self.chunk_interval_s)
+        if len(self.chunks) == 0:
+            # Rather than hanging the test, if the caller keeps waiting for a line.
+            raise RuntimeError('no more output')
+
+        return self.chunks.pop(0)
+
+
+def read_until_finished(chunks, plan, start_time_s=None, **kwargs):
+    if start_time_s is None:
+        start_time_s = time.time()
+
+    line_reader = SerialLineReader(FakeSerial(chunks))
+    line_reader.start()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            return _read_until_finished(line_reader, plan, start_time_s, **kwargs)
+    finally:
+        line_reader.stop()
+
+
+def test_line_reader_joins_partial_lines():
+    line_reader = SerialLineReader(FakeSerial([b'Fin', b'', b'ished\r\n']))
+    line_reader.start()
+    try:
+        assert line_reader.readline(0.0) == b''
+        assert line_reader.readline(1.0) == b'Finished\r\n'
+    finally:
+        line_reader.stop()
+
+
+def test_finished_split_across_reads():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=dict())
+
+    _, seen_trial_indices, _ = read_until_finished([b'trial: 1, pin(s): 3',
+        b'8\r\n', b'Fini', b'shed\r\n'], plan, print_lines=False
+    )
+    assert seen_trial_indices == {0}
+
+
+class FakeWorker:
+    """Completes each command by the next `poll`, like a fast `FlowWorker`.
+    """
+    def __init__(self):
+        self.sent = []
+        self._pending = []
+
+    def set_flow_setpoints(self, setpoints):
+        self.sent.append(setpoints)
+        self._pending.append(len(self.sent) - 1)
+        return self._pending[-1]
+
+    def poll(self):
+        results = [{'id': x, 'completed_s': time.time()} for x in self._pending]
+        self._pending = []
+        return results
+
+
+def test_streamed_waveform_with_chunked_output():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    flow_setpoints_sequence = config_dict[flow_setpoints_sequence_key]
+    # Valve onset of trial 1 is at 5s, so this is sampled from 4s to 6s.
+    flow_setpoints_sequence[0][0]['waveform'] = {'type': 'ramp', 'start_s': -1.0,
+        'duration_s': 2.0, 'to_sccm': 300
+    }
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=dict())
+
+    worker = FakeWorker()
+    streamer = FlowStreamer(make_stream(all_required_data, flow_setpoints_sequence),
+        worker.set_flow_setpoints
+    )
+    # So the ramp is in progress, and the streamer only ever lets us wait ~10ms for
+    # each line.
+    start_time_s = time.time() - 4.0
+    streamer.start(start_time_s)
+
+    line = b'trial: 1, pin(s): 38\r\n'
+    chunks = [line[i:(i + 3)] for i in range(0, len(line), 3)] + [b'Fini', b'shed\r\n']
+    _, seen_trial_indices, _ = read_until_finished(chunks, plan,
+        start_time_s=start_time_s, flow_senders=[streamer], worker=worker,
+        print_lines=False
+    )
+    assert seen_trial_indices == {0}
+    assert len(worker.sent) > 0
+    assert all(x[0]['port'] == 'COM13' for x in worker.sent)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+from os.path import split, join
+
+from olfactometer import load, util
+from olfactometer.run_plan import make_run_plan, finished_line
+
+
+this_script_path = split(__file__)[0]
+flow_steps_yaml = join(this_script_path, '..', 'examples', 'flow_steps.yaml')
+
+def test_plan():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=dict())
+
+    assert plan.n_trials == 6
+    assert plan.trial_s == 20.0
+    assert plan.duration_s() == util.time_config_will_take_s(all_required_data)
+    assert plan.onset_s.tolist() == [5.0, 25.0, 45.0, 65.0, 85.0, 105.0]
+
+    pins2odors = config_dict['pins2odors']
+    for trial_index, trial_str in enumerate(plan.trial_strs):
+        pins = util.get_trial_pins(all_required_data.pin_sequence, trial_index)
+        assert trial_str == (f'trial: {trial_index + 1}/6, odor(s): ' +
+            util.format_mixture_pins(pins2odors, pins, show_abbrevs=False)
+        )
+
+    # Trials 5 and 6 have the same setpoints as trial 4.
+    assert [x.trial_index for x in plan.flow_changes] == [1, 2, 3]
+    # flow_change_lead_s: 3.0 in config
+    assert [x.deadline_s for x in plan.flow_changes] == [22.0, 42.0, 62.0]
+
+    assert [x.line for x in plan.firmware_events[:2]] == ['trial: 1, pin(s): 38',
+        'trial: 2, pin(s): 38'
+    ]
+    assert plan.firmware_events[-1].line == finished_line
+    assert [x.expected_s for x in plan.firmware_events] == [0.0, 20.0, 40.0, 60.0,
+        80.0, 100.0, 120.0
+    ]
+
+
+
+def test_plan_lead_from_response_profiles():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    del config_dict['flow_change_lead_s']
+
+    # No profiles: changes at the start of each trial.
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=dict())
+    assert [x.deadline_s for x in plan.flow_changes] == [20.0, 40.0, 60.0]
+
+    # Slowest MFC to settle determines the lead, when longer than pre_pulse (5s).
+    profiles = {'COM13': {'settling_time_s': 7.0}, 'COM14': {'settling_time_s': 2.0}}
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=profiles)
+    assert [x.deadline_s for x in plan.flow_changes] == [18.0, 38.0, 58.0]
+
+
+def test_plan_trial_index():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=dict())
+
+    assert plan.trial_index(0.0) == 0
+    assert plan.trial_index(19.99) == 0
+    assert plan.trial_index(20.0) == 1
+    assert plan.trial_index(119.9) == 5
+    assert plan.trial_index(120.0) is None
+
+
+def test_plan_following_hardware_timing():
+    all_required_data, config_dict = load(flow_steps_yaml)
+    del config_dict['flow_setpoints_sequence']
+    del config_dict['pins2odors']
+    all_required_data.settings.follow_hardware_timing = True
+
+    plan = make_run_plan(all_required_data, config_dict, response_profiles=dict())
+    assert plan.trial_s is None and plan.onset_s is None
+    assert plan.trial_strs is None
+    assert plan.flow_changes is None
+    assert all(x.expected_s is None for x in plan.firmware_events)
+    assert len(plan.firmware_events) == 7
+
+
+def test_plan_reuses_validated_flows(monkeypatch):
+    from olfactometer import config_io
+    from olfactometer.trial_table import FlowSetpoints
+
+    _, config_dict = load(flow_steps_yaml)
+
+    from_sequence = FlowSetpoints.from_sequence
+    calls = []
+    def counting_from_sequence(cls, flow_setpoints_sequence):
+        calls.append(flow_setpoints_sequence)
+        return from_sequence(flow_setpoints_sequence)
+
+    monkeypatch.setattr(FlowSetpoints, 'from_sequence',
+        classmethod(counting_from_sequence)
+    )
+
+    all_required_data, config_dict, _, flows = config_io.load_compiled(config_dict)
+    assert len(calls) == 1
+    assert flows.mfc_ids == ('COM13', 'COM14')
+
+    plan = make_run_plan(all_required_data, config_dict, flows=flows,
+        response_profiles=dict()
+    )
+    assert plan.trial_table.flows is flows
+    assert len(calls) == 1
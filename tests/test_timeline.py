@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from olfactometer import olf_pb2, timeline, util
+
+
+def make_settings(pre_pulse_us, pulse_us, post_pulse_us, pulse_train_on_us=0,
+    pulse_train_off_us=0):
+
+    settings = olf_pb2.Settings()
+    settings.timing.pre_pulse_us = pre_pulse_us
+    settings.timing.pulse_us = pulse_us
+    settings.timing.post_pulse_us = post_pulse_us
+    settings.timing.pulse_train_on_us = pulse_train_on_us
+    settings.timing.pulse_train_off_us = pulse_train_off_us
+    return settings
+
+
+def step_firmware(timing, n_trials, since_boot_us=0,
+    resolution_us=timeline.micros_resolution_us):
+    """Returns events of `run_sequence`, stepping a clock 1us at a time.
+
+    A direct translation of the firmware, to check `timeline` against.
+    """
+    now_us = since_boot_us
+    start_us = now_us
+    # Set when the Arduino boots.
+    last_change_us = 0
+    events = []
+
+    def micros():
+        return now_us // resolution_us * resolution_us
+
+    def busy_wait_us(interval_us):
+        nonlocal now_us, last_change_us
+        while micros() - last_change_us < interval_us:
+            now_us += 1
+        last_change_us = micros()
+
+    def event(trial_index, kind):
+        events.append((now_us - start_us, trial_index, kind))
+
+    for i in range(n_trials):
+        event(i, 'trial')
+        busy_wait_us(timing.pre_pulse_us)
+        if timing.pulse_train_on_us > 0 and timing.pulse_train_off_us > 0:
+            pulse_start_us = micros()
+            while micros() - pulse_start_us < timing.pulse_us:
+                event(i, 'valve_on')
+                busy_wait_us(timing.pulse_train_on_us)
+                event(i, 'valve_off')
+                busy_wait_us(timing.pulse_train_off_us)
+        else:
+            event(i, 'valve_on')
+            busy_wait_us(timing.pulse_us)
+            event(i, 'valve_off')
+        busy_wait_us(timing.post_pulse_us)
+
+    event(None, 'finished')
+    return events
+
+
+timing_cases = [
+    (1000, 500, 2000),
+    # Not multiples of micros() resolution, so every wait is rounded up.
+    (1001, 503, 2002),
+    # Pulse trains, overrunning pulse_us (3 cycles of 250us for 600us).
+    (1000, 600, 1000, 100, 150),
+    (998, 1003, 1001, 97, 153),
+    (1000, 0, 1000, 100, 100),
+    (0, 0, 0),
+]
+
+@pytest.mark.parametrize('args', timing_cases)
+def test_matches_firmware(args):
+    settings = make_settings(*args)
+    simulated = timeline.simulate(settings, n_trials=3)
+    assert simulated.events() == step_firmware(settings.timing, n_trials=3)
+
+
+@pytest.mark.parametrize('since_boot_us', [3, 500, 1000, 5000])
+def test_first_pre_pulse_shortened(since_boot_us):
+    settings = make_settings(1000, 600, 1000, 100, 150)
+    simulated = timeline.simulate(settings, n_trials=3, since_boot_us=since_boot_us)
+    assert simulated.events() == step_firmware(settings.timing, n_trials=3,
+        since_boot_us=since_boot_us
+    )
+
+
+def test_pulse_train_overrun():
+    all_required_data = olf_pb2.AllRequiredData()
+    all_required_data.settings.CopyFrom(make_settings(1000, 500, 1000, 100, 100))
+    # Not 2.5ms, as the train runs 3 whole cycles of 200us.
+    assert util.seconds_per_trial(all_required_data) == pytest.approx(2.6e-3)
+
+    trial = timeline.trial_timing(all_required_data.settings.timing)
+    assert trial.n_pulses == 3 and trial.pulse_period_us == 200
+    # Last pulse offset is 100us after last onset, at 400us.
+    assert trial.offset_us - trial.onset_us == 500
+
+
+def test_sequence_durations_vectorized():
+    all_settings = [make_settings(*args) for args in timing_cases]
+    n_trials = list(range(1, len(all_settings) + 1))
+
+    durations_us = timeline.sequence_durations_us(
+        [x.timing for x in all_settings], n_trials
+    )
+    assert durations_us.tolist() == [timeline.simulate(s, n).finish_us
+        for s, n in zip(all_settings, n_trials)
+    ]
+
+
+def test_follow_hardware_timing():
+    settings = olf_pb2.Settings()
+    settings.follow_hardware_timing = True
+    assert timeline.simulate(settings, n_trials=3) is None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+from copy import deepcopy
+from os.path import join, split
+
+import numpy as np
+import pytest
+
+from olfactometer import config_io, olf_pb2, validation
+from olfactometer.flow_schedule import trial_valve_times_s
+from olfactometer.generators import common
+from olfactometer.trial_table import TrialTable, FlowSetpoints
+
+
+this_script_path = split(__file__)[0]
+example_config_dir = join(this_script_path, '..', 'examples')
+
+
+def test_config_dict_round_trip(make_generated_config):
+    config_dict = make_generated_config(n_trials=200)
+    # One setpoint with extra keys, which should also be preserved.
+    config_dict['flow_setpoints_sequence'][3] = [
+        {'address': 'A', 'sccm': 200.0, 'waveform': {'type': 'ramp', 'to_sccm': 0}},
+        {'address': 'B', 'sccm': 1800.0},
+    ]
+    orig = deepcopy(config_dict)
+
+    table = TrialTable.from_config_dict(config_dict)
+    assert len(table) == 200
+    assert table.mfc_ids == ('A', 'B')
+    assert table.sccm.shape == (200, 2)
+
+    assert table.to_config_dict(config_dict) == config_dict
+    # Input should not be modified.
+    assert config_dict == orig
+
+
+def test_pins_and_masks():
+    pin_lists = [[5, 3], [7], [3, 9, 11]]
+    table = TrialTable.from_pin_lists(pin_lists)
+
+    # Order within trials is kept.
+    assert table.pin_lists() == pin_lists
+    assert [table.trial_pins(i) for i in range(3)] == pin_lists
+    assert table.pin_masks.tolist() == [(1 << 5) | (1 << 3), 1 << 7,
+        (1 << 3) | (1 << 9) | (1 << 11)
+    ]
+    assert table.trials_using_pin(3).tolist() == [0, 2]
+    assert table.trials_using_pin(4).tolist() == []
+
+    pin_sequence = olf_pb2.PinSequence()
+    table.fill_pin_sequence(pin_sequence)
+    assert [list(g.pins) for g in pin_sequence.pin_groups] == pin_lists
+
+    with pytest.raises(ValueError):
+        TrialTable.from_pin_lists([[2], [64]])
+
+
+def test_from_all_required_data():
+    all_required_data, config_dict = config_io.load(
+        join(example_config_dir, 'flow_steps.yaml')
+    )
+    table = TrialTable.from_all_required_data(all_required_data, config_dict)
+
+    assert table.pin_lists() == [list(g.pins)
+        for g in all_required_data.pin_sequence.pin_groups
+    ]
+    assert table.flow_setpoints_sequence() == config_dict['flow_setpoints_sequence']
+
+    for i in range(len(table)):
+        onset_s, offset_s = trial_valve_times_s(all_required_data, i)
+        assert table.onset_s[i] == pytest.approx(onset_s)
+        assert table.offset_s[i] == pytest.approx(offset_s)
+
+    # 6 trials, of 5 + 1 + 14s
+    assert table.duration_s() == pytest.approx(120.0)
+
+    all_required_data.settings.follow_hardware_timing = True
+    table = TrialTable.from_all_required_data(all_required_data)
+    assert table.onset_s is None and table.duration_s() is None
+    assert table.sccm is None and table.flow_setpoints_sequence() is None
+
+
+def test_set_flows_broadcasts():
+    table = TrialTable.from_pin_lists([[2], [3], [4]])
+    table.set_flows('port', ['COM1', 'COM2'], [1800.0, 200.0])
+    assert table.sccm.shape == (3, 2)
+    assert table.trial_setpoints(2) == [{'port': 'COM1', 'sccm': 1800.0},
+        {'port': 'COM2', 'sccm': 200.0}
+    ]
+
+    with pytest.raises(ValueError):
+        table.set_flows('name', ['COM1'], [1.0])
+
+
+def test_mismatched_flow_controllers(make_generated_config):
+    config_dict = make_generated_config(n_trials=3)
+    config_dict['flow_setpoints_sequence'][1] = [{'address': 'A', 'sccm': 1.0},
+        {'address': 'C', 'sccm': 1.0}
+    ]
+    with pytest.raises(ValueError, match='trial 2'):
+        TrialTable.from_config_dict(config_dict)
+
+
+def test_add_pinlist_accepts_table():
+    pin_lists = [[2, 3], [4]]
+    from_lists = dict()
+    common.add_pinlist(pin_lists, from_lists)
+
+    from_table = dict()
+    common.add_pinlist(TrialTable.from_pin_lists(pin_lists), from_table)
+    assert from_table == from_lists
+
+
+def test_flow_setpoints_changes():
+    flows = FlowSetpoints.from_sequence([
+        [{'port': 'COM1', 'sccm': 1800}, {'port': 'COM2', 'sccm': 200}],
+        # Listed in a different order, but the same setpoints.
+        [{'port': 'COM2', 'sccm': 200}, {'port': 'COM1', 'sccm': 1800}],
+        [{'port': 'COM1', 'sccm': 1980}, {'port': 'COM2', 'sccm': 200}],
+        [{'port': 'COM1', 'sccm': 1800}, {'port': 'COM2', 'sccm': 20}],
+    ])
+    assert flows.mfc_ids == ('COM1', 'COM2')
+    assert flows.sccm.tolist() == [[1800, 200], [1800, 200], [1980, 200], [1800, 20]]
+    assert flows.changed_mfc_ids == [('COM1', 'COM2'), (), ('COM1',),
+        ('COM1', 'COM2')
+    ]
+    assert not flows.are_constant()
+    assert flows.mfc_id2flows() == {'COM1': [1800, 1800, 1980, 1800],
+        'COM2': [200, 200, 200, 20]
+    }
+
+    constant = FlowSetpoints(flows.id_type, flows.mfc_ids, flows.sccm[:2])
+    assert constant.are_constant()
+
+
+def test_flow_setpoints_validation():
+    def setpoints(sccm_a, sccm_b):
+        return [{'address': 'A', 'sccm': sccm_a}, {'address': 'B', 'sccm': sccm_b}]
+
+    flows = validation.validate_flow_setpoints_sequence(
+        [setpoints(1800, 200), setpoints(1980.0, 20)]
+    )
+    assert flows.sccm.dtype == float
+
+    with pytest.raises(ValueError, match='non-negative'):
+        validation.validate_flow_setpoints_sequence([setpoints(1800, 200),
+            setpoints(2000, -1)
+        ])
+
+    with pytest.raises(ValueError, match="trial 2 missing: {'B'}"):
+        validation.validate_flow_setpoints_sequence([setpoints(1800, 200),
+            setpoints(1800, 200)[:1]
+        ])
+
+    with pytest.raises(ValueError, match='either ports or addresses'):
+        validation.validate_flow_setpoints_sequence([setpoints(1800, 200),
+            [{'port': 'COM1', 'sccm': 1.0}, {'address': 'B', 'sccm': 1.0}]
+        ])
+
+    with pytest.warns(UserWarning, match='setpoint sum'):
+        validation.validate_flow_setpoints_sequence([setpoints(1800, 200),
+            setpoints(1800, 100)
+        ])
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os
+from os.path import join
+import re
+
+import pytest
+
+from olfactometer import upload
+
+
+fqbn = 'arduino:avr:mega'
+port = '/dev/ttyACM0'
+
+
+class FakePopen:
+    """Records commands, and writes compiled firmware to any --output-dir.
+    """
+    cmds = []
+
+    def __init__(self, cmd, shell=False, **kwargs):
+        FakePopen.cmds.append(cmd)
+        self.returncode = 0
+
+        match = re.search(r'--output-dir (\S+)', cmd)
+        if match is not None:
+            with open(join(match.group(1), 'olfactometer.ino.hex'), 'w') as f:
+                f.write(':00000001FF\n')
+
+    def communicate(self):
+        return None, None
+
+
+@pytest.fixture
+def fake_toolchain(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, 'get_port_and_fqbn',
+        lambda port=None, fqbn=None, will_upload=True: (port, fqbn)
+    )
+    monkeypatch.setattr(upload, 'toolchain_version', lambda fqbn: 'arduino-cli 0.32')
+    monkeypatch.setattr(upload, 'version_str', lambda: 'v0')
+    monkeypatch.setattr(upload, '_nanopb_generator_version', lambda: '0.4.7')
+    monkeypatch.setattr(upload, 'Popen', FakePopen)
+    FakePopen.cmds = []
+
+    sketch_dir = tmp_path / 'olfactometer'
+    sketch_dir.mkdir()
+    (sketch_dir / 'olfactometer.ino').write_text('void setup() {}\n')
+    lib_dir = tmp_path / 'libraries'
+    lib_dir.mkdir()
+    return str(sketch_dir), str(lib_dir)
+
+
+def test_firmware_cache_key(tmp_path):
+    sketch_dir = tmp_path / 'olfactometer'
+    sketch_dir.mkdir()
+    ino = sketch_dir / 'olfactometer.ino'
+    ino.write_text('a')
+    lib_dir = tmp_path / 'libraries'
+    lib_dir.mkdir()
+
+    def key(fqbn=fqbn, extra_flags='', toolchain='0.32'):
+        return upload.firmware_cache_key(sketch_dir, lib_dir, fqbn, extra_flags,
+            toolchain
+        )
+
+    k0 = key()
+    assert key() == k0
+    assert key(fqbn='arduino:avr:uno') != k0
+    assert key(extra_flags='-DDEBUG_PRINTS') != k0
+    assert key(toolchain='0.33') != k0
+
+    ino.write_text('b')
+    assert key() != k0
+
+    ino.write_text('a')
+    (lib_dir / 'pb.h').write_text('')
+    assert key() != k0
+
+
+def test_nanopb_cache_hit(tmp_path, fake_toolchain):
+    sketch_dir, _ = fake_toolchain
+
+    cache_key = upload.nanopb_cache_key()
+    cached_dir = upload.build_cache_dir() / 'nanopb' / cache_key
+    cached_dir.mkdir(parents=True)
+    (cached_dir / 'olf.pb.h').write_text('h')
+    (cached_dir / 'olf.pb.c').write_text('c')
+
+    upload.generate_nanopb_code(sketch_dir)
+
+    # Generator not run.
+    assert FakePopen.cmds == []
+    assert open(join(sketch_dir, 'olf.pb.h')).read() == 'h'
+    assert open(join(sketch_dir, 'olf.pb.c')).read() == 'c'
+
+
+def test_firmware_cache(fake_toolchain):
+    sketch_dir, lib_dir = fake_toolchain
+
+    upload.upload(sketch_dir, lib_dir, fqbn=fqbn, port=port)
+    assert len(FakePopen.cmds) == 1
+    assert FakePopen.cmds[0].startswith('arduino-cli compile')
+    assert f'-u -t -p {port}' in FakePopen.cmds[0]
+
+    firmware_dirs = [x for x in (upload.build_cache_dir() / 'firmware').iterdir()]
+    assert len(firmware_dirs) == 1
+    assert (firmware_dirs[0] / 'olfactometer.ino.hex').exists()
+
+    # Cache hit: only flashing.
+    upload.upload(sketch_dir, lib_dir, fqbn=fqbn, port=port)
+    assert len(FakePopen.cmds) == 2
+    assert FakePopen.cmds[1] == (f'arduino-cli upload -b {fqbn} -p {port} -t '
+        f'--input-dir {firmware_dirs[0]}'
+    )
+
+    # Nothing to flash on a dry run.
+    upload.upload(sketch_dir, lib_dir, fqbn=fqbn, port=port, dry_run=True)
+    assert len(FakePopen.cmds) == 2
+
+    # Different flags compile a new build.
+    upload.upload(sketch_dir, lib_dir, fqbn=fqbn, port=port, arduino_debug_prints=True)
+    assert FakePopen.cmds[-1].startswith('arduino-cli compile')
+    assert len(list((upload.build_cache_dir() / 'firmware').iterdir())) == 2
+
+    upload.upload(sketch_dir, lib_dir, fqbn=fqbn, port=port, use_cache=False)
+    assert FakePopen.cmds[-1].startswith('arduino-cli compile')
+    assert '--output-dir' not in FakePopen.cmds[-1]
+
+
+def test_prune_firmware_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, 'max_cached_firmware', 2)
+    for i in range(4):
+        build = tmp_path / str(i)
+        build.mkdir()
+        os.utime(build, (i, i))
+
+    in_progress = tmp_path / '.tmp'
+    in_progress.mkdir()
+
+    upload._prune_firmware_cache(tmp_path)
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['.tmp', '2', '3']
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import random
+
+import pytest
+
+from olfactometer import config_io, validation
+
+
+def per_group_error(pin_sequence):
+    """Returns index and error of first group failing (non-vectorized) checks.
+
+    Returns (None, None) if no group fails them.
+    """
+    for i, pin_group in enumerate(pin_sequence.pin_groups):
+        try:
+            validation.validate_pin_group(pin_group)
+        except ValueError as err:
+            return i, err
+    return None, None
+
+
+def error_kind(err):
+    """Returns message of err, without trial prefix or offending pins.
+    """
+    msg = str(err)
+    if msg.startswith('trial '):
+        msg = msg.split(': ', 1)[1]
+    return msg.split(':')[0]
+
+
+def test_schema():
+    schema = validation.get_schema()
+    assert schema is validation.get_schema()
+    assert schema.max_pin_groups == validation.max_count('PinSequence.pin_groups')
+    assert schema.max_pins_per_group == validation.max_count('PinGroup.pins')
+
+    with pytest.raises(ValueError):
+        validation.max_count('NotAField.pins')
+
+
+def test_pin_sequence_arrays(make_pin_sequence):
+    pins, group_sizes = validation.pin_sequence_arrays(
+        make_pin_sequence([[2, 3], [4], [5, 6, 7]])
+    )
+    assert pins.tolist() == [2, 3, 4, 5, 6, 7]
+    assert group_sizes.tolist() == [2, 1, 3]
+
+
+@pytest.mark.parametrize('bad_pins,msg', [
+    ([], 'should not be empty'),
+    ([2, 3, 4, 5, 6, 7, 8], 'PinGroup has 7 pins'),
+    ([5, 9, 5], 'duplicate pins'),
+    ([1, 4], 'reserved'),
+    ([54], '>53'),
+])
+def test_invalid_group_reports_trial(bad_pins, msg, make_pin_sequence):
+    pin_lists = [[2, 3]] * 10
+    pin_lists[6] = bad_pins
+    with pytest.raises(ValueError, match=f'^trial 7 \\(pin_groups\\[6\\]\\).*{msg}'):
+        validation.validate_pin_sequence(make_pin_sequence(pin_lists))
+
+
+def test_same_pin_across_trials(monkeypatch, make_pin_sequence):
+    import numpy as np
+
+    # As on platforms where NumPy's default int is 32 bits.
+    pin_sequence_arrays = validation.pin_sequence_arrays
+    def int32_pin_sequence_arrays(pin_sequence):
+        pins, group_sizes = pin_sequence_arrays(pin_sequence)
+        return pins.astype(np.int32), group_sizes.astype(np.int32)
+
+    monkeypatch.setattr(validation, 'pin_sequence_arrays', int32_pin_sequence_arrays)
+
+    validation.validate_pin_sequence(make_pin_sequence([[2, 3], [2, 3], [3]]))
+    with pytest.raises(ValueError, match='^trial 3 .*duplicate pins'):
+        validation.validate_pin_sequence(make_pin_sequence([[2, 3], [2, 3], [3, 3]]))
+
+
+def test_matches_per_group_checks(make_pin_sequence):
+    rng = random.Random(0)
+    mc = validation.get_schema().max_pin_groups
+    for _ in range(300):
+        pin_lists = [
+            [rng.randint(0, 56) for _ in range(rng.choice([0, 1, 2, 3, 6, 7]))]
+            if rng.random() < 0.02 else rng.sample(range(2, 54), rng.randint(1, 6))
+            for _ in range(rng.randint(1, mc))
+        ]
+        pin_sequence = make_pin_sequence(pin_lists)
+        expected_bad_group, expected_err = per_group_error(pin_sequence)
+
+        if expected_bad_group is None:
+            validation.validate_pin_sequence(pin_sequence)
+        else:
+            with pytest.raises(ValueError,
+                match=f'^trial {expected_bad_group + 1} ') as excinfo:
+                validation.validate_pin_sequence(pin_sequence)
+
+            assert error_kind(excinfo.value) == error_kind(expected_err)
+
+
+def test_sequence_length_limit(make_pin_sequence):
+    mc = validation.get_schema().max_pin_groups
+    validation.validate_pin_sequence(make_pin_sequence([[2]] * mc))
+    with pytest.raises(ValueError, match='longer than maximum'):
+        validation.validate_pin_sequence(make_pin_sequence([[2]] * (mc + 1)))
+
+    with pytest.raises(ValueError, match='should not be empty'):
+        validation.validate_pin_sequence(make_pin_sequence([]))
+
+
+def test_validate_protobuf_checks_groups():
+    config = {
+        'settings': {'timing': {'pre_pulse_us': 1, 'pulse_us': 1, 'post_pulse_us': 1}},
+        'pin_sequence': {'pin_groups': [{'pins': [2, 3]}, {'pins': [4, 4]}]},
+    }
+    all_required_data, _ = config_io.load_dict(config)
+    with pytest.raises(ValueError, match='^trial 2 .*duplicate'):
+        validation.validate_protobuf(all_required_data)
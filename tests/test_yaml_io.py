@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+from copy import deepcopy
+
+import pytest
+import yaml
+
+from olfactometer import config_io, persist
+
+
+class _PurePythonNoAliasDumper(yaml.Dumper):
+    def ignore_aliases(self, data):
+        return True
+
+
+def test_write_yaml_output_unchanged(tmp_path, make_generated_config):
+    generated_config = make_generated_config(n_trials=200)
+
+    yaml_fname = tmp_path / 'generated.yaml'
+    config_io.write_yaml(generated_config, yaml_fname)
+    persist.wait_for(yaml_fname)
+    with open(yaml_fname, 'r') as f:
+        written = f.read()
+
+    # What write_yaml used to do (besides monkeypatching yaml.Dumper globally).
+    generated_config['pins2odors'] = dict(
+        sorted(generated_config['pins2odors'].items(), key=lambda x: x[0])
+    )
+    expected = yaml.dump(generated_config, Dumper=_PurePythonNoAliasDumper,
+        default_flow_style=False, sort_keys=False
+    )
+    assert written == expected
+    assert '&id' not in written
+
+    with open(yaml_fname, 'r') as f:
+        assert config_io.safe_load_yaml(f) == yaml.safe_load(written)
+
+
+def test_write_yaml_generator_values(tmp_path, monkeypatch, make_generated_config):
+    np = pytest.importorskip('numpy')
+
+    generated_config = make_generated_config(n_trials=3)
+    expected = deepcopy(generated_config)
+
+    pin_groups = generated_config['pin_sequence']['pin_groups']
+    pin_groups[0]['pins'] = tuple(pin_groups[0]['pins'])
+    pin_groups[1]['pins'] = np.array(pin_groups[1]['pins'])
+    pin_groups[2]['pins'] = [np.int64(p) for p in pin_groups[2]['pins']]
+    generated_config['settings']['balance_pin'] = np.int32(50)
+    generated_config['flow_setpoints_sequence'][0] = [
+        dict(x, sccm=np.float64(x['sccm']))
+        for x in generated_config['flow_setpoints_sequence'][0]
+    ]
+    for config in (generated_config, expected):
+        config['pins2odors'][2] = dict(config['pins2odors'][2], name='α-pinène')
+
+    yaml_fname = tmp_path / 'generated.yaml'
+    yaml_str = config_io.write_yaml(generated_config, yaml_fname)
+    assert '!!' not in yaml_str
+
+    persist.wait_for(yaml_fname)
+    with open(yaml_fname, 'r') as f:
+        assert config_io.safe_load_yaml(f) == expected
+
+    all_required_data, _ = config_io.load(str(yaml_fname))
+    assert list(all_required_data.pin_sequence.pin_groups[1].pins) == (
+        expected['pin_sequence']['pin_groups'][1]['pins']
+    )
+
+    # Also to the sidecar, which is built from the config rather than the YAML.
+    monkeypatch.chdir(tmp_path)
+    config_path = config_io.write_timestamped_config(generated_config, verbose=False)
+    assert config_io.load(config_path)[1] == expected
+
+    with pytest.raises(yaml.representer.RepresenterError):
+        config_io.write_yaml(dict(expected, odors=object()), tmp_path / 'bad.yaml')